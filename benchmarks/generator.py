@@ -0,0 +1,144 @@
+import os
+import math
+import random
+from dataclasses import dataclass
+
+from modules.cvs import CVS
+from modules.cvs_objects import TreeObjectData, Blob
+from modules.references import Branch, Head
+
+FEATURE_BRANCH = 'feature'
+# subdirectories of every directory of the generated working tree
+DIRECTORY_FANOUT = 4
+# random bytes of every line, they are written as hex text
+LINE_BYTES = 32
+
+
+@dataclass
+class RepositoryShape:
+    '''Parameters of a generated repository, the same shape and seed give the same repository'''
+    files: int = 1000
+    # levels of directories below the repository root
+    depth: int = 3
+    # file sizes are log-uniformly distributed between these bounds
+    min_file_size: int = 256
+    max_file_size: int = 64 * 1024
+    # commits on master, the first one adds every file
+    commits: int = 20
+    # files changed by every following commit
+    changed_files: int = 10
+    # commits made on the feature branch and on master after the feature branch forks
+    divergence: int = 5
+    seed: int = 0
+
+
+class RepositoryGenerator:
+    '''Write a working tree and its history into a directory'''
+    def __init__(self, path: str, shape: RepositoryShape):
+        self.path = path
+        self.shape = shape
+        self.files: list[str] = []
+        self._random = random.Random(shape.seed)
+
+    def write_working_tree(self):
+        '''Create the directories and the files of the first commit'''
+        directories = self._generate_directories()
+        for directory in directories:
+            os.makedirs(directory, exist_ok=True)
+        self.files = [os.path.join(directories[i % len(directories)], f'file{i}.txt') for i in range(self.shape.files)]
+        for path in self.files:
+            self._write_file(path, self._generate_lines(self._generate_size()))
+
+    def modify_files(self, files: list[str]):
+        '''Replace a random line of every file'''
+        for path in files:
+            with open(path, 'rb') as f:
+                lines = f.read().splitlines(keepends=True)
+            lines[self._random.randrange(len(lines))] = self._generate_lines(1)[0]
+            self._write_file(path, lines)
+
+    def choose_files(self, files: list[str]) -> list[str]:
+        return self._random.sample(files, min(self.shape.changed_files, len(files)))
+
+    def build_history(self, cvs: CVS, commit=None):
+        '''Commit the working tree and the following changes with commit(cvs, message), leave head on master'''
+        commit = commit or commit_changes
+        commit(cvs, 'initial')
+        fork = self.shape.commits - self.shape.divergence
+        for i in range(1, self.shape.commits):
+            if i == fork:
+                self.create_feature_branch(cvs, commit)
+            self.modify_files(self.choose_files(self._get_master_files()))
+            commit(cvs, f'commit {i}')
+        if fork <= 0:
+            self.create_feature_branch(cvs, commit)
+
+    def create_feature_branch(self, cvs: CVS, commit=None):
+        '''Fork the feature branch from head, commit the divergent changes there and return to master'''
+        commit = commit or commit_changes
+        cvs.store_branch(Branch(FEATURE_BRANCH, cvs.get_commit_from_head()))
+        switch_branch(cvs, FEATURE_BRANCH)
+        for i in range(self.shape.divergence):
+            self.modify_files(self.choose_files(self._get_feature_files()))
+            commit(cvs, f'feature {i}')
+        switch_branch(cvs, 'master')
+
+    def _get_master_files(self) -> list[str]:
+        # both branches change their own half of the files, so the rebase has no conflicts
+        return self.files[len(self.files) // 2:] or self.files
+
+    def _get_feature_files(self) -> list[str]:
+        return self.files[:len(self.files) // 2] or self.files
+
+    def _generate_directories(self) -> list[str]:
+        directories = [self.path]
+        level = [self.path]
+        for _ in range(self.shape.depth):
+            level = [os.path.join(parent, f'dir{i}') for parent in level for i in range(DIRECTORY_FANOUT)]
+            directories.extend(level)
+
+        return directories
+
+    def _generate_size(self) -> int:
+        low = math.log(max(self.shape.min_file_size, 1))
+        high = math.log(max(self.shape.max_file_size, self.shape.min_file_size, 1))
+
+        return int(math.exp(self._random.uniform(low, high)))
+
+    def _generate_lines(self, size: int) -> list[bytes]:
+        count = max(size // (LINE_BYTES * 2 + 1), 1)
+        return [self._random.randbytes(LINE_BYTES).hex().encode() + b'\n' for _ in range(count)]
+
+    @staticmethod
+    def _write_file(path: str, lines: list[bytes]):
+        with open(path, 'wb') as f:
+            f.write(b''.join(lines))
+
+
+def stage_changes(cvs: CVS):
+    '''Stage every new and modified file'''
+    cvs.update_index()
+    for data in (*cvs.index.new, *cvs.index.modified):
+        cvs.add_to_staged(TreeObjectData(data.path, Blob))
+
+
+def commit_changes(cvs: CVS, message: str):
+    stage_changes(cvs)
+    cvs.make_commit(message)
+
+
+def switch_branch(cvs: CVS, branch_name: str):
+    cvs.head = Head(cvs.get_branch_by_name(branch_name))
+    cvs.store_head()
+    cvs.restore_repository_state(cvs.get_commit_from_head())
+
+
+def generate_repository(path: str, shape: RepositoryShape) -> CVS:
+    '''Create a repository with the whole history in the directory'''
+    generator = RepositoryGenerator(path, shape)
+    generator.write_working_tree()
+    cvs = CVS(path)
+    cvs.initialize_repository()
+    generator.build_history(cvs)
+
+    return cvs
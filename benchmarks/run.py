@@ -0,0 +1,151 @@
+import argparse
+import dataclasses
+import json
+import os
+import platform
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+
+from modules.cvs import CVS
+from benchmarks.generator import RepositoryShape, RepositoryGenerator, FEATURE_BRANCH, stage_changes
+
+OPERATIONS = ('initialize_repository', 'update_index', 'make_commit_initial', 'make_commit', 'log',
+              'restore_repository_state', 'initialize_rebase_state', 'rebase')
+# a median slower than the baseline by more than this part is reported as a regression
+DEFAULT_THRESHOLD = 0.2
+
+
+class Timer:
+    '''Collect durations of operations, in seconds'''
+    def __init__(self):
+        self.durations: dict[str, list[float]] = {}
+
+    def measure(self, operation: str, function, *args):
+        start = time.perf_counter()
+        result = function(*args)
+        self.durations.setdefault(operation, []).append(time.perf_counter() - start)
+
+        return result
+
+
+def run_once(directory: str, shape: RepositoryShape) -> dict[str, float]:
+    '''Generate a repository in the empty directory timing each operation, return durations by operation'''
+    timer = Timer()
+    generator = RepositoryGenerator(directory, shape)
+    generator.write_working_tree()
+    cvs = CVS(directory)
+    timer.measure('initialize_repository', cvs.initialize_repository)
+
+    def commit(cvs: CVS, message: str):
+        stage_changes(cvs)
+        operation = 'make_commit_initial' if 'make_commit_initial' not in timer.durations else 'make_commit'
+        timer.measure(operation, cvs.make_commit, message)
+
+    generator.build_history(cvs, commit)
+
+    # a new instance reads the index and the commits from disk like a new shell session
+    cvs = CVS(directory)
+    cvs.initialize_repository()
+    timer.measure('update_index', cvs.update_index)
+    head = cvs.get_commit_from_head()
+    history = timer.measure('log', lambda: list(cvs.enumerate_commit_parents(head, return_itself=True)))
+
+    timer.measure('restore_repository_state', cvs.restore_repository_state, history[-1])
+    cvs.restore_repository_state(head)
+
+    timer.measure('initialize_rebase_state', cvs.initialize_rebase_state, cvs.get_branch_by_name(FEATURE_BRANCH))
+    state = timer.measure('rebase', cvs.rebase)
+    if state.is_conflict:
+        raise RuntimeError('generated branches conflict')
+
+    return {operation: sum(durations) / len(durations) for operation, durations in timer.durations.items()}
+
+
+def run_benchmarks(shape: RepositoryShape, repeat: int = 3, directory: str = None) -> dict:
+    '''Run every operation on repeat freshly generated repositories, return a report suitable for JSON'''
+    runs: dict[str, list[float]] = {operation: [] for operation in OPERATIONS}
+    for _ in range(repeat):
+        with tempfile.TemporaryDirectory(prefix='cvs_benchmark_', dir=directory) as path:
+            for operation, duration in run_once(os.path.realpath(path), shape).items():
+                runs[operation].append(duration)
+
+    return {
+        'revision': get_revision(),
+        'python': platform.python_version(),
+        'platform': platform.platform(),
+        'shape': dataclasses.asdict(shape),
+        'repeat': repeat,
+        'results': {operation: {'min': min(durations),
+                                'median': statistics.median(durations),
+                                'runs': durations}
+                    for operation, durations in runs.items() if durations},
+    }
+
+
+def compare(report: dict, baseline: dict, threshold: float = DEFAULT_THRESHOLD) -> dict[str, float]:
+    '''Return operations slower than in the baseline by more than the threshold with their slowdown'''
+    regressions = {}
+    for operation, result in report['results'].items():
+        previous = baseline['results'].get(operation)
+        if not previous or not previous['median']:
+            continue
+        ratio = result['median'] / previous['median']
+        if ratio > 1 + threshold:
+            regressions[operation] = ratio
+
+    return regressions
+
+
+def get_revision():
+    '''Return the commit of the benchmarked sources or None outside of a git checkout'''
+    try:
+        output = subprocess.run(['git', 'rev-parse', 'HEAD'], cwd=os.path.dirname(os.path.abspath(__file__)),
+                                capture_output=True, check=True)
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+    return output.stdout.decode().strip()
+
+
+def parse_arguments(arguments=None) -> argparse.Namespace:
+    parser = argparse.ArgumentParser(description='Time repository operations on a generated repository')
+    for field in dataclasses.fields(RepositoryShape):
+        parser.add_argument('--' + field.name.replace('_', '-'), type=int, default=field.default)
+    parser.add_argument('--repeat', type=int, default=3, help='number of generated repositories')
+    parser.add_argument('--directory', help='where repositories are generated, the temporary directory by default')
+    parser.add_argument('--output', help='write the JSON report to this file instead of stdout')
+    parser.add_argument('--baseline', help='JSON report of a previous run to compare with')
+    parser.add_argument('--threshold', type=float, default=DEFAULT_THRESHOLD,
+                        help='allowed slowdown of the median against the baseline')
+
+    return parser.parse_args(arguments)
+
+
+def main(arguments=None) -> int:
+    arguments = parse_arguments(arguments)
+    shape = RepositoryShape(**{field.name: getattr(arguments, field.name)
+                               for field in dataclasses.fields(RepositoryShape)})
+    report = run_benchmarks(shape, arguments.repeat, arguments.directory)
+
+    content = json.dumps(report, indent=2)
+    if arguments.output:
+        with open(arguments.output, 'w') as f:
+            f.write(content + '\n')
+    else:
+        print(content)
+
+    if not arguments.baseline:
+        return 0
+    with open(arguments.baseline) as f:
+        regressions = compare(report, json.load(f), arguments.threshold)
+    for operation, ratio in regressions.items():
+        print(f'{operation} is {ratio:.2f} times slower than the baseline', file=sys.stderr)
+
+    return 1 if regressions else 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
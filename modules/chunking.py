@@ -0,0 +1,46 @@
+import hashlib
+
+# chunk boundaries depend only on the content, so an edit changes only the chunks around it
+MIN_CHUNK_SIZE = 16 * 1024
+MAX_CHUNK_SIZE = 256 * 1024
+# a boundary is put where the rolling hash has these bits unset, about once in 32 KiB after the minimum
+_BOUNDARY_MASK = ((1 << 15) - 1) << 17
+# the 32-bit gear hash depends only on the last 32 bytes
+_WINDOW = 32
+_GEAR = [int.from_bytes(hashlib.sha256(bytes([byte])).digest()[:4], 'big') for byte in range(256)]
+
+
+def find_boundary(data, start=0) -> int:
+    '''Return the end of the chunk beginning at start'''
+    end = min(len(data), start + MAX_CHUNK_SIZE)
+    if end - start <= MIN_CHUNK_SIZE:
+        return end
+
+    gear = _GEAR
+    mask = _BOUNDARY_MASK
+    rolling_hash = 0
+    window_start = start + MIN_CHUNK_SIZE - _WINDOW
+    for position, byte in enumerate(data[window_start:end], window_start + 1):
+        rolling_hash = (rolling_hash + rolling_hash + gear[byte]) & 0xFFFFFFFF
+        if not rolling_hash & mask:
+            return position
+
+    return end
+
+
+def iterate_stream_chunks(stream, read_size=1 << 20):
+    '''Yield content-defined chunks of a binary stream, they are the same as chunks of the whole content'''
+    buffer = b''
+    while True:
+        data = stream.read(read_size)
+        buffer += data
+        start = 0
+        # a boundary is final once the buffer holds the longest chunk after the start or the stream ended
+        while len(buffer) - start >= MAX_CHUNK_SIZE or not data and start < len(buffer):
+            end = find_boundary(buffer, start)
+            yield buffer[start:end]
+            start = end
+        buffer = buffer[start:]
+        if not data:
+            return
+
@@ -0,0 +1,108 @@
+import os
+import struct
+
+from modules import instrumentation
+
+GRAPH_SIGNATURE = b'CVSG'
+GRAPH_VERSION = 1
+NO_PARENT = 0xFFFFFFFF
+
+_HEADER = struct.Struct('>4sB')
+# commit hash, index of the parent record, generation number, tree hash kept for readers of the format
+_RECORD = struct.Struct('>20sII20s')
+
+
+class CommitGraph:
+    '''Append-only file of fixed-width commit records, allows history walks without reading commits'''
+    def __init__(self, path: str):
+        self.path = path
+        self.hashes: list[bytes] = []
+        self.parents: list[int] = []
+        self.generations: list[int] = []
+        self._positions: dict[bytes, int] = {}
+        self._loaded_size = 0
+
+    def load(self):
+        try:
+            with open(self.path, 'rb') as f:
+                content = f.read()
+        except FileNotFoundError:
+            return
+        if not content:
+            return
+        signature, version = _HEADER.unpack_from(content, 0)
+        if signature != GRAPH_SIGNATURE or version != GRAPH_VERSION:
+            raise ValueError(f'unsupported commit graph: {self.path}')
+
+        offset = max(self._loaded_size, _HEADER.size)
+        # a record could be partially written by an interrupted process
+        end = offset + (len(content) - offset) // _RECORD.size * _RECORD.size
+        for commit_hash, parent, generation, _ in _RECORD.iter_unpack(content[offset:end]):
+            self._append(commit_hash, parent, generation)
+        self._loaded_size = end
+
+    def contains(self, commit_hash: bytes) -> bool:
+        if commit_hash in self._positions:
+            return True
+        self._reload_if_changed()
+
+        return commit_hash in self._positions
+
+    def add(self, commit_hash: bytes, parent_hash: bytes, tree_hash: bytes):
+        '''Append a commit, its parent has to be in the graph already'''
+        if self.contains(commit_hash):
+            return
+        if parent_hash:
+            parent = self._positions[parent_hash]
+            generation = self.generations[parent] + 1
+        else:
+            parent = NO_PARENT
+            generation = 1
+
+        record = _RECORD.pack(commit_hash, parent, generation, tree_hash)
+        with open(self.path, 'ab') as f:
+            if f.tell() == 0:
+                f.write(_HEADER.pack(GRAPH_SIGNATURE, GRAPH_VERSION))
+            elif f.tell() != max(self._loaded_size, _HEADER.size):
+                # drop a partially written record of an interrupted process
+                f.truncate(max(self._loaded_size, _HEADER.size))
+            f.write(record)
+            self._loaded_size = f.tell()
+        self._append(commit_hash, parent, generation)
+
+    def get_parent(self, commit_hash: bytes) -> bytes:
+        '''Return the parent hash or b'' for the root commit'''
+        parent = self.parents[self._positions[commit_hash]]
+        if parent == NO_PARENT:
+            return b''
+
+        return self.hashes[parent]
+
+    def get_generation(self, commit_hash: bytes) -> int:
+        return self.generations[self._positions[commit_hash]]
+
+    def enumerate_ancestors(self, commit_hash: bytes):
+        '''Yield the commit and all its ancestors down to the root'''
+        instrumentation.count('commit_graph.ancestor_walks')
+        position = self._positions[commit_hash]
+        while position != NO_PARENT:
+            instrumentation.count('commit_graph.ancestors')
+            yield self.hashes[position]
+            position = self.parents[position]
+
+    def __len__(self):
+        return len(self.hashes)
+
+    def _append(self, commit_hash: bytes, parent: int, generation: int):
+        self._positions[commit_hash] = len(self.hashes)
+        self.hashes.append(commit_hash)
+        self.parents.append(parent)
+        self.generations.append(generation)
+
+    def _reload_if_changed(self):
+        try:
+            size = os.path.getsize(self.path)
+        except FileNotFoundError:
+            return
+        if size >= self._loaded_size + _RECORD.size:
+            self.load()
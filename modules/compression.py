@@ -0,0 +1,214 @@
+import bz2
+import lzma
+import zlib
+
+# stored objects start with this marker followed by the codec identifier,
+# raw pickles written by older versions start with the pickle opcode 0x80
+ENCODED_OBJECT_MARKER = b'\0'
+DEFAULT_CODEC = 'zlib'
+
+
+class Codec:
+    '''Stdlib compression algorithm used to store objects'''
+    name = ''
+    identifier = b''
+
+    def compress(self, data: bytes) -> bytes:
+        compressor = self.compressobj()
+        return compressor.compress(data) + compressor.flush()
+
+    def decompress(self, data: bytes) -> bytes:
+        decompressor = self.decompressobj()
+        return decompressor.decompress(data) + decompressor.flush()
+
+    def compressobj(self):
+        raise NotImplementedError
+
+    def decompressobj(self):
+        raise NotImplementedError
+
+    def decompress_stream(self, chunks, chunk_size: int):
+        '''Decompress an iterable of chunks, yielding at most chunk_size bytes at a time'''
+        decompressor = self.decompressobj()
+        for chunk in chunks:
+            yield from _drain(decompressor, chunk, chunk_size)
+        while not decompressor.eof:
+            data = decompressor.decompress(b'', chunk_size)
+            if not data:
+                break
+            yield data
+
+
+def _drain(decompressor, chunk: bytes, chunk_size: int):
+    data = decompressor.decompress(chunk, chunk_size)
+    while data:
+        yield data
+        if decompressor.eof:
+            return
+        data = decompressor.decompress(b'', chunk_size)
+
+
+class _IdentityStream:
+    def compress(self, data: bytes) -> bytes:
+        return bytes(data)
+
+    def decompress(self, data: bytes) -> bytes:
+        return bytes(data)
+
+    def flush(self) -> bytes:
+        return b''
+
+
+class _Decompressor:
+    '''Gives lzma and bz2 decompressors the zlib-like flush method'''
+    def __init__(self, decompressor):
+        self._decompressor = decompressor
+
+    @property
+    def eof(self) -> bool:
+        return self._decompressor.eof
+
+    def decompress(self, data: bytes, max_length=-1) -> bytes:
+        return self._decompressor.decompress(data, max_length)
+
+    def flush(self) -> bytes:
+        return b''
+
+
+class NoneCodec(Codec):
+    name = 'none'
+    identifier = b'n'
+
+    def compress(self, data: bytes) -> bytes:
+        return bytes(data)
+
+    def decompress(self, data: bytes) -> bytes:
+        return bytes(data)
+
+    def compressobj(self):
+        return _IdentityStream()
+
+    def decompressobj(self):
+        return _IdentityStream()
+
+    def decompress_stream(self, chunks, chunk_size: int):
+        yield from chunks
+
+
+class ZlibCodec(Codec):
+    name = 'zlib'
+    identifier = b'z'
+
+    def __init__(self, level=6):
+        self.level = level
+
+    def compress(self, data: bytes) -> bytes:
+        return zlib.compress(data, self.level)
+
+    def decompress(self, data: bytes) -> bytes:
+        return zlib.decompress(data)
+
+    def compressobj(self):
+        return zlib.compressobj(self.level)
+
+    def decompressobj(self):
+        return zlib.decompressobj()
+
+    def decompress_stream(self, chunks, chunk_size: int):
+        decompressor = zlib.decompressobj()
+        for chunk in chunks:
+            data = decompressor.decompress(chunk, chunk_size)
+            while data:
+                yield data
+                data = decompressor.decompress(decompressor.unconsumed_tail, chunk_size)
+        data = decompressor.flush()
+        if data:
+            yield data
+
+
+class LzmaCodec(Codec):
+    name = 'lzma'
+    identifier = b'x'
+
+    def compress(self, data: bytes) -> bytes:
+        return lzma.compress(data)
+
+    def decompress(self, data: bytes) -> bytes:
+        return lzma.decompress(data)
+
+    def compressobj(self):
+        return lzma.LZMACompressor()
+
+    def decompressobj(self):
+        return _Decompressor(lzma.LZMADecompressor())
+
+
+class Bz2Codec(Codec):
+    name = 'bz2'
+    identifier = b'b'
+
+    def compress(self, data: bytes) -> bytes:
+        return bz2.compress(data)
+
+    def decompress(self, data: bytes) -> bytes:
+        return bz2.decompress(data)
+
+    def compressobj(self):
+        return bz2.BZ2Compressor()
+
+    def decompressobj(self):
+        return _Decompressor(bz2.BZ2Decompressor())
+
+
+_codecs_by_name: dict[str, Codec] = {}
+_codecs_by_identifier: dict[bytes, Codec] = {}
+
+
+def register_codec(codec: Codec):
+    if len(codec.identifier) != 1:
+        raise ValueError('codec identifier must be a single byte')
+    _codecs_by_name[codec.name] = codec
+    _codecs_by_identifier[codec.identifier] = codec
+
+
+def get_codec(name: str) -> Codec:
+    try:
+        return _codecs_by_name[name]
+    except KeyError:
+        raise ValueError(f'unknown compression codec: {name}') from None
+
+
+def get_codec_by_identifier(identifier: bytes) -> Codec:
+    try:
+        return _codecs_by_identifier[identifier]
+    except KeyError:
+        raise ValueError(f'unknown compression codec identifier: {identifier!r}') from None
+
+
+def get_codecs_names() -> list[str]:
+    return list(_codecs_by_name)
+
+
+def encode(content: bytes, codec: Codec) -> bytes:
+    return ENCODED_OBJECT_MARKER + codec.identifier + codec.compress(content)
+
+
+def decode(content: bytes) -> bytes:
+    if content[:1] != ENCODED_OBJECT_MARKER:
+        # stored by a version without compression
+        return bytes(content)
+    codec = get_codec_by_identifier(bytes(content[1:2]))
+
+    return codec.decompress(content[2:])
+
+
+def get_stored_codec(content: bytes):
+    '''Return the codec of an encoded object or None for a raw one'''
+    if content[:1] != ENCODED_OBJECT_MARKER:
+        return None
+
+    return get_codec_by_identifier(bytes(content[1:2]))
+
+
+for _codec in (NoneCodec(), ZlibCodec(), LzmaCodec(), Bz2Codec()):
+    register_codec(_codec)
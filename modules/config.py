@@ -0,0 +1,127 @@
+import configparser
+import os
+
+from modules.folders_enum import FoldersEnum
+
+DEFAULTS = {
+    'core': {
+        'compression': 'zlib',
+        # threads used to hash and store files, 0 means one per cpu
+        'workers': '0',
+    },
+    'checkpoint': {
+        # full tree state is stored once expanding a commit walks this many commits
+        'interval': '100',
+    },
+    'checkout': {
+        # threads used to write files during checkout, 0 means one per cpu
+        'workers': '0',
+    },
+    'cache': {
+        # memory budget of decoded objects in bytes
+        'size': str(64 * 1024 * 1024),
+    },
+    'delta': {
+        # longest chain of deltas to reconstruct an object, 0 disables deltas
+        'depth': '10',
+        # smaller blobs are always stored whole
+        'min_size': str(64 * 1024),
+        # larger blobs are stored whole too, building a delta holds both versions in memory
+        'max_size': str(16 * 1024 * 1024),
+        # build deltas of changed files when committing, repack builds them for the whole history anyway
+        'on_commit': 'yes',
+    },
+    'monitor': {
+        # watch the working tree with inotify in the shell, only on Linux
+        'enabled': 'no',
+    },
+    'chunking': {
+        # files of at least this size are stored as content-defined chunks, 0 disables chunking
+        'min_size': '0',
+    },
+    'gc': {
+        # unreachable objects stored less than this many seconds ago are kept, an operation could still use them
+        'grace_period': str(14 * 24 * 60 * 60),
+    },
+}
+
+
+class RepositoryConfig:
+    '''Repository settings stored in cool_cvs/config'''
+    def __init__(self, path_to_repository: str):
+        self.path = os.path.join(path_to_repository, FoldersEnum.CONFIG)
+        self._parser = configparser.ConfigParser()
+        self._parser.read_dict(DEFAULTS)
+
+    @staticmethod
+    def load(path_to_repository: str) -> "RepositoryConfig":
+        config = RepositoryConfig(path_to_repository)
+        config._parser.read(config.path)
+
+        return config
+
+    def store(self):
+        with open(self.path, 'w') as f:
+            self._parser.write(f)
+
+    def get(self, section: str, option: str) -> str:
+        return self._parser.get(section, option)
+
+    def get_int(self, section: str, option: str) -> int:
+        return self._parser.getint(section, option)
+
+    def get_bool(self, section: str, option: str) -> bool:
+        return self._parser.getboolean(section, option)
+
+    def set(self, section: str, option: str, value):
+        if not self._parser.has_section(section):
+            self._parser.add_section(section)
+        self._parser.set(section, option, str(value))
+
+    @property
+    def compression(self) -> str:
+        return self.get('core', 'compression')
+
+    @property
+    def workers(self) -> int:
+        return self.get_int('core', 'workers')
+
+    @property
+    def checkpoint_interval(self) -> int:
+        return self.get_int('checkpoint', 'interval')
+
+    @property
+    def checkout_workers(self) -> int:
+        return self.get_int('checkout', 'workers')
+
+    @property
+    def cache_size(self) -> int:
+        return self.get_int('cache', 'size')
+
+    @property
+    def delta_depth(self) -> int:
+        return self.get_int('delta', 'depth')
+
+    @property
+    def delta_min_size(self) -> int:
+        return self.get_int('delta', 'min_size')
+
+    @property
+    def delta_max_size(self) -> int:
+        return self.get_int('delta', 'max_size')
+
+    @property
+    def delta_on_commit(self) -> bool:
+        return self.get_bool('delta', 'on_commit')
+
+    @property
+    def chunking_min_size(self) -> int:
+        return self.get_int('chunking', 'min_size')
+
+    @property
+    def monitor_enabled(self) -> bool:
+        return self.get_bool('monitor', 'enabled')
+
+    @property
+    def gc_grace_period(self) -> int:
+        return self.get_int('gc', 'grace_period')
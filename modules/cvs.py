@@ -1,14 +1,26 @@
 import os.path
+import shutil
+import time
 from dataclasses import dataclass
 
-from modules.cvs_objects import Commit, Tree, Blob, TreeObjectData
+from modules.cvs_objects import Commit, Tree, Blob, ChunkedBlob, TreeObjectData
 from modules.utils import *
 from modules.references import Branch, Head, Reference, Tag
 from modules.storage import CVSStorage
 from modules.folders_enum import FoldersEnum
 from modules.rebase_state import RebaseState
-
-
+from modules.config import RepositoryConfig
+from modules.index_cache import IndexCache
+from modules.object_cache import ObjectCache
+from modules.scanner import walk_directory, parallel_map
+from modules.commit_graph import CommitGraph
+from modules.diff import merge3, format_conflict
+from modules.packed_refs import PackedRefs
+from modules import fs_monitor, instrumentation
+
+
+# frequent lookups would only flood the trace
+@instrumentation.trace_methods(exclude={'read_object', 'get_commit_by_hash'})
 class CVS:
     def __init__(self, path: str):
         self.index: Index = Index(path, self)
@@ -22,7 +34,19 @@ class CVS:
         self._full_path_to_objects = os.path.join(path, FoldersEnum.OBJECTS)
         self._full_path_to_references = os.path.join(path, FoldersEnum.REFS)
 
-    def initialize_repository(self):
+        self.config = RepositoryConfig.load(path)
+        CVSStorage.set_codec(self._full_path_to_objects, self.config.compression)
+        CVSStorage.set_chunking_threshold(self._full_path_to_objects, self.config.chunking_min_size)
+        CVSStorage.forget_known_objects(self._full_path_to_objects)
+        self.object_cache = ObjectCache(self.config.cache_size)
+        self._checkpoints: set[str] = None
+        self.commit_graph = CommitGraph(os.path.join(path, FoldersEnum.COMMIT_GRAPH))
+        self.commit_graph.load()
+        self.packed_refs = PackedRefs(os.path.join(path, FoldersEnum.PACKED_REFS))
+        # path of a reference file -> (its mtime, size and inode, its content)
+        self._references: dict[str, tuple[tuple, bytes]] = {}
+
+    def initialize_repository(self, compression: str = None):
         if CVS.is_repository_exists(self.path_to_repository):
             self._initialize_head()
             self.update_index()
@@ -35,8 +59,13 @@ class CVS:
         os.mkdir(os.path.join(self.path_to_repository, FoldersEnum.TAGS))
         os.mkdir(os.path.join(self.path_to_repository, FoldersEnum.HEADS))
         os.mkdir(os.path.join(self.path_to_repository, FoldersEnum.INDEX))
+        os.mkdir(os.path.join(self.path_to_repository, FoldersEnum.CHECKPOINTS))
         with open(os.path.join(self.path_to_repository, FoldersEnum.HEAD), 'w'):
             pass
+        if compression is not None:
+            self.config.set('core', 'compression', compression)
+            CVSStorage.set_codec(self._full_path_to_objects, compression)
+        self.config.store()
 
         # initialize commit and head and store them
         commit = Commit(Tree())
@@ -44,6 +73,7 @@ class CVS:
                                 commit.serialize(),
                                 Commit,
                                 self._full_path_to_objects)
+        self._add_to_commit_graph(commit)
         branch = Branch('master', commit)
         CVSStorage.store_object(branch.name,
                                 branch.get_pointer().hex().encode(),
@@ -58,6 +88,7 @@ class CVS:
         self.update_index()
 
     def add_to_staged(self, data: TreeObjectData):
+        '''Stage the file in memory, index.store() persists the staged set once every file is added'''
         if data not in self.index.new and data not in self.index.modified and data not in self.index.removed \
                 or data in self.ignore or data in self.index.staged:
             return
@@ -69,61 +100,123 @@ class CVS:
             return
 
         # make commit from staged files and store it
-        commit_tree = initialize_and_store_tree_from_collection(self.index.staged, self._full_path_to_objects)
-        new_commit = Commit.derive_commit(self.get_commit_from_head(), commit_tree, message=message)
-        CVSStorage.store_object(new_commit.get_hash().hex(), new_commit.serialize(), Commit, self._full_path_to_objects)
-
-        # move head and branch to new commit and store them
+        parent = self.get_commit_from_head()
+        with CVSStorage.transaction(self._full_path_to_objects, self.config.workers):
+            commit_tree = initialize_and_store_tree_from_collection(
+                self.index.staged, self._full_path_to_objects, self.config.workers)
+            new_commit = Commit.derive_commit(parent, commit_tree, message=message)
+            CVSStorage.store_object(
+                new_commit.get_hash().hex(), new_commit.serialize(), Commit, self._full_path_to_objects)
+        self._add_to_commit_graph(new_commit)
+        if self.config.delta_on_commit:
+            self._store_deltas(parent, commit_tree)
+
+        # move head and branch to new commit and store them, only after the objects are on disk
         self.head = self.move_head_with_branch_to_commit(new_commit)
         self.store_head()
         if self.head.is_point_to_branch:
             self.store_branch(self.head.branch)
 
         self.index.staged = set()
+        self.index.store()
 
     def expand_full_tree(self, commit: Commit) -> dict[TreeObjectData, bytes]:
         files = {}
         removed = set(filter(lambda x: x.is_removed, commit.tree.children))
+        deltas = 0
         for parent in self.enumerate_commit_parents(commit, return_itself=True):
-            for item, item_hash in parent.tree.children.items():
-                blobs = []
-                if item.object_type is Tree:
-                    tree = Tree.deserialize(CVSStorage.read_object(item_hash.hex(), Tree, self._full_path_to_objects))
-                    for pair in self.enumerate_tree_files(tree):
-                        blobs.append(pair)
-                else:
-                    blobs.append((item, item_hash))
-
-                for blob, blob_hash in blobs:
-                    item_with_is_removed = TreeObjectData(blob.path, blob.object_type, is_removed=True)
-                    item_without_is_removed = TreeObjectData(blob.path, blob.object_type, is_removed=False)
-                    if item_with_is_removed in removed:
-                        continue
-                    elif item_without_is_removed in files:
-                        continue
-
-                    if blob.is_removed:
-                        removed.add(blob)
-                    files[blob] = blob_hash
+            # the checkpoint of the commit itself also holds its removed entries, so start from ancestors
+            checkpoint = self.get_checkpoint(parent) if parent is not commit else None
+            if checkpoint is not None:
+                self._merge_expanded_files(files, removed, checkpoint.children.items())
+                break
+
+            self._merge_expanded_files(files, removed, self._enumerate_commit_files(parent))
+            deltas += 1
+        # walks stay bounded only if every walk this long leaves a checkpoint, not just the first one
+        if deltas >= self.config.checkpoint_interval and not self._has_checkpoint(commit):
+            self._store_checkpoint(commit, files)
+
+        return files
+
+    def _enumerate_commit_files(self, commit: Commit) -> list[tuple[TreeObjectData, bytes]]:
+        '''Return files changed by the commit, including files of added directories'''
+        files = []
+        for item, item_hash in commit.tree.children.items():
+            if item.object_type is Tree:
+                tree = self.read_object(item_hash.hex(), Tree)
+                files.extend(self.enumerate_tree_files(tree))
+            else:
+                files.append((item, item_hash))
 
         return files
 
+    @staticmethod
+    def _merge_expanded_files(files: dict[TreeObjectData, bytes], removed: set[TreeObjectData], blobs):
+        for blob, blob_hash in blobs:
+            item_with_is_removed = TreeObjectData(blob.path, blob.object_type, is_removed=True)
+            item_without_is_removed = TreeObjectData(blob.path, blob.object_type, is_removed=False)
+            if item_with_is_removed in removed:
+                continue
+            elif item_without_is_removed in files:
+                continue
+
+            if blob.is_removed:
+                removed.add(blob)
+            files[blob] = blob_hash
+
+    def create_checkpoint(self, commit: Commit):
+        '''Store the full state of the commit, so expanding its descendants stops there'''
+        if not self._has_checkpoint(commit):
+            self._store_checkpoint(commit, self.expand_full_tree(commit))
+
+    def get_checkpoint(self, commit: Commit):
+        '''Return a tree with every file of the commit state or None if there is no checkpoint'''
+        if not self._has_checkpoint(commit):
+            return None
+        commit_hash = commit.get_hash().hex()
+        tree_hash = CVSStorage.read(commit_hash, os.path.join(self.path_to_repository, FoldersEnum.CHECKPOINTS))
+
+        return self.read_object(tree_hash.decode(), Tree)
+
+    def _has_checkpoint(self, commit: Commit) -> bool:
+        if self._checkpoints is None:
+            self._checkpoints = set(self._list_checkpoints())
+
+        return commit.get_hash().hex() in self._checkpoints
+
+    def _list_checkpoints(self) -> list[str]:
+        '''Return hashes of commits with a stored checkpoint, repositories created before checkpoints have none'''
+        path_to_checkpoints = os.path.join(self.path_to_repository, FoldersEnum.CHECKPOINTS)
+        if not os.path.isdir(path_to_checkpoints):
+            return []
+
+        return os.listdir(path_to_checkpoints)
+
+    def _store_checkpoint(self, commit: Commit, files: dict[TreeObjectData, bytes]):
+        checkpoint = Tree()
+        checkpoint.children = dict(files)
+        # descendants have to see the entries removed by the commit itself
+        for item, item_hash in commit.tree.children.items():
+            if item.is_removed and item.object_type is not Tree:
+                checkpoint.children[item] = item_hash
+        checkpoint_hash = checkpoint.get_hash().hex()
+        CVSStorage.store_object(checkpoint_hash, checkpoint.serialize(), Tree, self._full_path_to_objects)
+
+        commit_hash = commit.get_hash().hex()
+        CVSStorage.store(commit_hash,
+                         checkpoint_hash.encode(),
+                         os.path.join(self.path_to_repository, FoldersEnum.CHECKPOINTS))
+        if self._checkpoints is not None:
+            self._checkpoints.add(commit_hash)
+
     def get_full_tree_state(self, commit: Commit) -> Tree:
+        '''Return a tree with every file of the commit state and the entries removed by the commit'''
         full_tree = Tree()
-        full_tree.children = commit.tree.children.copy()
-        removed = set(filter(lambda x: x.is_removed, commit.tree.children))
-        for parent in self.enumerate_commit_parents(commit):
-            for item in parent.tree.children:
-                item_with_is_removed = TreeObjectData(item.path, item.object_type, is_removed=True)
-                item_without_is_removed = TreeObjectData(item.path, item.object_type, is_removed=False)
-                if item_with_is_removed in removed:
-                    continue
-                elif item_without_is_removed in full_tree.children:
-                    continue
-
-                if item.is_removed:
-                    removed.add(item)
-                full_tree.children[item] = parent.tree.children[item]
+        full_tree.children = self.expand_full_tree(commit)
+        for item, item_hash in commit.tree.children.items():
+            if item.is_removed:
+                full_tree.children[item] = item_hash
 
         return full_tree
 
@@ -134,26 +227,40 @@ class CVS:
     def initialize_rebase_state(self, src_branch: Branch):
         head_branch = self.get_branch_from_head()
         head_commit = head_branch.commit
-        head_commit_parents = {parent for parent in self.enumerate_commit_parents(head_commit, return_itself=True)}
         self.rebase_state = RebaseState(src_branch, head_branch)
+        merge_base = self.find_merge_base(head_commit, src_branch.commit)
 
-        common_commit = None
-        for branch_parent in self.enumerate_commit_parents(src_branch.commit, return_itself=True):
-            if branch_parent in head_commit_parents:
-                common_commit = branch_parent
+        for branch_parent_hash in self.enumerate_commit_parent_hashes(src_branch.commit, return_itself=True):
+            if branch_parent_hash == merge_base:
                 break
-            self.rebase_state.not_applied.append(branch_parent)
-        if common_commit is None:
-            common_commit = Commit(Tree())
+            self.rebase_state.not_applied.append(self.get_commit_by_hash(branch_parent_hash.hex()))
 
         for head_parent in self.enumerate_commit_parents(head_commit, return_itself=True):
             for item in head_parent.tree.children:
                 self.rebase_state.destination_branch_changed.add(item)
-            if head_parent == common_commit:
+            if head_parent.get_hash() == merge_base:
                 break
 
         self.rebase_state.current_dst_commit = head_commit
 
+    def find_merge_base(self, first: Commit, second: Commit):
+        '''Return the hash of the nearest common ancestor of two commits or None'''
+        self._add_to_commit_graph(first)
+        self._add_to_commit_graph(second)
+        first_hash = first.get_hash()
+        second_hash = second.get_hash()
+        # step back on the side with the greater generation, both sides meet at the merge base
+        while first_hash != second_hash:
+            instrumentation.count('commit_graph.merge_base_steps')
+            if self.commit_graph.get_generation(first_hash) >= self.commit_graph.get_generation(second_hash):
+                first_hash = self.commit_graph.get_parent(first_hash)
+            else:
+                second_hash = self.commit_graph.get_parent(second_hash)
+            if not first_hash or not second_hash:
+                return None
+
+        return first_hash
+
     def continue_rebase(self) -> RebaseState:
         if not self.rebase_state or not self.rebase_state.is_conflict:
             raise ValueError('not in rebase')
@@ -189,74 +296,183 @@ class CVS:
         return state
 
     def apply_commit(self, commit: Commit):
+        merged = {}
+        expanded = {}
         for item, item_hash in commit.tree.children.items():
             if item in self.rebase_state.resolved_files:
                 continue
             self.rebase_state.current_file = item
             self.rebase_state.resolved_files.add(item)
             if item in self.rebase_state.destination_branch_changed:
-                self.rebase_state.is_conflict = True
-                # нужно составить файл с конфликтом
-                branch_blob = Blob.deserialize(
-                    CVSStorage.read_object(item_hash.hex(), Blob, self._full_path_to_objects))
-                other_branch_file_lines = branch_blob.content.decode().splitlines(keepends=True)
-                with open(item.path, 'r') as f:
-                    curr_branch_file_lines = f.read().splitlines(keepends=True)
-                create_diff_file(item.path, curr_branch_file_lines, other_branch_file_lines)
-                # ждем разрешения конфликта
-                return
+                merged_hash = self._merge_file(commit, item, item_hash, expanded)
+                if merged_hash is None:
+                    self.rebase_state.is_conflict = True
+                    # ждем разрешения конфликта
+                    return
+                merged[item] = merged_hash
         self.rebase_state.resolved_files = set()
         # текущий коммит можно применить
-        commit.parent_commit_hash = self.rebase_state.current_dst_commit.get_hash()
+        tree = commit.tree
+        if merged:
+            tree = Tree()
+            for item, item_hash in commit.tree.children.items():
+                tree.add_object(item, merged.get(item, item_hash))
+            CVSStorage.store_object(tree.get_hash().hex(), tree.serialize(), Tree, self._full_path_to_objects)
+        commit = self.rebase_state.current_dst_commit.derive_commit(tree, message=commit.message)
         # сохранить на диск
         CVSStorage.store_object(
             commit.get_hash().hex(), commit.serialize(), Blob, self._full_path_to_objects)
+        self._add_to_commit_graph(commit)
         # сдвинуть head и текущую ветку
         self.head = self.move_head_with_branch_to_commit(commit)
         self.store_head()
         self.store_branch(self.head.branch)
         self.rebase_state.current_dst_commit = commit
 
-    def restore_repository_state(self, commit: Commit):
-        tree_files = self.expand_full_tree(commit)
+    def _merge_file(self, commit: Commit, item: TreeObjectData, item_hash: bytes, expanded: dict):
+        '''Three-way merge of an entry changed in both branches, return its merged hash or None on conflict
+
+        Only conflicts of files leave a file with conflict markers, directories have nothing to mark.
+        '''
+        if 'ours' not in expanded:
+            expanded['ours'] = self.expand_full_tree(self.rebase_state.current_dst_commit)
+            # like a cherry-pick, the base is the parent of the replayed commit, not the fork point
+            parent_hash = commit.parent_commit_hash
+            expanded['base'] = {} if not parent_hash else \
+                self.expand_full_tree(self.get_commit_by_hash(parent_hash.hex()))
+        if item.is_removed and not self._is_in_files(item, expanded['ours']):
+            # removed on both sides
+            return item_hash
+        if item.object_type is Tree:
+            return None
+        ours_hash = expanded['ours'].get(TreeObjectData(item.path, Blob))
+        base_hash = expanded['base'].get(TreeObjectData(item.path, Blob))
+
+        if item.is_removed:
+            # файл удален в переносимом коммите, но есть в текущей ветке
+            ours = self.read_object(ours_hash.hex(), Blob).content.splitlines(True)
+            create_diff_file(item.path, format_conflict(ours, []))
+            return None
+        theirs = self.read_object(item_hash.hex(), Blob).content.splitlines(True)
+        if ours_hash is None:
+            # файл удален в текущей ветке
+            create_diff_file(item.path, format_conflict([], theirs))
+            return None
+        base = self.read_object(base_hash.hex(), Blob).content.splitlines(True) if base_hash else []
+        ours = self.read_object(ours_hash.hex(), Blob).content.splitlines(True)
+        result = merge3(base, ours, theirs)
+        if result.is_conflict:
+            create_diff_file(item.path, result.lines)
+            return None
+
+        blob = Blob(b''.join(result.lines))
+        CVSStorage.store_object(blob.get_hash().hex(), blob.serialize(), Blob, self._full_path_to_objects)
+        return blob.get_hash()
+
+    @staticmethod
+    def _is_in_files(item: TreeObjectData, files: dict[TreeObjectData, bytes]) -> bool:
+        '''Check if the file or any file of the directory exists in the expanded tree'''
+        if item.object_type is Tree:
+            return any(not file.is_removed and file.path.startswith(item.path) for file in files)
 
-        # удалить все что есть (кроме того, что в игноре)
-        ignore = set(i.path for i in self.index.ignore)
-        rmdir(self.path_to_repository, ignore)
+        return TreeObjectData(item.path, Blob) in files
 
-        # восстановить копии из хранилища
-        self._restore_tree(tree_files)
+    def restore_repository_state(self, commit: Commit):
+        '''Make the working tree match the commit, touching only files which differ'''
+        target = {item: item_hash for item, item_hash in self.expand_full_tree(commit).items()
+                  if not item.is_removed and item.object_type is not Tree}
+        current = self.index.get_directory_files()
+
+        # удалить все, чего нет в коммите (кроме того, что в игноре)
+        for item in current:
+            if item not in target:
+                os.remove(item.path)
+        needed_directories = {os.path.join(directory, '') for item in target
+                              for directory in iterate_parent_directories(item.path, self.path_to_repository)}
+        ignore = {data.path for data in self.index.ignore}
+        directories, _ = walk_directory(self.path_to_repository, ignore)
+        for directory in sorted(directories, key=len, reverse=True):
+            if directory not in needed_directories:
+                shutil.rmtree(directory)
+
+        # восстановить измененные копии из хранилища
+        self._restore_tree({item: item_hash for item, item_hash in target.items() if current.get(item) != item_hash})
 
     def _restore_tree(self, files: dict[TreeObjectData, bytes]):
-        for file, file_hash in files.items():
-            file_data = CVSStorage.read_object(file_hash.hex(), file.object_type, self._full_path_to_objects)
-            os.makedirs(os.path.dirname(file.path), exist_ok=True)
-            blob = Blob.deserialize(file_data)
-            with open(file.path, 'wb+') as f:
-                f.write(blob.content)
+        for directory in {os.path.dirname(file.path) for file in files}:
+            os.makedirs(directory, exist_ok=True)
+
+        def restore(item: tuple[TreeObjectData, bytes]) -> os.stat_result:
+            file, file_hash = item
+            CVSStorage.restore_blob_to_file(file_hash.hex(), self._full_path_to_objects, file.path)
+            return os.stat(file.path)
+
+        items = list(files.items())
+        for (file, file_hash), stat in zip(items, parallel_map(restore, items, self.config.checkout_workers)):
+            self.index.cache.update_entry(file.path, stat, file_hash)
+        self.index.store()
+
+    def read_object(self, object_hash: str, object_type: type):
+        '''Return a decoded object, objects are immutable and are shared through the cache'''
+        obj = self.object_cache.get(object_hash)
+        if obj is None:
+            raw_object = CVSStorage.read_object(object_hash, object_type, self._full_path_to_objects)
+            if object_type is Blob and ChunkedBlob.is_manifest(raw_object):
+                raw_object = Blob.serialize_header() + b''.join(
+                    CVSStorage.iterate_blob_content(object_hash, self._full_path_to_objects))
+            obj = object_type.deserialize(raw_object)
+            self.object_cache.put(object_hash, obj, len(raw_object))
+
+        return obj
 
     def get_commit_by_hash(self, commit_hash: str) -> Commit:
-        raw_commit = CVSStorage.read_object(commit_hash, Commit, self._full_path_to_objects)
-
-        return Commit.deserialize(raw_commit)
+        return self.read_object(commit_hash, Commit)
 
     def get_branch_by_name(self, branch_name: str) -> Branch:
-        commit_hash = CVSStorage.read_object(branch_name,
-                                            Branch,
-                                            os.path.join(self.path_to_repository, FoldersEnum.HEADS))
+        commit_hash = self._read_reference(FoldersEnum.HEADS, branch_name)
 
-        raw_commit = CVSStorage.read_object(commit_hash.decode(), Commit, self._full_path_to_objects)
-
-        return Branch(branch_name, Commit.deserialize(raw_commit))
+        return Branch(branch_name, self.read_object(commit_hash, Commit))
 
     def get_commit_by_tag_name(self, tag_name: str) -> Commit:
-        commit_hash = CVSStorage.read_object(tag_name,
-                                             Tag,
-                                             os.path.join(self.path_to_repository, FoldersEnum.TAGS))
-
-        raw_commit = CVSStorage.read_object(commit_hash.decode(), Commit, self._full_path_to_objects)
+        commit_hash = self._read_reference(FoldersEnum.TAGS, tag_name)
+
+        return self.read_object(commit_hash, Commit)
+
+    def _read_reference(self, folder: FoldersEnum, name: str) -> str:
+        '''Return the commit hash of a branch or a tag, loose references override packed ones'''
+        try:
+            return self._read_reference_file(folder, name).decode()
+        except FileNotFoundError:
+            commit_hash = self.packed_refs.find(self._get_packed_name(folder, name))
+            if commit_hash is None:
+                raise
+            return commit_hash
+
+    def _read_reference_file(self, folder: FoldersEnum, name: str) -> bytes:
+        '''Read a reference file, its content is cached until the file is changed'''
+        path = os.path.join(self.path_to_repository, folder, name)
+        try:
+            stat = os.stat(path)
+        except FileNotFoundError:
+            self._references.pop(path, None)
+            raise
+        key = (stat.st_mtime_ns, stat.st_size, stat.st_ino)
+        cached = self._references.get(path)
+        if cached is not None and cached[0] == key:
+            return cached[1]
+
+        content = CVSStorage.read_object(name, Reference, os.path.join(self.path_to_repository, folder))
+        self._references[path] = (key, content)
+
+        return content
+
+    def _invalidate_reference(self, folder: FoldersEnum, name: str):
+        self._references.pop(os.path.join(self.path_to_repository, folder, name), None)
 
-        return Commit.deserialize(raw_commit)
+    @staticmethod
+    def _get_packed_name(folder: FoldersEnum, name: str) -> str:
+        # packed names are relative to the refs folder, like heads/master
+        return folder.value[len(FoldersEnum.REFS.value):].rstrip('/') + '/' + name
 
     def move_head_with_branch_to_commit(self, commit: Commit) -> Head:
         if self.head.is_point_to_branch:
@@ -268,20 +484,195 @@ class CVS:
     def create_tag(self, tag_name: str, message=''):
         current_commit = self.get_commit_from_head()
         tag = Tag(tag_name, current_commit, message=message)
+        self._invalidate_reference(FoldersEnum.TAGS, tag_name)
         CVSStorage.store_object(tag_name,
                                 tag.get_pointer().hex().encode(),
                                 Tag,
                                 os.path.join(self.path_to_repository, FoldersEnum.TAGS))
 
     def delete_tag(self, tag_name: str):
-        path_to_tag = os.path.join(self.path_to_repository, FoldersEnum.TAGS, tag_name)
-        os.remove(path_to_tag)
+        self._delete_reference(FoldersEnum.TAGS, tag_name)
 
     def delete_branch(self, branch_name: str):
-        path_to_branch = os.path.join(self.path_to_repository, FoldersEnum.HEADS, branch_name)
-        os.remove(path_to_branch)
+        self._delete_reference(FoldersEnum.HEADS, branch_name)
+
+    def _delete_reference(self, folder: FoldersEnum, name: str):
+        self._invalidate_reference(folder, name)
+        is_packed = self.packed_refs.remove(self._get_packed_name(folder, name))
+        try:
+            os.remove(os.path.join(self.path_to_repository, folder, name))
+        except FileNotFoundError:
+            if not is_packed:
+                raise
+
+    def pack_refs(self) -> int:
+        '''Move branches and tags into the packed-refs file, return the number of moved references'''
+        refs = self.packed_refs.items()
+        loose = []
+        for folder in (FoldersEnum.HEADS, FoldersEnum.TAGS):
+            directory = os.path.join(self.path_to_repository, folder)
+            for name in os.listdir(directory):
+                refs[self._get_packed_name(folder, name)] = self._read_reference(folder, name)
+                loose.append(os.path.join(directory, name))
+        if not loose:
+            return 0
+
+        self.packed_refs.store(refs)
+        for path in loose:
+            os.remove(path)
+            self._references.pop(path, None)
+
+        return len(loose)
+
+    def start_monitor(self) -> bool:
+        '''Watch the working tree, so the index examines only changed paths, return False if it is unsupported'''
+        if self.index.monitor is not None:
+            return True
+        if not fs_monitor.is_supported():
+            return False
+        monitor = fs_monitor.FileSystemMonitor(self.path_to_repository, {data.path for data in self.ignore})
+        try:
+            monitor.start()
+        except OSError:
+            # for example the limit of watches is reached
+            return False
+        self.index.monitor = monitor
+
+        return True
+
+    def stop_monitor(self):
+        if self.index.monitor is not None:
+            self.index.monitor.stop()
+            self.index.monitor = None
+
+    def repack(self) -> int:
+        self._store_history_deltas()
+        return CVSStorage.repack(self._full_path_to_objects)
+
+    def gc(self, grace_period: int = None, repack=False) -> "GarbageCollectionReport":
+        '''Remove objects unreachable from references, HEAD and the rebase in progress'''
+        if grace_period is None:
+            grace_period = self.config.gc_grace_period
+        report = GarbageCollectionReport()
+        stored_size = CVSStorage.get_stored_size(self._full_path_to_objects)
+        expire = time.time() - grace_period
+        self._remove_temporary_files(expire)
+
+        reachable = self._mark_reachable_objects()
+        report.removed_checkpoints = self._remove_unreachable_checkpoints(reachable)
+        report.removed = CVSStorage.prune_objects(self._full_path_to_objects, reachable, expire)
+        if repack:
+            self._store_history_deltas()
+            report.removed += CVSStorage.prune_packed_objects(self._full_path_to_objects, reachable, expire)
+        self.object_cache.clear()
+
+        report.reachable = len(reachable)
+        report.reclaimed_size = stored_size - CVSStorage.get_stored_size(self._full_path_to_objects)
+
+        return report
+
+    def _remove_temporary_files(self, expire: float):
+        '''Remove files left by interrupted reference writes, older versions wrote them next to the references'''
+        for folder in (FoldersEnum.CVS_DATA, FoldersEnum.HEADS, FoldersEnum.TAGS):
+            directory = os.path.join(self.path_to_repository, folder)
+            if not os.path.isdir(directory):
+                continue
+            for file in os.scandir(directory):
+                if file.name.startswith('tmp_') and file.is_file() and file.stat().st_mtime < expire:
+                    os.remove(file.path)
+
+    def _mark_reachable_objects(self) -> set[bytes]:
+        commits = [self.get_commit_from_head()]
+        commits.extend(self.get_branch_by_name(name).commit for name in self.get_branches_names())
+        commits.extend(self.get_commit_by_tag_name(name) for name in self.get_tags_names())
+        if self.rebase_state is not None:
+            commits.extend((self.rebase_state.source_branch.commit,
+                            self.rebase_state.destination_branch.commit,
+                            self.rebase_state.current_dst_commit,
+                            *self.rebase_state.not_applied))
+
+        reachable = set()
+        while commits:
+            commit = commits.pop()
+            commit_hash = commit.get_hash()
+            if commit_hash in reachable:
+                continue
+            reachable.add(commit_hash)
+            self._mark_tree(commit.tree, reachable)
+            if commit.parent_commit_hash:
+                commits.append(self.get_commit_by_hash(commit.parent_commit_hash.hex()))
+
+        path_to_checkpoints = os.path.join(self.path_to_repository, FoldersEnum.CHECKPOINTS)
+        for commit_hash in self._list_checkpoints():
+            if bytes.fromhex(commit_hash) in reachable:
+                tree_hash = CVSStorage.read(commit_hash, path_to_checkpoints).decode()
+                reachable.add(bytes.fromhex(tree_hash))
+                self._mark_tree(self.read_object(tree_hash, Tree), reachable)
+
+        return reachable
+
+    def _mark_tree(self, tree: Tree, reachable: set[bytes]):
+        for item, item_hash in tree.children.items():
+            # removed entries do not point to objects
+            if item.is_removed or item_hash in reachable:
+                continue
+            reachable.add(item_hash)
+            if item.object_type is Tree:
+                self._mark_tree(self.read_object(item_hash.hex(), Tree), reachable)
+            else:
+                reachable.update(CVSStorage.enumerate_object_references(item_hash.hex(), self._full_path_to_objects))
+
+    def _remove_unreachable_checkpoints(self, reachable: set[bytes]) -> int:
+        path_to_checkpoints = os.path.join(self.path_to_repository, FoldersEnum.CHECKPOINTS)
+        removed = 0
+        for commit_hash in self._list_checkpoints():
+            if bytes.fromhex(commit_hash) not in reachable:
+                os.remove(os.path.join(path_to_checkpoints, commit_hash))
+                removed += 1
+        self._checkpoints = None
+
+        return removed
+
+    def _store_deltas(self, parent: Commit, tree: Tree):
+        '''Store new versions of files as deltas against their versions in the parent commit'''
+        min_size, max_size = self.config.delta_min_size, self.config.delta_max_size
+        # larger files are left to the streaming storage, a delta would hold both versions in memory
+        changed = [(item, item_hash) for item, item_hash in tree.children.items()
+                   if item.object_type is Blob and not item.is_removed
+                   and min_size <= os.path.getsize(item.path) <= max_size]
+        if not changed or not self.config.delta_depth:
+            return
+
+        previous = self.expand_full_tree(parent)
+        for item, item_hash in changed:
+            base_hash = previous.get(item)
+            if base_hash:
+                CVSStorage.store_delta(item_hash.hex(), base_hash.hex(), self._full_path_to_objects,
+                                       self.config.delta_depth, min_size, max_size)
+
+    def _store_history_deltas(self):
+        '''Store loose versions of files from the head history as deltas against their previous versions'''
+        if not self.config.delta_depth:
+            return
+        previous = {}
+        commits = list(self.enumerate_commit_parents(self.get_commit_from_head(), return_itself=True))
+        for commit in reversed(commits):
+            for item, item_hash in self._enumerate_commit_files(commit):
+                if item.object_type is not Blob or item.is_removed:
+                    continue
+                base_hash = previous.get(item)
+                if base_hash and base_hash != item_hash:
+                    CVSStorage.store_delta(item_hash.hex(), base_hash.hex(), self._full_path_to_objects,
+                                           self.config.delta_depth, self.config.delta_min_size,
+                                           self.config.delta_max_size)
+                previous[item] = item_hash
+
+    def get_compression_report(self):
+        return CVSStorage.get_compression_report(self._full_path_to_objects)
 
     def store_head(self):
+        # the file could be rewritten within the same mtime tick with the same size
+        self._invalidate_reference(FoldersEnum.CVS_DATA, 'HEAD')
         if self.head.is_point_to_branch:
             CVSStorage.store_object('HEAD',
                                     self.head.get_pointer(),
@@ -294,6 +685,7 @@ class CVS:
                                     os.path.join(self.path_to_repository, FoldersEnum.CVS_DATA))
 
     def store_branch(self, branch: Branch):
+        self._invalidate_reference(FoldersEnum.HEADS, branch.name)
         CVSStorage.store_object(branch.name,
                                 branch.get_pointer().hex().encode(),
                                 Branch,
@@ -324,47 +716,66 @@ class CVS:
         raise ValueError('head does not point to a branch')
 
     def get_branches_names(self) -> list[str]:
-        path_to_branches = os.path.join(self.path_to_repository, FoldersEnum.HEADS)
-
-        return os.listdir(path_to_branches)
+        return self._get_references_names(FoldersEnum.HEADS)
 
     def get_tags_names(self) -> list[str]:
-        path_to_tags = os.path.join(self.path_to_repository, FoldersEnum.TAGS)
+        return self._get_references_names(FoldersEnum.TAGS)
+
+    def _get_references_names(self, folder: FoldersEnum) -> list[str]:
+        loose = os.listdir(os.path.join(self.path_to_repository, folder))
+        packed = self.packed_refs.get_names(self._get_packed_name(folder, ''))
 
-        return os.listdir(path_to_tags)
+        return sorted({*loose, *packed})
 
     def enumerate_commit_parents(self, commit: Commit, return_itself=False):
-        current_commit = commit
         if return_itself:
             yield commit
-        while current_commit.parent_commit_hash != b'':
-            prev_commit = self.get_commit_by_hash(current_commit.parent_commit_hash.hex())
-            if prev_commit.parent_commit_hash == b'':
+        for parent_hash in self.enumerate_commit_parent_hashes(commit):
+            yield self.get_commit_by_hash(parent_hash.hex())
+
+    def enumerate_commit_parent_hashes(self, commit: Commit, return_itself=False):
+        '''Walk like enumerate_commit_parents, but read only the commit graph'''
+        commit_hash = commit.get_hash()
+        self._add_to_commit_graph(commit)
+        if return_itself:
+            yield commit_hash
+        ancestors = self.commit_graph.enumerate_ancestors(commit_hash)
+        next(ancestors)
+        for parent_hash in ancestors:
+            # the initial commit is not yielded
+            if not self.commit_graph.get_parent(parent_hash):
                 break
-            yield prev_commit
-            current_commit = prev_commit
+            yield parent_hash
+
+    def _add_to_commit_graph(self, commit: Commit):
+        '''Append the commit and its ancestors missing from the commit graph'''
+        missing = []
+        current_commit = commit
+        while not self.commit_graph.contains(current_commit.get_hash()):
+            missing.append(current_commit)
+            if not current_commit.parent_commit_hash:
+                break
+            current_commit = self.get_commit_by_hash(current_commit.parent_commit_hash.hex())
+        for missing_commit in reversed(missing):
+            self.commit_graph.add(missing_commit.get_hash(),
+                                  missing_commit.parent_commit_hash,
+                                  missing_commit.tree.get_hash())
 
     def enumerate_tree_files(self, tree: Tree) -> tuple[TreeObjectData, bytes]:
         for item, item_hash in tree.children.items():
             if item.object_type is Tree:
-                nested_tree = CVSStorage.read_object(item_hash.hex(), Tree, self._full_path_to_objects)
-                yield from self.enumerate_tree_files(Tree.deserialize(nested_tree))
+                yield from self.enumerate_tree_files(self.read_object(item_hash.hex(), Tree))
             else:
                 yield item, item_hash
 
     def _get_head_reference(self):
-        head_reference = CVSStorage.read_object('HEAD',
-                                                Reference,
-                                                os.path.join(self.path_to_repository, FoldersEnum.CVS_DATA))
+        head_reference = self._read_reference_file(FoldersEnum.CVS_DATA, 'HEAD')
         if head_reference.decode().startswith('ref'):
             branch_name = os.path.basename(head_reference.decode())
-            commit_hash = CVSStorage.read_object(
-                branch_name, Branch, os.path.join(self.path_to_repository, FoldersEnum.HEADS))
-            raw_commit = CVSStorage.read_object(commit_hash.decode(), Commit, self._full_path_to_objects)
-            return Branch(branch_name, Commit.deserialize(raw_commit))
+            commit_hash = self._read_reference(FoldersEnum.HEADS, branch_name)
+            return Branch(branch_name, self.read_object(commit_hash, Commit))
         else:
-            raw_commit = CVSStorage.read_object(head_reference.decode(), Commit, self._full_path_to_objects)
-            return Commit.deserialize(raw_commit)
+            return self.read_object(head_reference.decode(), Commit)
 
 
 class Index:
@@ -372,10 +783,12 @@ class Index:
         self.directory = directory
         self.cvs = cvs
         self.ignore: set[TreeObjectData] = set()
-        self.staged: set[TreeObjectData] = set()
+        self.cache = IndexCache.load(os.path.join(directory, FoldersEnum.INDEX_CACHE), directory)
+        self.staged: set[TreeObjectData] = set(self.cache.staged)
         self.modified: dict[TreeObjectData, bytes] = {}
         self.removed: dict[TreeObjectData, bytes] = {}
         self.new: dict[TreeObjectData, bytes] = {}
+        self.monitor: fs_monitor.FileSystemMonitor = None
 
     def compare_tree_to_dir(self, tree_files: dict[TreeObjectData, bytes]) -> "TreeComparisonResult":
         in_first: dict[TreeObjectData, bytes] = {}
@@ -385,6 +798,7 @@ class Index:
         res = TreeComparisonResult(in_first, in_second, different, equal)
 
         dir_tree_files = {item: item_hash for item, item_hash in self._enumerate_tree_files_from_directory(self.directory)}
+        self.cache.retain(item.path for item in dir_tree_files)
         for first_tree_object_data in dir_tree_files:
             if first_tree_object_data not in tree_files:
                 # current object is new
@@ -409,23 +823,78 @@ class Index:
                         for data, v in comp_res.in_second.items()
                         if TreeObjectData(data.path, data.object_type, is_removed=True) not in tree_files}
         self.modified = comp_res.different
+        self.store()
+
+    def get_directory_files(self) -> dict[TreeObjectData, bytes]:
+        '''Return every file of the working tree with its hash'''
+        return dict(self._enumerate_tree_files_from_directory(self.directory))
+
+    def store(self):
+        '''Persist stat data of the working tree and the staged set'''
+        self.cache.set_staged(self.staged)
+        if self.cache.is_changed:
+            self.cache.store()
 
     def _enumerate_tree_files_from_directory(self, directory: str) -> tuple[TreeObjectData, bytes]:
-        for file in os.listdir(directory):
-            full_path = os.path.join(directory, file)
-            if os.path.isdir(full_path):
-                full_path = os.path.join(full_path, '')
-                if TreeObjectData(full_path, Tree) in self.ignore:
-                    continue
-                yield from self._enumerate_tree_files_from_directory(full_path)
+        ignore = {data.path for data in self.ignore}
+        changes = self.monitor.take_changes() if self.monitor is not None else None
+        if changes is None:
+            _, files = walk_directory(directory, ignore)
+            if self.monitor is not None:
+                # following queries trust the cache, so it has to describe the whole tree
+                self.cache.retain(path for path, _ in files)
+        else:
+            files = self._stat_changed_files(changes, ignore)
+            # files which were not changed since the previous query keep their cached hashes
+            changed_directories = tuple(path for path in changes if path.endswith(os.sep))
+            unchanged = [(path, entry.object_hash) for path, entry in self.cache.entries.items()
+                         if path not in changes and not path.startswith(changed_directories)]
+            self.cache.retain([*(path for path, _ in unchanged), *(path for path, _ in files)])
+            for path, object_hash in unchanged:
+                yield TreeObjectData(path, Blob), object_hash
+
+        not_cached = []
+        for path, stat in files:
+            file_hash = self.cache.get_hash(path, stat)
+            if file_hash is None:
+                not_cached.append((path, stat))
             else:
-                if TreeObjectData(full_path, Blob) in self.ignore:
-                    continue
-                file_data = TreeObjectData(full_path, Blob)
-                with open(full_path, 'rb') as f:
-                    obj = Blob(f.read())
+                yield TreeObjectData(path, Blob), file_hash
+
+        hashes = parallel_map(lambda path: CVSStorage.hash_file(path, self.cvs._full_path_to_objects),
+                              (path for path, _ in not_cached),
+                              self.cvs.config.workers)
+        for (path, stat), file_hash in zip(not_cached, hashes):
+            self.cache.update_entry(path, stat, file_hash)
+            yield TreeObjectData(path, Blob), file_hash
 
-                yield file_data, obj.get_hash()
+    @staticmethod
+    def _stat_changed_files(changes: set[str], ignore: set[str]) -> list[tuple[str, os.stat_result]]:
+        files = {}
+        ignored_prefixes = tuple(ignore)
+        for path in changes:
+            if path.startswith(ignored_prefixes):
+                continue
+            if path.endswith(os.sep):
+                if os.path.isdir(path):
+                    files.update(walk_directory(path, ignore)[1])
+                continue
+            try:
+                stat = os.stat(path)
+            except (FileNotFoundError, NotADirectoryError):
+                continue
+            if not os.path.isdir(path):
+                files[path] = stat
+
+        return list(files.items())
+
+
+@dataclass
+class GarbageCollectionReport:
+    reachable: int = 0
+    removed: int = 0
+    removed_checkpoints: int = 0
+    reclaimed_size: int = 0
 
 
 @dataclass
@@ -3,6 +3,32 @@ import os
 from dataclasses import dataclass
 import hashlib
 import pickle
+import struct
+
+from modules import chunking, instrumentation
+
+# Objects are stored as a type tag, a format version and a type specific body.
+# Pickled objects written by older versions start with the pickle PROTO opcode.
+FORMAT_VERSION = 1
+BLOB_TAG = b'b'
+TREE_TAG = b't'
+COMMIT_TAG = b'c'
+CHUNKED_BLOB_TAG = b'k'
+PICKLE_PROTOCOL_OPCODE = b'\x80'
+# files are read, hashed and stored by pieces of this size
+CHUNK_SIZE = 1 << 20
+BLOB_HASH_HEADER = b'blob #\0'
+CHUNKED_BLOB_HASH_HEADER = b'chunked #\0'
+
+_OBJECT_HEADER = struct.Struct('>cB')
+_TREE_HEADER = struct.Struct('>BI')
+_TREE_ENTRY = struct.Struct('>BBI')
+_HASH_LENGTH = struct.Struct('>B')
+_FIELD_LENGTH = struct.Struct('>I')
+# size of the file, number of chunks
+_MANIFEST_HEADER = struct.Struct('>QI')
+# blob hash, size of the chunk
+_MANIFEST_ENTRY = struct.Struct('>20sI')
 
 
 class CVSObject(abc.ABC):
@@ -23,29 +49,186 @@ class CVSObject(abc.ABC):
 class Blob(CVSObject):
     '''Blob is a file container'''
     def __init__(self, content: bytes, is_removed=False):
+        self._hash = None
         self.content = content
         self.is_removed = is_removed
 
+    @property
+    def content(self) -> bytes:
+        return self._content
+
+    @content.setter
+    def content(self, value: bytes):
+        self._content = value
+        self._hash = None
+
+    def __getstate__(self):
+        return {'content': self.content, 'is_removed': self.is_removed}
+
+    def __setstate__(self, state):
+        self.__init__(state['content'], state.get('is_removed', False))
+
     def serialize(self) -> bytes:
-        return pickle.dumps(self)
+        return _OBJECT_HEADER.pack(BLOB_TAG, FORMAT_VERSION) + self.content
 
     @staticmethod
     def deserialize(content: bytes) -> "Blob":
-        return pickle.loads(content)
+        if _is_pickled(content):
+            return pickle.loads(content)
+        _check_header(content, BLOB_TAG)
+
+        return Blob(content[_OBJECT_HEADER.size:])
 
     def get_hash(self) -> bytes:
-        header = b'blob #\0'
+        if self._hash is None:
+            instrumentation.count('hash.computations')
+            instrumentation.count('hash.bytes', len(self.content))
+            self._hash = hashlib.sha1(BLOB_HASH_HEADER + self.content).digest()
+
+        return self._hash
+
+    @staticmethod
+    def hash_content(content: bytes) -> bytes:
+        '''Return the hash of a blob with the content, the content may be any buffer'''
+        instrumentation.count('hash.computations')
+        instrumentation.count('hash.bytes', len(content))
+        digest = hashlib.sha1(BLOB_HASH_HEADER)
+        digest.update(content)
+
+        return digest.digest()
+
+    @staticmethod
+    @instrumentation.timed('hash.file')
+    def hash_file(path: str, chunk_size=CHUNK_SIZE) -> bytes:
+        '''Return the hash of a blob with the file content without reading the whole file'''
+        digest = hashlib.sha1(BLOB_HASH_HEADER)
+        size = 0
+        # working tree files are not mapped, another process could truncate them under the mapping
+        with open(path, 'rb') as f:
+            for chunk in iter(lambda: f.read(chunk_size), b''):
+                digest.update(chunk)
+                size += len(chunk)
+        instrumentation.count('hash.computations')
+        instrumentation.count('hash.bytes', size)
+
+        return digest.digest()
+
+    @staticmethod
+    def serialize_header() -> bytes:
+        return _OBJECT_HEADER.pack(BLOB_TAG, FORMAT_VERSION)
 
-        return hashlib.sha1(header + self.content).digest()
+    @staticmethod
+    def iterate_content(serialized_chunks):
+        '''Yield the content of a serialized blob given by pieces'''
+        chunks = iter(serialized_chunks)
+        head = b''
+        for chunk in chunks:
+            head += chunk
+            if len(head) >= _OBJECT_HEADER.size:
+                break
+        if _is_pickled(head):
+            yield Blob.deserialize(head + b''.join(chunks)).content
+            return
+        _check_header(head, BLOB_TAG)
+        if len(head) > _OBJECT_HEADER.size:
+            yield head[_OBJECT_HEADER.size:]
+        yield from chunks
+
+
+class ChunkedBlob(CVSObject):
+    '''Manifest of a large file stored as blobs of its content-defined chunks'''
+    def __init__(self, chunks: list[tuple[bytes, int]] = None):
+        self._hash = None
+        self.chunks = chunks if chunks is not None else []
+
+    @property
+    def chunks(self) -> list[tuple[bytes, int]]:
+        return self._chunks
+
+    @chunks.setter
+    def chunks(self, value: list[tuple[bytes, int]]):
+        self._chunks = value
+        self._hash = None
+
+    def add_chunk(self, blob_hash: bytes, size: int):
+        self._chunks.append((blob_hash, size))
+        self._hash = None
+
+    @property
+    def size(self) -> int:
+        return sum(size for _, size in self.chunks)
+
+    def serialize(self) -> bytes:
+        parts = [
+            _OBJECT_HEADER.pack(CHUNKED_BLOB_TAG, FORMAT_VERSION),
+            _MANIFEST_HEADER.pack(self.size, len(self.chunks))
+        ]
+        for blob_hash, size in self.chunks:
+            parts.append(_MANIFEST_ENTRY.pack(blob_hash, size))
+
+        return b''.join(parts)
+
+    @staticmethod
+    def deserialize(content: bytes) -> "ChunkedBlob":
+        _check_header(content, CHUNKED_BLOB_TAG)
+        _, count = _MANIFEST_HEADER.unpack_from(content, _OBJECT_HEADER.size)
+        offset = _OBJECT_HEADER.size + _MANIFEST_HEADER.size
+
+        return ChunkedBlob(list(_MANIFEST_ENTRY.iter_unpack(content[offset:offset + count * _MANIFEST_ENTRY.size])))
+
+    def get_hash(self) -> bytes:
+        if self._hash is None:
+            self._hash = hashlib.sha1(CHUNKED_BLOB_HASH_HEADER + self.serialize()).digest()
+
+        return self._hash
+
+    @staticmethod
+    def is_manifest(content: bytes) -> bool:
+        return bytes(content[:1]) == CHUNKED_BLOB_TAG
+
+    @staticmethod
+    def iterate_file_chunks(path: str):
+        '''Yield content-defined chunks of the file'''
+        with open(path, 'rb') as f:
+            yield from chunking.iterate_stream_chunks(f)
+
+    @staticmethod
+    @instrumentation.timed('hash.file')
+    def hash_file(path: str) -> bytes:
+        '''Return the hash of the manifest of the file without storing its chunks'''
+        manifest = ChunkedBlob()
+        for chunk in ChunkedBlob.iterate_file_chunks(path):
+            manifest.add_chunk(Blob.hash_content(chunk), len(chunk))
+
+        return manifest.get_hash()
 
 
 class Commit(CVSObject):
     '''Commit is reference to a top-level tree'''
     def __init__(self, tree: "Tree", message=''):
+        self._hash = None
+        # hash of the tree the cached commit hash was computed from
+        self._hashed_tree_hash = None
         self.tree = tree
         self.parent_commit_hash = b''
         self.message = message
 
+    @property
+    def parent_commit_hash(self) -> bytes:
+        return self._parent_commit_hash
+
+    @parent_commit_hash.setter
+    def parent_commit_hash(self, value: bytes):
+        self._parent_commit_hash = value
+        self._hash = None
+
+    def __getstate__(self):
+        return {'tree': self.tree, 'parent_commit_hash': self.parent_commit_hash, 'message': self.message}
+
+    def __setstate__(self, state):
+        self.__init__(state['tree'], state.get('message', ''))
+        self.parent_commit_hash = state['parent_commit_hash']
+
     def derive_commit(self, tree: "Tree", message='') -> "Commit":
         commit = Commit(tree, message)
         commit.parent_commit_hash = self.get_hash()
@@ -53,16 +236,42 @@ class Commit(CVSObject):
         return commit
 
     def serialize(self) -> bytes:
-        return pickle.dumps(self)
+        message = self.message.encode()
+        tree = self.tree.serialize()
+
+        return b''.join((
+            _OBJECT_HEADER.pack(COMMIT_TAG, FORMAT_VERSION),
+            _HASH_LENGTH.pack(len(self.parent_commit_hash)), self.parent_commit_hash,
+            _FIELD_LENGTH.pack(len(message)), message,
+            _FIELD_LENGTH.pack(len(tree)), tree
+        ))
 
     @staticmethod
+    @instrumentation.timed('objects.deserialize_commit')
     def deserialize(content: bytes) -> "Commit":
-        return pickle.loads(content)
+        if _is_pickled(content):
+            commit = pickle.loads(content)
+            _pin_legacy_tree_hash(commit.tree)
+            return commit
+        _check_header(content, COMMIT_TAG)
+        offset = _OBJECT_HEADER.size
+        parent_commit_hash, offset = _read_field(content, offset, _HASH_LENGTH)
+        message, offset = _read_field(content, offset, _FIELD_LENGTH)
+        tree, offset = _read_field(content, offset, _FIELD_LENGTH)
+
+        commit = Commit(Tree.deserialize(tree), message.decode())
+        commit.parent_commit_hash = parent_commit_hash
+
+        return commit
 
     def get_hash(self) -> bytes:
-        header = b'commit #\0'
+        tree_hash = self.tree.get_hash()
+        if self._hash is None or self._hashed_tree_hash != tree_hash:
+            header = b'commit #\0'
+            self._hash = hashlib.sha1(header + tree_hash + self.parent_commit_hash).digest()
+            self._hashed_tree_hash = tree_hash
 
-        return hashlib.sha1(header + self.tree.get_hash() + self.parent_commit_hash).digest()
+        return self._hash
 
     def __hash__(self):
         return int.from_bytes(self.get_hash(), byteorder='big', signed=True)
@@ -76,21 +285,89 @@ class Commit(CVSObject):
 class Tree(CVSObject):
     '''Tree is a collection of blobs and trees'''
     def __init__(self, is_removed=False):
+        self._hash = None
         self.children: dict[TreeObjectData, bytes] = {}
         self.is_removed = is_removed
 
+    @property
+    def children(self) -> dict["TreeObjectData", bytes]:
+        return self._children
+
+    @children.setter
+    def children(self, value: dict["TreeObjectData", bytes]):
+        self._children = _TreeChildren(self, value)
+        self._hash = None
+
+    @property
+    def is_removed(self) -> bool:
+        return self._is_removed
+
+    @is_removed.setter
+    def is_removed(self, value: bool):
+        self._is_removed = value
+        self._hash = None
+
+    def invalidate_hash(self):
+        self._hash = None
+
+    def __getstate__(self):
+        # layout of trees pickled by older versions, their hash is the sha1 of this pickle
+        return {'children': dict(self.children), 'is_removed': self.is_removed}
+
+    def __setstate__(self, state):
+        self.__init__(state.get('is_removed', False))
+        self.children = state['children']
+
     def add_object(self, data: "TreeObjectData", object_hash: bytes):
         self.children[data] = object_hash
 
     def serialize(self) -> bytes:
-        return pickle.dumps(self)
+        '''Entries are sorted, so equal trees always produce the same bytes'''
+        parts = [
+            _OBJECT_HEADER.pack(TREE_TAG, FORMAT_VERSION),
+            _TREE_HEADER.pack(self.is_removed, len(self.children))
+        ]
+        for data in sorted(self.children, key=TreeObjectData.sort_key):
+            path = data.path.encode()
+            object_hash = self.children[data]
+            parts.append(_TREE_ENTRY.pack(get_type_code(data.object_type), data.is_removed, len(path)))
+            parts.append(path)
+            parts.append(_HASH_LENGTH.pack(len(object_hash)))
+            parts.append(object_hash)
+
+        return b''.join(parts)
 
     @staticmethod
+    @instrumentation.timed('objects.deserialize_tree')
     def deserialize(content: bytes) -> "Tree":
-        return pickle.loads(content)
+        if _is_pickled(content):
+            tree = pickle.loads(content)
+            _pin_legacy_tree_hash(tree)
+            return tree
+        _check_header(content, TREE_TAG)
+        is_removed, count = _TREE_HEADER.unpack_from(content, _OBJECT_HEADER.size)
+        offset = _OBJECT_HEADER.size + _TREE_HEADER.size
+
+        children = {}
+        for _ in range(count):
+            type_code, entry_is_removed, path_length = _TREE_ENTRY.unpack_from(content, offset)
+            offset += _TREE_ENTRY.size
+            path = bytes(content[offset:offset + path_length]).decode()
+            offset += path_length
+            object_hash, offset = _read_field(content, offset, _HASH_LENGTH)
+            children[TreeObjectData(path, get_object_type(type_code), bool(entry_is_removed))] = object_hash
+
+        tree = Tree(is_removed=bool(is_removed))
+        tree.children = children
+
+        return tree
 
     def get_hash(self) -> bytes:
-        return hashlib.sha1(self.serialize()).digest()
+        if self._hash is None:
+            header = b'tree #\0'
+            self._hash = hashlib.sha1(header + self.serialize()).digest()
+
+        return self._hash
 
     @staticmethod
     def initialize_from_directory(directory: str) -> "Tree":
@@ -102,12 +379,12 @@ class Tree(CVSObject):
                 full_path = os.path.join(full_path, '')
                 file_data = TreeObjectData(full_path, Tree)
                 obj = Tree.initialize_from_directory(full_path)
+                object_hash = obj.get_hash()
             else:
                 file_data = TreeObjectData(full_path, Blob)
-                with open(full_path, 'rb') as f:
-                    obj = Blob(f.read())
+                object_hash = Blob.hash_file(full_path)
 
-            tree.add_object(file_data, obj.get_hash())
+            tree.add_object(file_data, object_hash)
 
         return tree
 
@@ -115,6 +392,54 @@ class Tree(CVSObject):
         return self.children == other.children and self.is_removed == other.is_removed
 
 
+class _TreeChildren(dict):
+    '''Children of a tree, any change drops the cached hash of the tree'''
+    def __init__(self, tree: Tree, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self._tree = tree
+
+    def __setitem__(self, key, value):
+        super().__setitem__(key, value)
+        self._tree.invalidate_hash()
+
+    def __delitem__(self, key):
+        super().__delitem__(key)
+        self._tree.invalidate_hash()
+
+    def clear(self):
+        super().clear()
+        self._tree.invalidate_hash()
+
+    def pop(self, *args):
+        value = super().pop(*args)
+        self._tree.invalidate_hash()
+        return value
+
+    def popitem(self):
+        item = super().popitem()
+        self._tree.invalidate_hash()
+        return item
+
+    def setdefault(self, key, default=None):
+        value = super().setdefault(key, default)
+        self._tree.invalidate_hash()
+        return value
+
+    def update(self, *args, **kwargs):
+        super().update(*args, **kwargs)
+        self._tree.invalidate_hash()
+
+    def __ior__(self, other):
+        self.update(other)
+        return self
+
+    def copy(self) -> dict:
+        return dict(self)
+
+    def __reduce__(self):
+        return dict, (dict(self),)
+
+
 @dataclass(eq=True, frozen=True)
 class TreeObjectData:
     path: str
@@ -124,3 +449,45 @@ class TreeObjectData:
     @property
     def name(self) -> str:
         return os.path.basename(self.path)
+
+    def sort_key(self) -> tuple:
+        return self.path, get_type_code(self.object_type), self.is_removed
+
+
+_TYPE_CODES: dict[type, int] = {Blob: 0, Tree: 1}
+_TYPES_BY_CODE: dict[int, type] = {code: object_type for object_type, code in _TYPE_CODES.items()}
+
+
+def get_type_code(object_type: type) -> int:
+    return _TYPE_CODES[object_type]
+
+
+def get_object_type(type_code: int) -> type:
+    try:
+        return _TYPES_BY_CODE[type_code]
+    except KeyError:
+        raise ValueError(f'unknown object type code: {type_code}') from None
+
+
+def _is_pickled(content: bytes) -> bool:
+    return content[:1] == PICKLE_PROTOCOL_OPCODE
+
+
+def _pin_legacy_tree_hash(tree: Tree):
+    '''Pickled trees keep the hash they were stored under: sha1 of their pickle'''
+    tree._hash = hashlib.sha1(pickle.dumps(tree)).digest()
+
+
+def _check_header(content: bytes, tag: bytes):
+    actual_tag, version = _OBJECT_HEADER.unpack_from(content, 0)
+    if actual_tag != tag:
+        raise ValueError(f'expected object with tag {tag!r}, got {actual_tag!r}')
+    if version > FORMAT_VERSION:
+        raise ValueError(f'unsupported object format version: {version}')
+
+
+def _read_field(content: bytes, offset: int, length_format: struct.Struct) -> tuple[bytes, int]:
+    length, = length_format.unpack_from(content, offset)
+    offset += length_format.size
+
+    return bytes(content[offset:offset + length]), offset + length
@@ -0,0 +1,110 @@
+import struct
+from itertools import accumulate
+
+from modules import compression
+
+# delta objects are stored as the encoded object marker, this identifier, the header and an encoded delta
+DELTA_IDENTIFIER = b'd'
+# shorter runs of equal lines are inserted, a copy instruction would not be smaller
+MIN_COPY_LENGTH = 32
+
+# hash of the base object, length of the chain of deltas ending with this object
+_HEADER = struct.Struct('>20sB')
+# size of the base, size of the target
+_SIZES = struct.Struct('>QQ')
+_INSERT = struct.Struct('>BQ')
+_COPY = struct.Struct('>BQQ')
+_INSERT_CODE = 0
+_COPY_CODE = 1
+
+HEADER_SIZE = len(compression.ENCODED_OBJECT_MARKER + DELTA_IDENTIFIER) + _HEADER.size
+
+
+def create_delta(base: bytes, target: bytes) -> bytes:
+    '''Return instructions building the target from pieces of the base and inserted data'''
+    base_lines = base.splitlines(keepends=True)
+    target_lines = target.splitlines(keepends=True)
+    offsets = [0, *accumulate(map(len, base_lines))]
+    first_positions = {}
+    for position, line in enumerate(base_lines):
+        first_positions.setdefault(line, position)
+
+    parts = [_SIZES.pack(len(base), len(target))]
+    inserted = []
+
+    def flush_inserted():
+        if inserted:
+            data = b''.join(inserted)
+            parts.append(_INSERT.pack(_INSERT_CODE, len(data)))
+            parts.append(data)
+            inserted.clear()
+
+    i = 0
+    expected = 0
+    while i < len(target_lines):
+        line = target_lines[i]
+        # prefer continuing the previous copy, lines are often repeated
+        if expected < len(base_lines) and base_lines[expected] == line:
+            start = expected
+        else:
+            start = first_positions.get(line)
+        if start is None:
+            inserted.append(line)
+            i += 1
+            continue
+
+        end = start
+        while i < len(target_lines) and end < len(base_lines) and base_lines[end] == target_lines[i]:
+            end += 1
+            i += 1
+        expected = end
+        length = offsets[end] - offsets[start]
+        if length < MIN_COPY_LENGTH:
+            inserted.append(base[offsets[start]:offsets[end]])
+            continue
+        flush_inserted()
+        parts.append(_COPY.pack(_COPY_CODE, offsets[start], length))
+    flush_inserted()
+
+    return b''.join(parts)
+
+
+def apply_delta(base: bytes, delta: bytes) -> bytes:
+    base_size, target_size = _SIZES.unpack_from(delta, 0)
+    if base_size != len(base):
+        raise ValueError('delta does not match the base object')
+    parts = []
+    position = _SIZES.size
+    while position < len(delta):
+        if delta[position] == _COPY_CODE:
+            _, offset, length = _COPY.unpack_from(delta, position)
+            position += _COPY.size
+            parts.append(base[offset:offset + length])
+        else:
+            _, length = _INSERT.unpack_from(delta, position)
+            position += _INSERT.size
+            parts.append(delta[position:position + length])
+            position += length
+    target = b''.join(parts)
+    if len(target) != target_size:
+        raise ValueError('delta is corrupted')
+
+    return target
+
+
+def encode(base_hash: bytes, depth: int, delta: bytes, codec: compression.Codec) -> bytes:
+    return compression.ENCODED_OBJECT_MARKER + DELTA_IDENTIFIER + _HEADER.pack(base_hash, depth) + \
+        compression.encode(delta, codec)
+
+
+def decode(content: bytes) -> bytes:
+    return compression.decode(content[HEADER_SIZE:])
+
+
+def is_delta(content: bytes) -> bool:
+    return content[:2] == compression.ENCODED_OBJECT_MARKER + DELTA_IDENTIFIER
+
+
+def read_header(content: bytes) -> tuple[bytes, int]:
+    '''Return the base hash and the chain depth of a stored delta'''
+    return _HEADER.unpack_from(content, 2)
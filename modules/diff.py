@@ -0,0 +1,182 @@
+from dataclasses import dataclass
+
+CONFLICT_START = b'<<<<<<<'
+CONFLICT_SEPARATOR = b'======='
+CONFLICT_END = b'>>>>>>>'
+
+
+def diff_matches(first: list, second: list) -> list[tuple[int, int]]:
+    '''Return pairs of indexes of lines which are kept by the shortest edit script (Myers, linear space)'''
+    interned = {}
+    a = [interned.setdefault(line, len(interned)) for line in first]
+    b = [interned.setdefault(line, len(interned)) for line in second]
+
+    matches = []
+    # tasks are either ranges to compare or lists of matches ready to be emitted, processed in order
+    tasks = [(0, len(a), 0, len(b))]
+    while tasks:
+        task = tasks.pop()
+        if isinstance(task, list):
+            matches.extend(task)
+            continue
+        a_low, a_high, b_low, b_high = task
+
+        prefix = []
+        while a_low < a_high and b_low < b_high and a[a_low] == b[b_low]:
+            prefix.append((a_low, b_low))
+            a_low += 1
+            b_low += 1
+        suffix = []
+        while a_low < a_high and b_low < b_high and a[a_high - 1] == b[b_high - 1]:
+            a_high -= 1
+            b_high -= 1
+            suffix.append((a_high, b_high))
+        suffix.reverse()
+        matches.extend(prefix)
+        if a_low == a_high or b_low == b_high:
+            matches.extend(suffix)
+            continue
+
+        x_start, y_start, x_end, y_end = _middle_snake(a, b, a_low, a_high, b_low, b_high)
+        snake = [(a_low + i, b_low + i - x_start + y_start) for i in range(x_start, x_end)]
+        tasks.append(suffix)
+        tasks.append((a_low + x_end, a_high, b_low + y_end, b_high))
+        tasks.append(snake)
+        tasks.append((a_low, a_low + x_start, b_low, b_low + y_start))
+
+    return matches
+
+
+def _middle_snake(a: list, b: list, a_low: int, a_high: int, b_low: int, b_high: int) -> tuple[int, int, int, int]:
+    '''Return the start and the end (relative to the lows) of the middle snake of an optimal path'''
+    n = a_high - a_low
+    m = b_high - b_low
+    delta = n - m
+    is_odd = delta % 2 == 1
+    max_d = (n + m + 1) // 2
+    offset = max_d + 1
+    forward = [0] * (2 * offset + 1)
+    # x coordinates of the backward search are counted from the end of the sequences
+    backward = [0] * (2 * offset + 1)
+
+    for d in range(max_d + 1):
+        for k in range(-d, d + 1, 2):
+            if k == -d or (k != d and forward[offset + k - 1] < forward[offset + k + 1]):
+                x = forward[offset + k + 1]
+            else:
+                x = forward[offset + k - 1] + 1
+            y = x - k
+            x_start, y_start = x, y
+            while x < n and y < m and a[a_low + x] == b[b_low + y]:
+                x += 1
+                y += 1
+            forward[offset + k] = x
+            backward_k = delta - k
+            if is_odd and -(d - 1) <= backward_k <= d - 1 and x + backward[offset + backward_k] >= n:
+                return x_start, y_start, x, y
+
+        for k in range(-d, d + 1, 2):
+            if k == -d or (k != d and backward[offset + k - 1] < backward[offset + k + 1]):
+                x = backward[offset + k + 1]
+            else:
+                x = backward[offset + k - 1] + 1
+            y = x - k
+            x_start, y_start = x, y
+            while x < n and y < m and a[a_high - 1 - x] == b[b_high - 1 - y]:
+                x += 1
+                y += 1
+            backward[offset + k] = x
+            forward_k = delta - k
+            if not is_odd and -d <= forward_k <= d and x + forward[offset + forward_k] >= n:
+                return n - x, m - y, n - x_start, m - y_start
+
+    raise AssertionError('middle snake was not found')
+
+
+def diff_opcodes(first: list, second: list) -> list[tuple[str, int, int, int, int]]:
+    '''Return difflib-like opcodes: equal, replace, delete and insert ranges'''
+    opcodes = []
+    i = j = 0
+    for first_index, second_index in [*diff_matches(first, second), (len(first), len(second))]:
+        if i < first_index and j < second_index:
+            opcodes.append(('replace', i, first_index, j, second_index))
+        elif i < first_index:
+            opcodes.append(('delete', i, first_index, j, second_index))
+        elif j < second_index:
+            opcodes.append(('insert', i, first_index, j, second_index))
+        if first_index < len(first):
+            if opcodes and opcodes[-1][0] == 'equal':
+                _, start_i, _, start_j, _ = opcodes.pop()
+                opcodes.append(('equal', start_i, first_index + 1, start_j, second_index + 1))
+            else:
+                opcodes.append(('equal', first_index, first_index + 1, second_index, second_index + 1))
+        i, j = first_index + 1, second_index + 1
+
+    return opcodes
+
+
+@dataclass
+class MergeResult:
+    lines: list[bytes]
+    conflicts: int
+
+    @property
+    def is_conflict(self) -> bool:
+        return self.conflicts > 0
+
+
+def merge3(base: list[bytes], ours: list[bytes], theirs: list[bytes],
+           ours_label=b'ours', theirs_label=b'theirs') -> MergeResult:
+    '''Merge changes of two versions of a file made since the base version, conflicts are marked by hunks'''
+    ours_matches = dict(diff_matches(base, ours))
+    theirs_matches = dict(diff_matches(base, theirs))
+
+    result = MergeResult([], 0)
+    base_index = ours_index = theirs_index = 0
+    while True:
+        # lines of the base kept in both versions split the files into independent chunks
+        sync = next((i for i in range(base_index, len(base)) if i in ours_matches and i in theirs_matches), None)
+        if sync is None:
+            base_end, ours_end, theirs_end = len(base), len(ours), len(theirs)
+        else:
+            base_end, ours_end, theirs_end = sync, ours_matches[sync], theirs_matches[sync]
+
+        _merge_chunk(result,
+                     base[base_index:base_end],
+                     ours[ours_index:ours_end],
+                     theirs[theirs_index:theirs_end],
+                     ours_label,
+                     theirs_label)
+        if sync is None:
+            return result
+
+        result.lines.append(base[sync])
+        base_index, ours_index, theirs_index = base_end + 1, ours_end + 1, theirs_end + 1
+
+
+def format_conflict(ours: list[bytes], theirs: list[bytes], ours_label=b'ours', theirs_label=b'theirs') -> list[bytes]:
+    return [
+        CONFLICT_START + b' ' + ours_label + b'\n',
+        *_terminate_lines(ours),
+        CONFLICT_SEPARATOR + b'\n',
+        *_terminate_lines(theirs),
+        CONFLICT_END + b' ' + theirs_label + b'\n'
+    ]
+
+
+def _merge_chunk(result: MergeResult, base: list[bytes], ours: list[bytes], theirs: list[bytes],
+                 ours_label: bytes, theirs_label: bytes):
+    if ours == theirs or theirs == base:
+        result.lines.extend(ours)
+    elif ours == base:
+        result.lines.extend(theirs)
+    else:
+        result.lines.extend(format_conflict(ours, theirs, ours_label, theirs_label))
+        result.conflicts += 1
+
+
+def _terminate_lines(lines: list[bytes]) -> list[bytes]:
+    if lines and not lines[-1].endswith(b'\n'):
+        return [*lines[:-1], lines[-1] + b'\n']
+
+    return lines
@@ -0,0 +1,27 @@
+import mmap
+import os
+
+
+def map_file(path: str, sequential=False, min_size=0) -> memoryview:
+    '''Return a read-only view of the file mapped into memory, the view keeps the mapping alive
+
+    Files smaller than min_size are read instead, mapping a few pages costs more than copying them.
+    '''
+    # only for immutable objects and packs under cool_cvs, truncating a mapped file kills the process with SIGBUS
+    with open(path, 'rb') as f:
+        size = os.fstat(f.fileno()).st_size
+        if not size:
+            # empty files can not be mapped
+            return memoryview(b'')
+        if size < min_size:
+            return memoryview(f.read())
+        mapped = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+    if sequential and hasattr(mapped, 'madvise') and hasattr(mmap, 'MADV_SEQUENTIAL'):
+        mapped.madvise(mmap.MADV_SEQUENTIAL)
+
+    return memoryview(mapped)
+
+
+def iterate_slices(view: memoryview, chunk_size: int):
+    for offset in range(0, len(view), chunk_size):
+        yield view[offset:offset + chunk_size]
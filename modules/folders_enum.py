@@ -11,3 +11,8 @@ class FoldersEnum(str, Enum):
     TAGS = f'{CVS_DATA_FOLDER_NAME}/refs/tags'
     OBJECTS = f'{CVS_DATA_FOLDER_NAME}/objects/'
     INDEX = f'{CVS_DATA_FOLDER_NAME}/index/'
+    INDEX_CACHE = f'{CVS_DATA_FOLDER_NAME}/index/cache'
+    CONFIG = f'{CVS_DATA_FOLDER_NAME}/config'
+    CHECKPOINTS = f'{CVS_DATA_FOLDER_NAME}/checkpoints/'
+    COMMIT_GRAPH = f'{CVS_DATA_FOLDER_NAME}/commit-graph'
+    PACKED_REFS = f'{CVS_DATA_FOLDER_NAME}/packed-refs'
@@ -0,0 +1,184 @@
+import ctypes
+import ctypes.util
+import errno
+import os
+import select
+import struct
+import sys
+import threading
+
+IN_MODIFY = 0x00000002
+IN_ATTRIB = 0x00000004
+IN_CLOSE_WRITE = 0x00000008
+IN_MOVED_FROM = 0x00000040
+IN_MOVED_TO = 0x00000080
+IN_CREATE = 0x00000100
+IN_DELETE = 0x00000200
+IN_DELETE_SELF = 0x00000400
+IN_MOVE_SELF = 0x00000800
+IN_Q_OVERFLOW = 0x00004000
+IN_IGNORED = 0x00008000
+IN_ONLYDIR = 0x01000000
+IN_DONT_FOLLOW = 0x02000000
+IN_ISDIR = 0x40000000
+IN_NONBLOCK = os.O_NONBLOCK
+IN_CLOEXEC = os.O_CLOEXEC
+
+WATCH_MASK = IN_MODIFY | IN_ATTRIB | IN_CLOSE_WRITE | IN_MOVED_FROM | IN_MOVED_TO | IN_CREATE | IN_DELETE \
+             | IN_DELETE_SELF | IN_MOVE_SELF | IN_ONLYDIR | IN_DONT_FOLLOW
+
+# watch descriptor, mask, cookie, length of the name which follows
+_EVENT = struct.Struct('@iIII')
+_READ_SIZE = 64 * 1024
+
+_libc = None
+
+
+def _get_libc():
+    global _libc
+    if _libc is None:
+        libc = ctypes.CDLL(ctypes.util.find_library('c') or 'libc.so.6', use_errno=True)
+        libc.inotify_init1.argtypes = [ctypes.c_int]
+        libc.inotify_add_watch.argtypes = [ctypes.c_int, ctypes.c_char_p, ctypes.c_uint32]
+        _libc = libc
+
+    return _libc
+
+
+def is_supported() -> bool:
+    '''inotify is available only on Linux'''
+    if not sys.platform.startswith('linux'):
+        return False
+    try:
+        return hasattr(_get_libc(), 'inotify_init1')
+    except OSError:
+        return False
+
+
+class FileSystemMonitor:
+    '''Collects paths changed in a directory tree using inotify, directories are given with a trailing slash'''
+    def __init__(self, directory: str, ignore=frozenset()):
+        self.directory = os.path.join(directory, '')
+        self.ignore = tuple(ignore)
+        self._fd = None
+        self._watches: dict[int, str] = {}
+        self._dirty: set[str] = set()
+        # a full scan is needed before the first query and after the event queue overflowed
+        self._is_synchronized = False
+        self._lock = threading.Lock()
+        # held while events are read and handled, so no read event waits unhandled in a buffer
+        self._read_lock = threading.Lock()
+        self._thread = None
+        self._stop_read, self._stop_write = None, None
+
+    def start(self):
+        fd = _get_libc().inotify_init1(IN_NONBLOCK | IN_CLOEXEC)
+        if fd < 0:
+            raise OSError(ctypes.get_errno(), 'inotify_init1 failed')
+        self._fd = fd
+        self._stop_read, self._stop_write = os.pipe()
+        try:
+            self._watch_tree(self.directory)
+        except OSError:
+            self.stop()
+            raise
+        self._thread = threading.Thread(target=self._run, name='fs-monitor', daemon=True)
+        self._thread.start()
+
+    def stop(self):
+        if self._thread is not None:
+            os.write(self._stop_write, b'\0')
+            self._thread.join()
+            self._thread = None
+        for fd in (self._fd, self._stop_read, self._stop_write):
+            if fd is not None:
+                os.close(fd)
+        self._fd = self._stop_read = self._stop_write = None
+        self._watches = {}
+
+    @property
+    def is_running(self) -> bool:
+        return self._thread is not None and self._thread.is_alive()
+
+    def take_changes(self):
+        '''Return paths changed since the previous call or None if the whole tree has to be scanned'''
+        if self.is_running:
+            # events of writes which already returned are queued, the thread could not have read them yet
+            with self._read_lock:
+                self._read_events()
+        with self._lock:
+            dirty = self._dirty
+            self._dirty = set()
+            if not self._is_synchronized or not self.is_running:
+                self._is_synchronized = True
+                return None
+
+        return dirty
+
+    def _run(self):
+        while True:
+            readable, _, _ = select.select([self._fd, self._stop_read], [], [])
+            if self._stop_read in readable:
+                return
+            with self._read_lock:
+                self._read_events()
+
+    def _read_events(self):
+        '''Handle every queued event'''
+        while True:
+            try:
+                data = os.read(self._fd, _READ_SIZE)
+            except BlockingIOError:
+                return
+            except OSError:
+                # changes could be lost, the next query scans the whole tree
+                with self._lock:
+                    self._is_synchronized = False
+                return
+            self._handle_events(data)
+
+    def _handle_events(self, data: bytes):
+        offset = 0
+        while offset < len(data):
+            wd, mask, _, length = _EVENT.unpack_from(data, offset)
+            offset += _EVENT.size
+            name = os.fsdecode(data[offset:offset + length].rstrip(b'\0'))
+            offset += length
+
+            if mask & IN_Q_OVERFLOW:
+                with self._lock:
+                    self._is_synchronized = False
+                continue
+            if mask & IN_IGNORED:
+                self._watches.pop(wd, None)
+                continue
+            directory = self._watches.get(wd)
+            if directory is None:
+                continue
+            path = os.path.join(directory, name) if name else directory
+            if mask & IN_ISDIR:
+                path = os.path.join(path, '')
+            if path.startswith(self.ignore):
+                continue
+            if mask & IN_ISDIR and mask & (IN_CREATE | IN_MOVED_TO):
+                # files could be created before the watch was added, so the directory is scanned
+                try:
+                    self._watch_tree(path)
+                except OSError:
+                    with self._lock:
+                        self._is_synchronized = False
+            with self._lock:
+                self._dirty.add(path)
+
+    def _watch_tree(self, directory: str):
+        for root, directories, _ in os.walk(directory):
+            root = os.path.join(root, '')
+            directories[:] = [name for name in directories if not os.path.join(root, name, '').startswith(self.ignore)]
+            wd = _get_libc().inotify_add_watch(self._fd, os.fsencode(root), WATCH_MASK)
+            if wd < 0:
+                error = ctypes.get_errno()
+                if error in (errno.ENOENT, errno.ENOTDIR):
+                    # removed while walking, the removal is reported by the parent watch
+                    continue
+                raise OSError(error, os.strerror(error), root)
+            self._watches[wd] = root
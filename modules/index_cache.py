@@ -0,0 +1,109 @@
+import json
+import os
+import time
+from dataclasses import dataclass
+
+from modules.cvs_objects import TreeObjectData, get_type_code, get_object_type
+
+INDEX_CACHE_VERSION = 1
+
+
+@dataclass(frozen=True)
+class IndexEntry:
+    mtime: int
+    size: int
+    inode: int
+    object_hash: bytes
+
+    def is_matching(self, stat: os.stat_result) -> bool:
+        return self.mtime == stat.st_mtime_ns and self.size == stat.st_size and self.inode == stat.st_ino
+
+
+class IndexCache:
+    '''Stat data and hashes of working tree files and the staged set, stored in cool_cvs/index/'''
+    def __init__(self, path: str, directory: str):
+        self.path = path
+        self.directory = os.path.join(directory, '')
+        self.entries: dict[str, IndexEntry] = {}
+        self.staged: set[TreeObjectData] = set()
+        # files modified in the same tick the cache was written can not be trusted
+        self.timestamp = 0
+        self.is_changed = False
+
+    @staticmethod
+    def load(path: str, directory: str) -> "IndexCache":
+        cache = IndexCache(path, directory)
+        try:
+            with open(path, 'r') as f:
+                content = json.load(f)
+        except (FileNotFoundError, ValueError):
+            return cache
+        if content.get('version') != INDEX_CACHE_VERSION:
+            return cache
+
+        cache.timestamp = content['timestamp']
+        for relative_path, (mtime, size, inode, object_hash) in content['entries'].items():
+            cache.entries[os.path.join(cache.directory, relative_path)] = IndexEntry(mtime, size, inode, bytes.fromhex(object_hash))
+        for relative_path, type_code, is_removed in content['staged']:
+            cache.staged.add(TreeObjectData(os.path.join(cache.directory, relative_path), get_object_type(type_code), is_removed))
+
+        return cache
+
+    def store(self):
+        if not os.path.isdir(os.path.dirname(self.path)):
+            return
+        self.timestamp = time.time_ns()
+        content = {
+            'version': INDEX_CACHE_VERSION,
+            'timestamp': self.timestamp,
+            'entries': {
+                self._relative(path): [entry.mtime, entry.size, entry.inode, entry.object_hash.hex()]
+                for path, entry in self.entries.items()
+            },
+            'staged': [
+                [self._relative(data.path), get_type_code(data.object_type), data.is_removed]
+                for data in self.staged
+            ]
+        }
+        temporary_path = self.path + '.tmp'
+        with open(temporary_path, 'w') as f:
+            json.dump(content, f, separators=(',', ':'))
+        os.replace(temporary_path, self.path)
+        self.is_changed = False
+
+    def get_hash(self, path: str, stat: os.stat_result):
+        '''Return the cached hash of a file or None if the file could change since it was hashed'''
+        entry = self.entries.get(path)
+        if entry is None or not entry.is_matching(stat):
+            return None
+        if entry.mtime >= self.timestamp:
+            # rewrite the cache with a newer timestamp once the file is hashed again
+            self.is_changed = True
+            return None
+
+        return entry.object_hash
+
+    def update_entry(self, path: str, stat: os.stat_result, object_hash: bytes):
+        entry = IndexEntry(stat.st_mtime_ns, stat.st_size, stat.st_ino, object_hash)
+        if self.entries.get(path) != entry:
+            self.entries[path] = entry
+            self.is_changed = True
+
+    def retain(self, paths):
+        '''Forget entries of files which are not in paths'''
+        paths = set(paths)
+        for path in [path for path in self.entries if path not in paths]:
+            del self.entries[path]
+            self.is_changed = True
+
+    def set_staged(self, staged):
+        staged = set(staged)
+        if staged != self.staged:
+            self.staged = staged
+            self.is_changed = True
+
+    def _relative(self, path: str) -> str:
+        if path.startswith(self.directory):
+            return path[len(self.directory):]
+
+        return path
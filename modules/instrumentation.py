@@ -0,0 +1,196 @@
+import os
+import time
+import inspect
+import functools
+import threading
+from dataclasses import dataclass, field
+
+# set to 1 to print a profile of every shell command, to trace to also record spans
+ENVIRONMENT_VARIABLE = 'CVS_PROFILE'
+# later spans are only counted, so tracing a long session does not grow memory without bound
+MAX_SPANS = 10000
+
+
+@dataclass
+class Timing:
+    calls: int = 0
+    total: float = 0.0
+
+
+@dataclass
+class Span:
+    name: str
+    depth: int
+    # seconds since the profile was started
+    start: float
+    duration: float
+
+
+@dataclass
+class Profile:
+    '''Counters, timers and spans collected while instrumentation is enabled'''
+    counters: dict[str, int] = field(default_factory=dict)
+    timings: dict[str, Timing] = field(default_factory=dict)
+    spans: list[Span] = field(default_factory=list)
+    dropped_spans: int = 0
+    started: float = field(default_factory=time.perf_counter)
+
+
+# checked before anything else, so disabled instrumentation costs a call and a global lookup
+_enabled = False
+_tracing = False
+_profile = Profile()
+_lock = threading.Lock()
+_local = threading.local()
+
+
+def enable(trace=False):
+    global _enabled, _tracing
+    _enabled = True
+    _tracing = trace
+
+
+def disable():
+    global _enabled, _tracing
+    _enabled = False
+    _tracing = False
+
+
+def is_enabled() -> bool:
+    return _enabled
+
+
+def is_tracing() -> bool:
+    return _tracing
+
+
+def enable_from_environment() -> bool:
+    '''Enable instrumentation if the environment variable asks for it, return True if it was enabled'''
+    value = os.environ.get(ENVIRONMENT_VARIABLE, '').strip().lower()
+    if value in ('', '0', 'no', 'off'):
+        return False
+    enable(trace=value == 'trace')
+
+    return True
+
+
+def get_profile() -> Profile:
+    return _profile
+
+
+def reset() -> Profile:
+    '''Start a new profile, return the previous one'''
+    global _profile
+    with _lock:
+        profile, _profile = _profile, Profile()
+
+    return profile
+
+
+def count(name: str, value: int = 1):
+    if not _enabled:
+        return
+    with _lock:
+        _profile.counters[name] = _profile.counters.get(name, 0) + value
+
+
+def add_time(name: str, duration: float):
+    if not _enabled:
+        return
+    with _lock:
+        timing = _profile.timings.get(name)
+        if timing is None:
+            timing = _profile.timings[name] = Timing()
+        timing.calls += 1
+        timing.total += duration
+
+
+def timed(name: str):
+    '''Decorator adding the duration of every call to the timer with the name'''
+    def decorator(function):
+        @functools.wraps(function)
+        def wrapper(*args, **kwargs):
+            if not _enabled:
+                return function(*args, **kwargs)
+            start = time.perf_counter()
+            try:
+                return function(*args, **kwargs)
+            finally:
+                add_time(name, time.perf_counter() - start)
+
+        return wrapper
+
+    return decorator
+
+
+def traced(name: str):
+    '''Decorator recording a span of every call while tracing, nested calls are recorded deeper'''
+    def decorator(function):
+        @functools.wraps(function)
+        def wrapper(*args, **kwargs):
+            if not _tracing:
+                return function(*args, **kwargs)
+            depth = getattr(_local, 'depth', 0)
+            _local.depth = depth + 1
+            start = time.perf_counter()
+            try:
+                return function(*args, **kwargs)
+            finally:
+                _local.depth = depth
+                _add_span(name, depth, start, time.perf_counter() - start)
+
+        return wrapper
+
+    return decorator
+
+
+def trace_methods(exclude=frozenset()):
+    '''Class decorator tracing public methods, generators are skipped as their calls do no work'''
+    def decorator(cls):
+        for name, attribute in list(vars(cls).items()):
+            if name.startswith('_') or name in exclude:
+                continue
+            is_static = isinstance(attribute, staticmethod)
+            function = attribute.__func__ if is_static else attribute
+            if not inspect.isfunction(function) or inspect.isgeneratorfunction(function):
+                continue
+            wrapper = traced(f'{cls.__name__}.{name}')(function)
+            setattr(cls, name, staticmethod(wrapper) if is_static else wrapper)
+
+        return cls
+
+    return decorator
+
+
+def _add_span(name: str, depth: int, start: float, duration: float):
+    with _lock:
+        if len(_profile.spans) >= MAX_SPANS:
+            _profile.dropped_spans += 1
+            return
+        _profile.spans.append(Span(name, depth, start - _profile.started, duration))
+
+
+def format_profile(profile: Profile) -> str:
+    '''Return a readable report of the profile'''
+    lines = []
+    if profile.counters:
+        lines.append('counters:')
+        width = max(map(len, profile.counters))
+        for name, value in sorted(profile.counters.items()):
+            lines.append(f'  {name:<{width}}  {value}')
+    if profile.timings:
+        lines.append('timers:')
+        width = max(map(len, profile.timings))
+        for name, timing in sorted(profile.timings.items(), key=lambda item: -item[1].total):
+            lines.append(f'  {name:<{width}}  {timing.calls} calls  {timing.total * 1000:.3f} ms')
+    if profile.spans:
+        lines.append('spans:')
+        # spans are recorded when they end, so inner spans come before outer ones
+        for span in sorted(profile.spans, key=lambda span: (span.start, span.depth)):
+            lines.append(f'  {span.start * 1000:10.3f} ms  {"  " * span.depth}{span.name}  {span.duration * 1000:.3f} ms')
+        if profile.dropped_spans:
+            lines.append(f'  {profile.dropped_spans} more spans are not kept')
+    if not lines:
+        lines.append('nothing was recorded')
+
+    return '\n'.join(lines)
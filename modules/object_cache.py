@@ -0,0 +1,45 @@
+from collections import OrderedDict
+
+from modules.cvs_objects import CVSObject
+
+
+class ObjectCache:
+    '''LRU cache of decoded objects keyed by hash, bounded by the size of their stored content'''
+    def __init__(self, max_size: int):
+        self.max_size = max_size
+        self.size = 0
+        self.hits = 0
+        self.misses = 0
+        self._objects: OrderedDict[str, tuple[CVSObject, int]] = OrderedDict()
+
+    def get(self, key: str):
+        item = self._objects.get(key)
+        if item is None:
+            self.misses += 1
+            return None
+        self._objects.move_to_end(key)
+        self.hits += 1
+
+        return item[0]
+
+    def put(self, key: str, obj: CVSObject, size: int):
+        if size > self.max_size:
+            return
+        previous = self._objects.pop(key, None)
+        if previous is not None:
+            self.size -= previous[1]
+        self._objects[key] = (obj, size)
+        self.size += size
+        while self.size > self.max_size:
+            _, (_, evicted_size) = self._objects.popitem(last=False)
+            self.size -= evicted_size
+
+    def clear(self):
+        self._objects.clear()
+        self.size = 0
+
+    def __contains__(self, key: str):
+        return key in self._objects
+
+    def __len__(self):
+        return len(self._objects)
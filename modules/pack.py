@@ -0,0 +1,373 @@
+import os
+import bisect
+import hashlib
+import struct
+import tempfile
+import threading
+
+from modules.file_view import map_file, iterate_slices
+from modules.transaction import write_file_atomically, fsync_directory
+
+PACK_DIRECTORY = 'pack'
+# pack described by indexes of the first version, later packs are named by the hash of their content
+PACK_FILE_NAME = 'objects.pack'
+INDEX_FILE_NAME = 'objects.idx'
+
+PACK_SIGNATURE = b'CVSP'
+INDEX_SIGNATURE = b'CVSI'
+PACK_VERSION = 1
+# the second version of the index names its pack file, the third one records when objects were packed
+INDEX_VERSION = 3
+_NAMED_PACK_INDEX_VERSION = 2
+
+_HEADER = struct.Struct('>4sB')
+_PACK_NAME_LENGTH = struct.Struct('>B')
+_INDEX_COUNT = struct.Struct('>I')
+# object hash, offset in pack file, length of stored content
+_INDEX_ENTRY_WITHOUT_TIME = struct.Struct('>20sQQ')
+# and the time in seconds the object was stored, unreachable objects are kept for the gc grace period after it
+_INDEX_ENTRY = struct.Struct('>20sQQQ')
+
+
+class PackIndex:
+    '''Sorted hash -> (offset, length) table of a pack file, kept in memory'''
+    def __init__(self, keys: list[bytes], locations: list[tuple[int, int]], pack_name: str = None, stat=None,
+                 times: list[int] = None):
+        self.keys = keys
+        self.locations = locations
+        self.times = times if times is not None else [0] * len(keys)
+        self.pack_name = pack_name
+        self.stat = stat
+        self._pack_view = None
+        self._lock = threading.Lock()
+
+    def find(self, name: str):
+        try:
+            key = bytes.fromhex(name)
+        except ValueError:
+            return None
+        position = bisect.bisect_left(self.keys, key)
+        if position < len(self.keys) and self.keys[position] == key:
+            return self.locations[position]
+
+        return None
+
+    def items(self):
+        return zip(self.keys, self.locations)
+
+    def get_times(self) -> dict[bytes, int]:
+        return dict(zip(self.keys, self.times))
+
+    def read(self, path_to_pack: str, offset: int, length: int) -> bytes:
+        return bytes(self.get_view(path_to_pack, offset, length))
+
+    def get_view(self, path_to_pack: str, offset: int, length: int) -> memoryview:
+        '''Return a slice of the memory mapped pack file'''
+        if self._pack_view is None:
+            with self._lock:
+                if self._pack_view is None:
+                    self._pack_view = map_file(path_to_pack)
+
+        return self._pack_view[offset:offset + length]
+
+    def close(self):
+        with self._lock:
+            if self._pack_view is not None:
+                # the mapping is closed when the last slice given out is released
+                self._pack_view.release()
+                self._pack_view = None
+
+    def __len__(self):
+        return len(self.keys)
+
+    def __del__(self):
+        self.close()
+
+    @staticmethod
+    def load(path_to_index: str) -> "PackIndex":
+        stat = os.stat(path_to_index)
+        with open(path_to_index, 'rb') as f:
+            content = f.read()
+        signature, version = _HEADER.unpack_from(content, 0)
+        if signature != INDEX_SIGNATURE or version not in (PACK_VERSION, _NAMED_PACK_INDEX_VERSION, INDEX_VERSION):
+            raise ValueError(f'unsupported pack index: {path_to_index}')
+        position = _HEADER.size
+        pack_name = PACK_FILE_NAME
+        if version != PACK_VERSION:
+            length, = _PACK_NAME_LENGTH.unpack_from(content, position)
+            position += _PACK_NAME_LENGTH.size
+            pack_name = content[position:position + length].decode()
+            position += length
+        count, = _INDEX_COUNT.unpack_from(content, position)
+        entry = _INDEX_ENTRY if version == INDEX_VERSION else _INDEX_ENTRY_WITHOUT_TIME
+        keys = []
+        locations = []
+        times = []
+        for key, offset, length, *packed_time in entry.iter_unpack(
+                content[position + _INDEX_COUNT.size:][:count * entry.size]):
+            keys.append(key)
+            locations.append((offset, length))
+            # older indexes do not record it, their objects count from the last time the index was written
+            times.append(packed_time[0] if packed_time else int(stat.st_mtime))
+
+        return PackIndex(keys, locations, pack_name, (stat.st_mtime_ns, stat.st_size, stat.st_ino), times)
+
+    @staticmethod
+    def empty() -> "PackIndex":
+        return PackIndex([], [])
+
+    def serialize(self) -> bytes:
+        pack_name = self.pack_name.encode()
+        parts = [_HEADER.pack(INDEX_SIGNATURE, INDEX_VERSION), _PACK_NAME_LENGTH.pack(len(pack_name)), pack_name,
+                 _INDEX_COUNT.pack(len(self.keys))]
+        for key, (offset, length), packed_time in zip(self.keys, self.locations, self.times):
+            parts.append(_INDEX_ENTRY.pack(key, offset, length, packed_time))
+
+        return b''.join(parts)
+
+
+class PackStorage:
+    '''Pack file with a sorted index naming it, stored in objects/pack/
+
+    Repack appends objects after the part described by the index, rewrite writes a new pack.
+    Both switch to the new state by renaming the index, so readers see either the old or the new one.
+    '''
+    _indexes: dict[str, PackIndex] = {}
+    _lock = threading.Lock()
+
+    @staticmethod
+    def get_pack_directory(path_to_objects: str) -> str:
+        return os.path.join(path_to_objects, PACK_DIRECTORY)
+
+    @staticmethod
+    def get_pack_path(path_to_objects: str, index: PackIndex = None) -> str:
+        '''Return the path of the pack file described by the index, the current one by default'''
+        if index is None:
+            index = PackStorage.get_index(path_to_objects)
+        return os.path.join(path_to_objects, PACK_DIRECTORY, index.pack_name or PACK_FILE_NAME)
+
+    @staticmethod
+    def get_index_path(path_to_objects: str) -> str:
+        return os.path.join(path_to_objects, PACK_DIRECTORY, INDEX_FILE_NAME)
+
+    @staticmethod
+    def get_index(path_to_objects: str) -> PackIndex:
+        key = os.path.abspath(path_to_objects)
+        index = PackStorage._indexes.get(key)
+        if index is None:
+            with PackStorage._lock:
+                index = PackStorage._indexes.get(key)
+                if index is None:
+                    index = PackStorage._load_index(path_to_objects)
+                    PackStorage._indexes[key] = index
+
+        return index
+
+    @staticmethod
+    def refresh_index(path_to_objects: str) -> bool:
+        '''Reload the index if it was changed on disk, return True if it was reloaded'''
+        index = PackStorage.get_index(path_to_objects)
+        try:
+            stat = os.stat(PackStorage.get_index_path(path_to_objects))
+            current = (stat.st_mtime_ns, stat.st_size, stat.st_ino)
+        except FileNotFoundError:
+            current = None
+        if current == index.stat:
+            return False
+
+        PackStorage.invalidate(path_to_objects)
+        PackStorage.get_index(path_to_objects)
+        return True
+
+    @staticmethod
+    def invalidate(path_to_objects: str):
+        index = PackStorage._indexes.pop(os.path.abspath(path_to_objects), None)
+        if index is not None:
+            index.close()
+
+    @staticmethod
+    def read(name: str, path_to_objects: str):
+        '''Return a view of stored content of an object or None if the pack does not contain it'''
+        try:
+            return PackStorage._get_view(name, path_to_objects)
+        except FileNotFoundError:
+            # the pack could be replaced by another process after the index was loaded
+            if not PackStorage.refresh_index(path_to_objects):
+                raise
+            return PackStorage._get_view(name, path_to_objects)
+
+    @staticmethod
+    def iterate_chunks(name: str, path_to_objects: str, chunk_size: int):
+        '''Yield views of stored content of a packed object by pieces, the object must be in the pack'''
+        view = PackStorage.read(name, path_to_objects)
+        yield from iterate_slices(view, chunk_size)
+
+    @staticmethod
+    def _get_view(name: str, path_to_objects: str):
+        index = PackStorage.get_index(path_to_objects)
+        location = index.find(name)
+        if location is None:
+            return None
+        offset, length = location
+        path_to_pack = PackStorage.get_pack_path(path_to_objects, index)
+        view = index.get_view(path_to_pack, offset, length)
+        if len(view) != length:
+            raise EOFError(f'pack file is truncated: {path_to_pack}')
+
+        return view
+
+    @staticmethod
+    def contains(name: str, path_to_objects: str) -> bool:
+        return PackStorage.get_index(path_to_objects).find(name) is not None
+
+    @staticmethod
+    def enumerate_loose_objects(path_to_objects: str):
+        '''Yield (name, path) of every object stored as a separate file'''
+        if not os.path.isdir(path_to_objects):
+            return
+        for directory in os.scandir(path_to_objects):
+            if not directory.is_dir() or not _is_hex(directory.name, 2):
+                continue
+            for file in os.scandir(directory.path):
+                if file.is_file() and _is_hex(file.name, 38):
+                    yield directory.name + file.name, file.path
+
+    @staticmethod
+    def repack(path_to_objects: str) -> int:
+        '''Move loose objects into the pack file, return the number of moved objects'''
+        loose = list(PackStorage.enumerate_loose_objects(path_to_objects))
+        if not loose:
+            return 0
+
+        index = PackStorage.get_index(path_to_objects)
+        if index.pack_name is None:
+            return PackStorage.rewrite(path_to_objects, {bytes.fromhex(name) for name, _ in loose})
+        entries = dict(index.items())
+        times = index.get_times()
+        # the described part of the pack is not changed, readers of the current index are not affected
+        with open(PackStorage.get_pack_path(path_to_objects, index), 'ab') as pack:
+            for name, path in loose:
+                key = bytes.fromhex(name)
+                if key in entries:
+                    continue
+                with open(path, 'rb') as f:
+                    content = f.read()
+                    times[key] = int(os.fstat(f.fileno()).st_mtime)
+                entries[key] = (pack.tell(), len(content))
+                pack.write(content)
+            pack.flush()
+            os.fsync(pack.fileno())
+
+        PackStorage.write_index(path_to_objects, index.pack_name, entries, times)
+        _remove_loose_objects(loose)
+
+        return len(loose)
+
+    @staticmethod
+    def rewrite(path_to_objects: str, keep: set[bytes]) -> int:
+        '''Write a new pack of kept packed and loose objects, other loose objects stay, return the number of moved objects'''
+        loose = [(name, path) for name, path in PackStorage.enumerate_loose_objects(path_to_objects)
+                 if bytes.fromhex(name) in keep]
+        index = PackStorage.get_index(path_to_objects)
+        pack_directory = PackStorage.get_pack_directory(path_to_objects)
+        os.makedirs(pack_directory, exist_ok=True)
+        entries = {}
+        # objects keep the time they were stored, so rewriting does not extend their grace period
+        times = index.get_times()
+        digest = hashlib.sha1()
+        fd, temporary_path = tempfile.mkstemp(prefix='tmp_', suffix='.pack', dir=pack_directory)
+        try:
+            with open(fd, 'wb') as pack:
+                def write(content):
+                    pack.write(content)
+                    digest.update(content)
+
+                write(_HEADER.pack(PACK_SIGNATURE, PACK_VERSION))
+                if index.pack_name is not None:
+                    path_to_pack = PackStorage.get_pack_path(path_to_objects, index)
+                    for key, (offset, length) in index.items():
+                        if key in keep:
+                            entries[key] = (pack.tell(), length)
+                            write(index.get_view(path_to_pack, offset, length))
+                for name, path in loose:
+                    key = bytes.fromhex(name)
+                    if key in entries:
+                        continue
+                    with open(path, 'rb') as f:
+                        content = f.read()
+                        times[key] = int(os.fstat(f.fileno()).st_mtime)
+                    entries[key] = (pack.tell(), len(content))
+                    write(content)
+                pack.flush()
+                os.fsync(pack.fileno())
+
+            pack_name = f'pack-{digest.hexdigest()}.pack'
+            path_to_new_pack = os.path.join(pack_directory, pack_name)
+            # a pack with the same name has the same content, it could be described by the current index
+            if os.path.exists(path_to_new_pack):
+                os.remove(temporary_path)
+            else:
+                os.replace(temporary_path, path_to_new_pack)
+                fsync_directory(pack_directory)
+        except BaseException:
+            if os.path.exists(temporary_path):
+                os.remove(temporary_path)
+            raise
+
+        PackStorage.write_index(path_to_objects, pack_name, entries, times)
+        # views of the old pack stay valid, the mapping outlives the file name
+        if index.pack_name is not None and index.pack_name != pack_name:
+            old_pack = PackStorage.get_pack_path(path_to_objects, index)
+            if os.path.exists(old_pack):
+                os.remove(old_pack)
+        _remove_loose_objects(loose)
+
+        return len(loose)
+
+    @staticmethod
+    def remove_stale_files(path_to_objects: str, expire: float):
+        '''Remove temporary files and packs no index describes, left by interrupted writes before expire'''
+        pack_directory = PackStorage.get_pack_directory(path_to_objects)
+        if not os.path.isdir(pack_directory):
+            return
+        PackStorage.refresh_index(path_to_objects)
+        current = PackStorage.get_pack_path(path_to_objects)
+        for file in os.scandir(pack_directory):
+            is_stale = file.name.startswith('tmp_') or file.name.endswith('.pack') and file.path != current
+            if is_stale and file.is_file() and file.stat().st_mtime < expire:
+                os.remove(file.path)
+
+    @staticmethod
+    def write_index(path_to_objects: str, pack_name: str, entries: dict[bytes, tuple[int, int]],
+                    times: dict[bytes, int]):
+        '''Switch to the pack with an atomic rename of its index'''
+        keys = sorted(entries)
+        index = PackIndex(keys, [entries[key] for key in keys], pack_name, times=[times[key] for key in keys])
+        write_file_atomically(PackStorage.get_index_path(path_to_objects), index.serialize())
+        PackStorage.invalidate(path_to_objects)
+
+    @staticmethod
+    def _load_index(path_to_objects: str) -> PackIndex:
+        try:
+            return PackIndex.load(PackStorage.get_index_path(path_to_objects))
+        except FileNotFoundError:
+            return PackIndex.empty()
+
+
+def _remove_loose_objects(loose: list[tuple[str, str]]):
+    for _, path in loose:
+        os.remove(path)
+    for directory in {os.path.dirname(path) for _, path in loose}:
+        if not os.listdir(directory):
+            os.rmdir(directory)
+
+
+def _is_hex(name: str, length: int) -> bool:
+    if len(name) != length:
+        return False
+    try:
+        int(name, 16)
+    except ValueError:
+        return False
+
+    return True
@@ -0,0 +1,81 @@
+import bisect
+import os
+
+PACKED_REFS_HEADER = '# packed-refs\n'
+
+
+class PackedRefs:
+    '''Sorted "<commit hash> <name>" lines of references which do not have their own files'''
+    def __init__(self, path: str):
+        self.path = path
+        self.names: list[str] = []
+        self.hashes: list[str] = []
+        self._stat = ()
+
+    def refresh(self):
+        '''Reload the file if it was changed on disk'''
+        try:
+            stat = os.stat(self.path)
+            current = (stat.st_mtime_ns, stat.st_size, stat.st_ino)
+        except FileNotFoundError:
+            current = None
+        if current == self._stat:
+            return
+
+        names = []
+        hashes = []
+        if current is not None:
+            with open(self.path, 'r') as f:
+                for line in f:
+                    if line.startswith('#') or not line.strip():
+                        continue
+                    commit_hash, name = line.rstrip('\n').split(' ', 1)
+                    names.append(name)
+                    hashes.append(commit_hash)
+        self.names = names
+        self.hashes = hashes
+        self._stat = current
+
+    def find(self, name: str):
+        '''Return the commit hash of a packed reference or None'''
+        self.refresh()
+        position = bisect.bisect_left(self.names, name)
+        if position < len(self.names) and self.names[position] == name:
+            return self.hashes[position]
+
+        return None
+
+    def get_names(self, prefix: str) -> list[str]:
+        '''Return names of packed references starting with the prefix, without the prefix'''
+        self.refresh()
+        start = bisect.bisect_left(self.names, prefix)
+        end = start
+        while end < len(self.names) and self.names[end].startswith(prefix):
+            end += 1
+
+        return [name[len(prefix):] for name in self.names[start:end]]
+
+    def items(self) -> dict[str, str]:
+        self.refresh()
+
+        return dict(zip(self.names, self.hashes))
+
+    def store(self, refs: dict[str, str]):
+        '''Replace the file atomically, readers see either the old or the new references'''
+        temporary_path = self.path + '.tmp'
+        with open(temporary_path, 'w') as f:
+            f.write(PACKED_REFS_HEADER)
+            for name in sorted(refs):
+                f.write(f'{refs[name]} {name}\n')
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(temporary_path, self.path)
+
+    def remove(self, name: str) -> bool:
+        '''Remove a packed reference, return False if it is not packed'''
+        refs = self.items()
+        if refs.pop(name, None) is None:
+            return False
+        self.store(refs)
+
+        return True
@@ -29,7 +29,7 @@ class Head(Reference):
             self.content = item.get_hash()
             self.commit = item
         elif isinstance(item, Branch):
-            self.content = f'ref: {FoldersEnum.REFS}{item.name}'.encode()
+            self.content = f'ref: {FoldersEnum.REFS.value}{item.name}'.encode()
             self.branch = item
 
     def get_pointer(self) -> bytes:
@@ -0,0 +1,45 @@
+import os
+from concurrent.futures import ThreadPoolExecutor
+
+from modules import instrumentation
+
+
+def get_workers_count(workers: int = None) -> int:
+    '''Return the number of threads to use, 0 or None means one per cpu'''
+    if not workers:
+        return os.cpu_count() or 1
+
+    return workers
+
+
+@instrumentation.timed('scanner.walk_directory')
+def walk_directory(directory: str, ignore=frozenset()) -> tuple[list[str], list[tuple[str, os.stat_result]]]:
+    '''Return all subdirectories (with a trailing slash) and all files with their stat data'''
+    directories = []
+    files = []
+    stack = [directory]
+    while stack:
+        with os.scandir(stack.pop()) as entries:
+            for entry in entries:
+                if entry.is_dir():
+                    path = os.path.join(entry.path, '')
+                    if path in ignore:
+                        continue
+                    directories.append(path)
+                    stack.append(path)
+                elif entry.path not in ignore:
+                    files.append((entry.path, entry.stat()))
+    instrumentation.count('scanner.files', len(files))
+
+    return directories, files
+
+
+def parallel_map(function, items, workers: int = None) -> list:
+    '''Apply function to every item using a pool of threads, results keep the order of items'''
+    items = list(items)
+    workers = min(get_workers_count(workers), len(items))
+    if workers <= 1:
+        return [function(item) for item in items]
+
+    with ThreadPoolExecutor(max_workers=workers) as executor:
+        return list(executor.map(function, items))
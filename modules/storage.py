@@ -1,8 +1,27 @@
 import os
 import abc
+import hashlib
+import tempfile
+from contextlib import contextmanager
+from dataclasses import dataclass, field
 
-from modules.cvs_objects import CVSObject
+from modules.cvs_objects import CVSObject, Blob, ChunkedBlob, BLOB_HASH_HEADER, BLOB_TAG, CHUNK_SIZE
 from modules.references import Reference
+from modules.folders_enum import FoldersEnum
+from modules.pack import PackStorage
+from modules.file_view import map_file, iterate_slices
+from modules.transaction import WriteTransaction, write_file_atomically, fsync_directory
+from modules import compression, delta, instrumentation
+
+
+# enough decoded bytes to recognize a chunked blob manifest
+REFERENCES_HEAD_SIZE = 256
+# content with a zero byte among this many first bytes is treated as binary
+BINARY_CHECK_SIZE = 8000
+# smaller loose objects, most commits and trees, are read instead of mapped
+MIN_MAPPED_SIZE = 64 * 1024
+# replaced whenever objects are removed, so other processes know their sets of stored objects are stale
+REMOVAL_STAMP_FILE_NAME = 'removed'
 
 
 class KVStorage(metaclass=abc.ABCMeta):
@@ -34,24 +53,189 @@ class FolderStorage(KVStorage):
             return f.read()
 
 
+@dataclass
+class CompressionReport:
+    objects: int = 0
+    raw_size: int = 0
+    stored_size: int = 0
+    codecs: dict[str, int] = field(default_factory=dict)
+
+    @property
+    def ratio(self) -> float:
+        if not self.stored_size:
+            return 1.0
+
+        return self.raw_size / self.stored_size
+
+
 class CVSStorage(FolderStorage):
+    _codecs: dict[str, compression.Codec] = {}
+    _chunking_thresholds: dict[str, int] = {}
+    _transactions: dict[str, WriteTransaction] = {}
+    # ids of stored objects loaded on the first lookup, with the removal stamp they were loaded at
+    _known_objects: dict[str, tuple[set[bytes], tuple]] = {}
+
+    @staticmethod
+    def set_codec(path_to_objects: str, codec_name: str):
+        '''Choose the codec used to store new objects in the repository'''
+        CVSStorage._codecs[os.path.abspath(path_to_objects)] = compression.get_codec(codec_name)
+
+    @staticmethod
+    def get_codec(path_to_objects: str) -> compression.Codec:
+        codec = CVSStorage._codecs.get(os.path.abspath(path_to_objects))
+        if codec is None:
+            return compression.get_codec(compression.DEFAULT_CODEC)
+
+        return codec
+
+    @staticmethod
+    def set_chunking_threshold(path_to_objects: str, min_size: int):
+        '''Store files of at least min_size bytes as chunks, 0 disables chunking'''
+        CVSStorage._chunking_thresholds[os.path.abspath(path_to_objects)] = min_size
+
+    @staticmethod
+    def is_chunked_file(path: str, path_to_objects: str) -> bool:
+        min_size = CVSStorage._chunking_thresholds.get(os.path.abspath(path_to_objects), 0)
+
+        return bool(min_size) and os.path.getsize(path) >= min_size
+
+    @staticmethod
+    def hash_file(path: str, path_to_objects: str) -> bytes:
+        '''Return the hash the file would be stored under'''
+        if CVSStorage.is_chunked_file(path, path_to_objects):
+            return ChunkedBlob.hash_file(path)
+
+        return Blob.hash_file(path)
+
+    @staticmethod
+    @contextmanager
+    def transaction(path_to_objects: str, workers: int = None):
+        '''Objects stored inside become visible on exit, after all of them are flushed to disk'''
+        key = os.path.abspath(path_to_objects)
+        if key in CVSStorage._transactions:
+            # nested transactions are a part of the outer one
+            yield CVSStorage._transactions[key]
+            return
+
+        transaction = WriteTransaction(workers)
+        CVSStorage._transactions[key] = transaction
+        try:
+            yield transaction
+            for path in transaction.commit():
+                CVSStorage._remember_object(path, path_to_objects)
+        except BaseException:
+            transaction.rollback()
+            raise
+        finally:
+            del CVSStorage._transactions[key]
+
+    @staticmethod
+    def get_transaction(path_to_objects: str):
+        return CVSStorage._transactions.get(os.path.abspath(path_to_objects))
+
+    @staticmethod
+    def contains_object(name: str, source: str) -> bool:
+        '''Check if the object is stored or is going to be stored by the current transaction'''
+        if bytes.fromhex(name) in CVSStorage.get_known_objects(source):
+            return True
+        transaction = CVSStorage.get_transaction(source)
+
+        return transaction is not None and \
+            transaction.contains(os.path.join(CVSStorage.get_object_directory(source, name), name[2:]))
+
     @staticmethod
+    def get_known_objects(path_to_objects: str) -> set[bytes]:
+        '''Return ids of loose and packed objects, objects stored later by this process are added'''
+        key = os.path.abspath(path_to_objects)
+        # gc of another process could remove known objects, then it replaces the removal stamp
+        stamp = CVSStorage._get_removal_stamp(path_to_objects)
+        known, known_stamp = CVSStorage._known_objects.get(key, (None, None))
+        if known is None or known_stamp != stamp:
+            known = {bytes.fromhex(name) for name, _ in PackStorage.enumerate_loose_objects(path_to_objects)}
+            PackStorage.refresh_index(path_to_objects)
+            known.update(PackStorage.get_index(path_to_objects).keys)
+            CVSStorage._known_objects[key] = known, stamp
+
+        return known
+
+    @staticmethod
+    def forget_known_objects(path_to_objects: str):
+        '''Reload the known ids on the next lookup, objects could be deleted'''
+        CVSStorage._known_objects.pop(os.path.abspath(path_to_objects), None)
+
+    @staticmethod
+    def _mark_objects_removed(path_to_objects: str):
+        '''Make every process reload the known ids'''
+        write_file_atomically(os.path.join(path_to_objects, REMOVAL_STAMP_FILE_NAME), b'')
+        CVSStorage.forget_known_objects(path_to_objects)
+
+    @staticmethod
+    def _get_removal_stamp(path_to_objects: str):
+        try:
+            stat = os.stat(os.path.join(path_to_objects, REMOVAL_STAMP_FILE_NAME))
+        except FileNotFoundError:
+            return None
+
+        return stat.st_mtime_ns, stat.st_ino
+
+    @staticmethod
+    def _remember_object(path: str, path_to_objects: str):
+        known, _ = CVSStorage._known_objects.get(os.path.abspath(path_to_objects), (None, None))
+        if known is not None:
+            known.add(bytes.fromhex(os.path.basename(os.path.dirname(path)) + os.path.basename(path)))
+
+    @staticmethod
+    def _get_references_temporary_directory(destination: str) -> str:
+        '''Return the repository data directory holding the references, or the destination outside of a repository'''
+        path = os.path.abspath(destination)
+        while os.path.basename(path) != FoldersEnum.CVS_DATA_FOLDER_NAME:
+            parent = os.path.dirname(path)
+            if parent == path:
+                return destination
+            path = parent
+
+        return path
+
+    @staticmethod
+    def _make_directory(path: str, path_to_objects: str):
+        transaction = CVSStorage.get_transaction(path_to_objects)
+        if transaction is not None:
+            transaction.make_directory(path)
+        else:
+            os.makedirs(path, exist_ok=True)
+
+    @staticmethod
+    @instrumentation.timed('storage.store_object')
     def store_object(name: str, content: bytes, obj_type: type, destination: str):
         if issubclass(obj_type, CVSObject):
+            # objects are addressed by their content, an existing one never has to be rewritten
+            if CVSStorage.contains_object(name, destination):
+                instrumentation.count('storage.skipped_objects')
+                return
             truncated_name = name[2:]
             item_directory = CVSStorage.get_object_directory(destination, name)
-            CVSStorage.store(truncated_name, content, item_directory)
+            content = compression.encode(content, CVSStorage.get_codec(destination))
+            CVSStorage._make_directory(item_directory, destination)
+            CVSStorage.replace_file(os.path.join(item_directory, truncated_name), content, destination)
+            instrumentation.count('storage.stored_objects')
+            instrumentation.count('storage.stored_bytes', len(content))
         elif issubclass(obj_type, Reference):
-            CVSStorage.store(name, content, destination)
+            os.makedirs(destination, exist_ok=True)
+            # a temporary file left by a crash in a reference directory would be listed as a reference
+            write_file_atomically(os.path.join(destination, name), content,
+                                  CVSStorage._get_references_temporary_directory(destination))
         else:
             raise NotImplementedError
 
     @staticmethod
+    @instrumentation.timed('storage.read_object')
     def read_object(name: str, obj_type: type, source: str) -> bytes:
         if issubclass(obj_type, CVSObject):
-            truncated_name = name[2:]
-            item_directory = CVSStorage.get_object_directory(source, name)
-            return CVSStorage.read(truncated_name, item_directory)
+            content = CVSStorage._decode_stored_object(CVSStorage.read_stored_object(name, source), source)
+            instrumentation.count('storage.read_objects')
+            instrumentation.count('storage.read_bytes', len(content))
+
+            return content
         elif issubclass(obj_type, Reference):
             content = CVSStorage.read(name, source)
 
@@ -59,6 +243,350 @@ class CVSStorage(FolderStorage):
         else:
             raise NotImplementedError
 
+    @staticmethod
+    def read_stored_object(name: str, source: str) -> bytes:
+        '''Return a view of an object as it is stored on disk, without decoding'''
+        packed = PackStorage.read(name, source)
+        if packed is not None:
+            return packed
+        path = os.path.join(CVSStorage.get_object_directory(source, name), name[2:])
+        try:
+            return CVSStorage.get_file_view(path)
+        except FileNotFoundError:
+            # the object could be moved to the pack by another process
+            if not PackStorage.refresh_index(source):
+                raise
+            packed = PackStorage.read(name, source)
+            if packed is None:
+                raise
+            return packed
+
+    @staticmethod
+    def _decode_stored_object(stored: bytes, source: str) -> bytes:
+        deltas = []
+        while delta.is_delta(stored):
+            deltas.append(delta.decode(stored))
+            base_hash, _ = delta.read_header(stored)
+            stored = CVSStorage.read_stored_object(base_hash.hex(), source)
+        content = compression.decode(stored)
+        for instructions in reversed(deltas):
+            content = delta.apply_delta(content, instructions)
+
+        return content
+
+    @staticmethod
+    def store_delta(name: str, base_name: str, destination: str, max_depth: int, min_size=0, max_size=None) -> bool:
+        '''Replace a loose object by a delta against the base object, return True if the delta was stored'''
+        if name == base_name:
+            return False
+        path = os.path.join(CVSStorage.get_object_directory(destination, name), name[2:])
+        try:
+            with open(path, 'rb') as f:
+                header = f.read(delta.HEADER_SIZE)
+        except FileNotFoundError:
+            return False
+        if delta.is_delta(header):
+            return False
+
+        # the chain must not get too long or come back to the object itself
+        depth = 1
+        chain_name = base_name
+        while True:
+            header = CVSStorage.read_stored_header(chain_name, destination, delta.HEADER_SIZE)
+            if not delta.is_delta(header):
+                break
+            base_hash, _ = delta.read_header(header)
+            chain_name = base_hash.hex()
+            depth += 1
+            if chain_name == name or depth > max_depth:
+                return False
+        if depth > max_depth:
+            return False
+
+        # both versions are held in memory, so larger objects are never decoded whole
+        content = CVSStorage._read_limited(name, destination, max_size)
+        if content is None or len(content) < min_size or not _is_text_blob(content):
+            return False
+        base = CVSStorage._read_limited(base_name, destination, max_size)
+        if base is None or not _is_text_blob(base):
+            return False
+        instructions = delta.create_delta(base, content)
+        if len(instructions) * 2 > len(content):
+            return False
+
+        encoded = delta.encode(bytes.fromhex(base_name), depth, instructions, CVSStorage.get_codec(destination))
+        CVSStorage.replace_file(path, encoded, destination)
+
+        return True
+
+    @staticmethod
+    def _read_limited(name: str, source: str, max_size: int = None):
+        '''Return the decoded object or None if it is larger than max_size'''
+        chunks = []
+        size = 0
+        for chunk in CVSStorage.iterate_object(name, source):
+            size += len(chunk)
+            if max_size is not None and size > max_size:
+                return None
+            chunks.append(bytes(chunk))
+
+        return b''.join(chunks)
+
+    @staticmethod
+    def replace_file(path: str, content: bytes, temporary_directory: str):
+        '''Write the file through a temporary one, so mapped views of the old file stay valid'''
+        transaction = CVSStorage.get_transaction(temporary_directory)
+        if transaction is not None:
+            transaction.write_file(path, content, temporary_directory)
+            return
+        fd, temporary_path = tempfile.mkstemp(prefix='tmp_', dir=temporary_directory)
+        try:
+            with open(fd, 'wb') as f:
+                f.write(content)
+                f.flush()
+                os.fsync(f.fileno())
+            os.replace(temporary_path, path)
+        except BaseException:
+            if os.path.exists(temporary_path):
+                os.remove(temporary_path)
+            raise
+        # like a committed transaction, the new name and a new object directory are flushed too
+        directory = os.path.dirname(path)
+        fsync_directory(directory)
+        fsync_directory(os.path.dirname(directory))
+        CVSStorage._remember_object(path, temporary_directory)
+
+    @staticmethod
+    def read_stored_header(name: str, source: str, size: int) -> bytes:
+        '''Return at most size first bytes of an object as it is stored on disk'''
+        return next(CVSStorage._iterate_stored_object(name, source, size), b'')
+
+    @staticmethod
+    @instrumentation.timed('storage.store_blob_from_file')
+    def store_blob_from_file(path: str, destination: str, chunk_size=CHUNK_SIZE) -> bytes:
+        '''Hash and store file content as a blob reading it by chunks, return the blob hash'''
+        if CVSStorage.is_chunked_file(path, destination):
+            return CVSStorage.store_chunked_blob_from_file(path, destination)
+        # hashing a mapped file is much cheaper than compressing and writing it again
+        blob_hash = Blob.hash_file(path)
+        if CVSStorage.contains_object(blob_hash.hex(), destination):
+            instrumentation.count('storage.skipped_objects')
+            return blob_hash
+        codec = CVSStorage.get_codec(destination)
+        compressor = codec.compressobj()
+        digest = hashlib.sha1(BLOB_HASH_HEADER)
+        CVSStorage._make_directory(destination, destination)
+        fd, temporary_path = tempfile.mkstemp(prefix='tmp_', dir=destination)
+        try:
+            with open(fd, 'wb') as stored, open(path, 'rb') as f:
+                stored.write(compression.ENCODED_OBJECT_MARKER + codec.identifier)
+                stored.write(compressor.compress(Blob.serialize_header()))
+                for chunk in iter(lambda: f.read(chunk_size), b''):
+                    digest.update(chunk)
+                    stored.write(compressor.compress(chunk))
+                stored.write(compressor.flush())
+                instrumentation.count('storage.stored_objects')
+                instrumentation.count('storage.stored_bytes', stored.tell())
+            name = digest.hexdigest()
+            item_directory = CVSStorage.get_object_directory(destination, name)
+            CVSStorage._make_directory(item_directory, destination)
+            transaction = CVSStorage.get_transaction(destination)
+            if transaction is not None:
+                transaction.add_file(temporary_path, os.path.join(item_directory, name[2:]))
+            else:
+                os.replace(temporary_path, os.path.join(item_directory, name[2:]))
+                CVSStorage._remember_object(os.path.join(item_directory, name[2:]), destination)
+        except BaseException:
+            if os.path.exists(temporary_path):
+                os.remove(temporary_path)
+            raise
+
+        return digest.digest()
+
+    @staticmethod
+    def store_chunked_blob_from_file(path: str, destination: str) -> bytes:
+        '''Store chunks of the file which are not stored yet and their manifest, return the manifest hash'''
+        manifest = ChunkedBlob()
+        for chunk in ChunkedBlob.iterate_file_chunks(path):
+            chunk_hash = Blob.hash_content(chunk)
+            name = chunk_hash.hex()
+            if not CVSStorage.contains_object(name, destination):
+                CVSStorage.store_object(name, Blob(bytes(chunk)).serialize(), Blob, destination)
+            manifest.add_chunk(chunk_hash, len(chunk))
+        CVSStorage.store_object(manifest.get_hash().hex(), manifest.serialize(), ChunkedBlob, destination)
+
+        return manifest.get_hash()
+
+    @staticmethod
+    def iterate_object(name: str, source: str, chunk_size=CHUNK_SIZE):
+        '''Yield decoded content of an object by pieces of at most chunk_size bytes'''
+        stored_chunks = CVSStorage._iterate_stored_object(name, source, chunk_size)
+        head = next(stored_chunks, b'')
+        while len(head) < 2:
+            chunk = next(stored_chunks, None)
+            if chunk is None:
+                break
+            head += chunk
+        if delta.is_delta(head):
+            stored = b''.join(_prepend(head, stored_chunks))
+            content = CVSStorage._decode_stored_object(stored, source)
+            for offset in range(0, len(content), chunk_size):
+                yield content[offset:offset + chunk_size]
+            return
+        codec = compression.get_stored_codec(head)
+        if codec is None:
+            yield head
+            yield from stored_chunks
+            return
+
+        yield from codec.decompress_stream(_prepend(head[2:], stored_chunks), chunk_size)
+
+    @staticmethod
+    def restore_blob_to_file(name: str, source: str, path: str, chunk_size=CHUNK_SIZE):
+        '''Write content of a stored blob to a file without loading it in memory'''
+        with open(path, 'wb') as f:
+            for chunk in CVSStorage.iterate_blob_content(name, source, chunk_size):
+                f.write(chunk)
+
+    @staticmethod
+    def iterate_blob_content(name: str, source: str, chunk_size=CHUNK_SIZE):
+        '''Yield the content of a blob, chunked blobs are joined from their chunks'''
+        stored_chunks = CVSStorage.iterate_object(name, source, chunk_size)
+        head = b''
+        for chunk in stored_chunks:
+            head += chunk
+            if head:
+                break
+        if not ChunkedBlob.is_manifest(head):
+            yield from Blob.iterate_content(_prepend(head, stored_chunks))
+            return
+
+        manifest = ChunkedBlob.deserialize(head + b''.join(stored_chunks))
+        for blob_hash, _ in manifest.chunks:
+            yield from Blob.iterate_content(CVSStorage.iterate_object(blob_hash.hex(), source, chunk_size))
+
+    @staticmethod
+    def _iterate_stored_object(name: str, source: str, chunk_size: int):
+        if not PackStorage.contains(name, source):
+            path = os.path.join(CVSStorage.get_object_directory(source, name), name[2:])
+            try:
+                view = map_file(path, sequential=True, min_size=MIN_MAPPED_SIZE)
+            except FileNotFoundError:
+                if not PackStorage.refresh_index(source) or not PackStorage.contains(name, source):
+                    raise
+            else:
+                yield from iterate_slices(view, chunk_size)
+                return
+
+        yield from PackStorage.iterate_chunks(name, source, chunk_size)
+
+    @staticmethod
+    def repack(path_to_objects: str, keep: set[bytes] = None) -> int:
+        '''Move all loose objects into the pack file, or only the kept ones dropping other packed objects'''
+        if keep is None:
+            return PackStorage.repack(path_to_objects)
+        moved = PackStorage.rewrite(path_to_objects, keep)
+        CVSStorage._mark_objects_removed(path_to_objects)
+
+        return moved
+
+    @staticmethod
+    def enumerate_object_references(name: str, source: str):
+        '''Yield hashes of objects needed to read the object: its delta bases and chunks of a chunked blob'''
+        yield from CVSStorage._enumerate_delta_bases(name, source)
+        stored_chunks = CVSStorage.iterate_object(name, source, REFERENCES_HEAD_SIZE)
+        head = b''
+        for chunk in stored_chunks:
+            head += chunk
+            if head:
+                break
+        if not ChunkedBlob.is_manifest(head):
+            return
+        for chunk_hash, _ in ChunkedBlob.deserialize(head + b''.join(stored_chunks)).chunks:
+            yield chunk_hash
+            yield from CVSStorage._enumerate_delta_bases(chunk_hash.hex(), source)
+
+    @staticmethod
+    def _enumerate_delta_bases(name: str, source: str):
+        while True:
+            header = CVSStorage.read_stored_header(name, source, delta.HEADER_SIZE)
+            if not delta.is_delta(header):
+                return
+            base_hash, _ = delta.read_header(header)
+            yield base_hash
+            name = base_hash.hex()
+
+    @staticmethod
+    def prune_objects(path_to_objects: str, reachable: set[bytes], expire: float) -> int:
+        '''Remove unreachable loose objects and temporary files modified before expire, return the number of removed objects'''
+        loose = list(PackStorage.enumerate_loose_objects(path_to_objects))
+        # newer objects could be written by an operation in progress, they are kept with the objects they need
+        for name, path in loose:
+            key = bytes.fromhex(name)
+            if key not in reachable and os.stat(path).st_mtime >= expire:
+                reachable.add(key)
+                reachable.update(CVSStorage.enumerate_object_references(name, path_to_objects))
+
+        removed = [path for name, path in loose if bytes.fromhex(name) not in reachable]
+        for path in removed:
+            os.remove(path)
+        for directory in {os.path.dirname(path) for path in removed}:
+            if not os.listdir(directory):
+                os.rmdir(directory)
+        # left by interrupted writes
+        for file in os.scandir(path_to_objects):
+            if file.name.startswith('tmp_') and file.is_file() and file.stat().st_mtime < expire:
+                os.remove(file.path)
+        PackStorage.remove_stale_files(path_to_objects, expire)
+        CVSStorage._mark_objects_removed(path_to_objects)
+
+        return len(removed)
+
+    @staticmethod
+    def prune_packed_objects(path_to_objects: str, reachable: set[bytes], expire: float) -> int:
+        '''Repack kept objects without unreachable objects packed before expire, return the number of dropped objects'''
+        index = PackStorage.get_index(path_to_objects)
+        # like loose objects, newer packed objects are kept with the objects they need
+        for key, packed_time in zip(index.keys, index.times):
+            if key not in reachable and packed_time >= expire:
+                reachable.add(key)
+                reachable.update(CVSStorage.enumerate_object_references(key.hex(), path_to_objects))
+        dropped = sum(1 for key in index.keys if key not in reachable)
+        CVSStorage.repack(path_to_objects, keep=reachable)
+
+        return dropped
+
+    @staticmethod
+    def get_stored_size(path_to_objects: str) -> int:
+        '''Return the size of all files in the objects directory'''
+        size = 0
+        for directory, _, files in os.walk(path_to_objects):
+            size += sum(os.path.getsize(os.path.join(directory, file)) for file in files)
+
+        return size
+
+    @staticmethod
+    def get_compression_report(path_to_objects: str) -> CompressionReport:
+        '''Compare the size of stored objects with the size of their decoded content'''
+        report = CompressionReport()
+        stored_objects = ((name, CVSStorage.get_file_content(path))
+                          for name, path in PackStorage.enumerate_loose_objects(path_to_objects))
+        index = PackStorage.get_index(path_to_objects)
+        packed_objects = ((key.hex(), index.read(PackStorage.get_pack_path(path_to_objects, index), offset, length))
+                          for key, (offset, length) in index.items())
+        for name, stored in (*stored_objects, *packed_objects):
+            if delta.is_delta(stored):
+                codec_name = 'delta'
+            else:
+                codec = compression.get_stored_codec(stored)
+                codec_name = codec.name if codec else 'raw'
+            report.objects += 1
+            report.stored_size += len(stored)
+            report.raw_size += len(CVSStorage._decode_stored_object(stored, path_to_objects))
+            report.codecs[codec_name] = report.codecs.get(codec_name, 0) + 1
+
+        return report
+
     @staticmethod
     def get_object_directory(path_to_objects: str, name: str) -> str:
         return os.path.join(path_to_objects, name[:2])
@@ -67,3 +595,19 @@ class CVSStorage(FolderStorage):
     def get_file_content(path: str):
         with open(path, 'rb') as f:
             return f.read()
+
+    @staticmethod
+    def get_file_view(path: str) -> memoryview:
+        '''Return content of the file, large files are mapped into memory instead of copying them'''
+        return map_file(path, min_size=MIN_MAPPED_SIZE)
+
+
+def _is_text_blob(content: bytes) -> bool:
+    # deltas are line based, manifests and binary content gain nothing from them
+    return content[:1] == BLOB_TAG and b'\0' not in content[:BINARY_CHECK_SIZE]
+
+
+def _prepend(first: bytes, chunks):
+    if first:
+        yield first
+    yield from chunks
@@ -0,0 +1,104 @@
+import os
+import tempfile
+import threading
+
+from modules.scanner import parallel_map
+
+
+class WriteTransaction:
+    '''Files written in a transaction are renamed into place together, after all of them are flushed to disk'''
+    def __init__(self, workers: int = None):
+        self.workers = workers
+        # final path -> temporary path
+        self._files: dict[str, str] = {}
+        self._directories: set[str] = set()
+        self._lock = threading.Lock()
+
+    def make_directory(self, path: str):
+        '''Create a directory once per transaction'''
+        if path in self._directories:
+            return
+        os.makedirs(path, exist_ok=True)
+        with self._lock:
+            self._directories.add(path)
+
+    def add_file(self, temporary_path: str, path: str):
+        '''Take a written temporary file, it is moved to the path on commit'''
+        with self._lock:
+            previous = self._files.get(path)
+            self._files[path] = temporary_path
+        if previous is not None:
+            os.remove(previous)
+
+    def write_file(self, path: str, content: bytes, temporary_directory: str):
+        fd, temporary_path = tempfile.mkstemp(prefix='tmp_', dir=temporary_directory)
+        try:
+            with open(fd, 'wb') as f:
+                f.write(content)
+        except BaseException:
+            os.remove(temporary_path)
+            raise
+        self.add_file(temporary_path, path)
+
+    def contains(self, path: str) -> bool:
+        return path in self._files
+
+    def commit(self) -> list[str]:
+        '''Move the files into place, return their paths'''
+        files = list(self._files.items())
+        parallel_map(lambda item: fsync_file(item[1]), files, self.workers)
+        for path, temporary_path in files:
+            os.replace(temporary_path, path)
+        self._files = {}
+
+        # new names and new directories are durable only when their parents are flushed too
+        directories = {os.path.dirname(path) for path, _ in files}
+        for directory in directories | {os.path.dirname(directory) for directory in directories}:
+            fsync_directory(directory)
+
+        return [path for path, _ in files]
+
+    def rollback(self):
+        for temporary_path in self._files.values():
+            if os.path.exists(temporary_path):
+                os.remove(temporary_path)
+        self._files = {}
+
+
+def fsync_file(path: str):
+    fd = os.open(path, os.O_RDONLY)
+    try:
+        os.fsync(fd)
+    finally:
+        os.close(fd)
+
+
+def fsync_directory(path: str):
+    if not hasattr(os, 'O_DIRECTORY'):
+        # directories can not be opened on Windows
+        return
+    fd = os.open(path, os.O_RDONLY | os.O_DIRECTORY)
+    try:
+        os.fsync(fd)
+    finally:
+        os.close(fd)
+
+
+def write_file_atomically(path: str, content: bytes, temporary_directory: str = None):
+    '''Replace the file so readers and crashes see either the old or the new content
+
+    The temporary file is created in the directory of the file unless another one on the same file system is given.
+    '''
+    directory = os.path.dirname(path)
+    fd, temporary_path = tempfile.mkstemp(prefix='tmp_', dir=temporary_directory or directory)
+    try:
+        with open(fd, 'wb') as f:
+            f.write(content)
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(temporary_path, path)
+    except BaseException:
+        if os.path.exists(temporary_path):
+            os.remove(temporary_path)
+        raise
+    fsync_directory(directory)
@@ -1,81 +1,73 @@
 import os
-import shutil
-import difflib
 
 from modules.cvs_objects import Tree, TreeObjectData, Blob
 from modules.storage import CVSStorage
+from modules.scanner import walk_directory, parallel_map
 
 
-def initialize_and_store_tree_from_directory(directory: str, destination: str) -> Tree:
+def initialize_and_store_tree_from_directory(directory: str, destination: str, workers: int = None) -> Tree:
     '''Return a Tree object representing a directory'''
-    tree = Tree()
-    for file in os.listdir(directory):
-        full_path = os.path.join(directory, file)
-        if os.path.isdir(full_path):
-            full_path = os.path.join(full_path, '')
-            file_data = TreeObjectData(full_path, Tree)
-            obj = initialize_and_store_tree_from_directory(full_path, destination)
-        else:
-            file_data = TreeObjectData(full_path, Blob)
-            with open(full_path, 'rb') as f:
-                obj = Blob(f.read())
+    root = os.path.join(directory, '')
+    directories, files = walk_directory(directory)
+    trees = {path: Tree() for path in [root, *directories]}
+
+    blob_hashes = parallel_map(lambda path: CVSStorage.store_blob_from_file(path, destination),
+                               (path for path, _ in files),
+                               workers)
+    for (path, _), blob_hash in zip(files, blob_hashes):
+        trees[os.path.join(os.path.dirname(path), '')].add_object(TreeObjectData(path, Blob), blob_hash)
 
-        tree.add_object(file_data, obj.get_hash())
-        CVSStorage.store_object(obj.get_hash().hex(), obj.serialize(), file_data.object_type, destination)
+    # nested directories go first, so every tree is complete before it is hashed
+    for path in sorted(directories, key=len, reverse=True):
+        tree = trees[path]
+        tree_hash = tree.get_hash()
+        CVSStorage.store_object(tree_hash.hex(), tree.serialize(), Tree, destination)
+        parent = os.path.join(os.path.dirname(path[:-1]), '')
+        trees[parent].add_object(TreeObjectData(path, Tree), tree_hash)
 
-    return tree # слеши
+    return trees[root]
 
 
-def initialize_and_store_tree_from_collection(collection, destination: str) -> Tree:
+def initialize_and_store_tree_from_collection(collection, destination: str, workers: int = None) -> Tree:
     tree = Tree()
+    files = [data.path for data in collection if data.object_type != Tree and not data.is_removed]
+    blob_hashes = dict(zip(files, parallel_map(lambda path: CVSStorage.store_blob_from_file(path, destination),
+                                               files,
+                                               workers)))
     for data in collection:
         path = data.path
         if data.object_type == Tree:
             if not data.is_removed:
-                obj = initialize_and_store_tree_from_directory(path, destination)
+                obj = initialize_and_store_tree_from_directory(path, destination, workers)
                 obj_data = TreeObjectData(path, Tree)
             else:
                 obj = Tree()
                 obj_data = TreeObjectData(path, Tree, is_removed=True)
-            CVSStorage.store_object(obj.get_hash().hex(), obj.serialize(), Tree, destination)
+            object_hash = obj.get_hash()
+            CVSStorage.store_object(object_hash.hex(), obj.serialize(), Tree, destination)
+        elif not data.is_removed:
+            obj_data = TreeObjectData(path, Blob)
+            object_hash = blob_hashes[path]
         else:
-            if not data.is_removed:
-                obj_data = TreeObjectData(path, Blob)
-                with open(path, 'rb') as f:
-                    obj = Blob(f.read())
-            else:
-                obj = Blob(b'')
-                obj_data = TreeObjectData(path, Blob, is_removed=True)
-            CVSStorage.store_object(obj.get_hash().hex(), obj.serialize(), Blob, destination)
+            obj = Blob(b'')
+            obj_data = TreeObjectData(path, Blob, is_removed=True)
+            object_hash = obj.get_hash()
+            CVSStorage.store_object(object_hash.hex(), obj.serialize(), Blob, destination)
 
-        tree.add_object(obj_data, b'' if obj_data.is_removed else obj.get_hash())
+        tree.add_object(obj_data, b'' if obj_data.is_removed else object_hash)
 
     return tree
 
 
-def listdir_with_trailing_slash(directory: str):
-    for item in os.listdir(directory):
-        if os.path.isdir(item):
-            yield os.path.join(item, '')
-        else:
-            yield item
-
+def create_diff_file(path: str, lines: list[bytes]):
+    with open(path, 'wb') as f:
+        f.writelines(lines)
 
-def create_diff_file(path: str, first: list[str], second: list[str]):
-    with open(path, 'w') as f:
-        f.writelines(difflib.ndiff(first, second))
 
-
-def rmdir(path, ignore=None):
-    if ignore is None:
-        ignore = []
-    for item in os.listdir(path):
-        item = os.path.join(path, item)
-        if os.path.isdir(item):
-            item = os.path.join(item, '')
-        if item in ignore:
-            continue
-        if os.path.isdir(item):
-            shutil.rmtree(item)
-        else:
-            os.remove(item)
+def iterate_parent_directories(path: str, root: str):
+    '''Yield directories between the file and the root, excluding the root'''
+    root = os.path.join(root, '')
+    directory = os.path.dirname(path)
+    while os.path.join(directory, '') != root and directory.startswith(root):
+        yield directory
+        directory = os.path.dirname(directory)
@@ -1,11 +1,14 @@
 import argparse
 import cmd
 import os
+import sys
 
 from modules.cvs import CVS
-from modules.cvs_objects import Tree, TreeObjectData, Blob
+from modules.cvs_objects import Tree, TreeObjectData, Blob, Commit
 from modules.references import Head, Branch
 from modules.rebase_state import RebaseState
+from modules.compression import get_codecs_names
+from modules import instrumentation
 
 
 class ExitCmdExecution(Exception):
@@ -39,16 +42,36 @@ class CVSShell(cmd.Cmd):
         self._commit_parser = None
         self._rebase_parser = None
         self._reset_parser = None
+        self._gc_parser = None
         self._initialize_argparsers()
+        # print a profile of every command to stderr
+        self._profile_commands = instrumentation.enable_from_environment()
+
+    def precmd(self, line: str) -> str:
+        if self._profile_commands:
+            instrumentation.reset()
+        return line
+
+    def postcmd(self, stop, line: str):
+        if self._profile_commands and line.strip():
+            print(instrumentation.format_profile(instrumentation.get_profile()), file=sys.stderr)
+        return stop
 
     def do_init(self, arg: str):
-        '''Initialize repository'''
+        '''Initialize repository
+        init [compression codec: zlib|lzma|bz2|none]'''
         if CVS.is_repository_exists(self.working_directory):
             return
+        compression = arg.strip() or None
+        if compression and compression not in get_codecs_names():
+            print(f'unknown compression codec: {compression}')
+            return
 
+        self._close_repository()
         self.cvs = CVS(self.working_directory)
-        self.cvs.initialize_repository()
+        self.cvs.initialize_repository(compression)
         self.path_to_repository = self.working_directory
+        self._start_monitor()
 
         print(f'initialized repository at {self.working_directory}')
 
@@ -107,6 +130,8 @@ class CVSShell(cmd.Cmd):
             else:
                 data = TreeObjectData(path, Blob, is_removed=is_removed)
             self.cvs.add_to_staged(data)
+        # written once, rewriting the index for every file makes staging quadratic
+        self.cvs.index.store()
 
     def do_reset(self, arg):
         '''Move head and current branch to specified commit
@@ -219,10 +244,11 @@ class CVSShell(cmd.Cmd):
                 first, second = map(self.cvs.get_branch_by_name, values['onto'])
                 self.cvs.initialize_rebase_state(second)
                 self.cvs.rebase_state.not_applied = []
-                for c in self.cvs.enumerate_commit_parents(second.commit, return_itself=True):
-                    if c == first.commit:
+                first_hash = first.commit.get_hash()
+                for commit_hash in self.cvs.enumerate_commit_parent_hashes(second.commit, return_itself=True):
+                    if commit_hash == first_hash:
                         break
-                    self.cvs.rebase_state.not_applied.append(c)
+                    self.cvs.rebase_state.not_applied.append(self.cvs.get_commit_by_hash(commit_hash.hex()))
                 self._handle_rebase_state(self.cvs.rebase())
             elif values['interactive']:
                 self._handle_interactive_rebase(values['interactive'])
@@ -238,6 +264,93 @@ class CVSShell(cmd.Cmd):
             print_commit_info(parent)
             print('-' * 20)
 
+    def do_repack(self, arg):
+        '''Move loose objects into the pack file'''
+        if not self.path_to_repository:
+            print('not a repository')
+            return
+
+        count = self.cvs.repack()
+        print(f'packed {count} objects')
+
+    def do_gc(self, arg):
+        '''Remove unreachable objects
+        gc [--repack] [--grace-period seconds]'''
+        if not self.path_to_repository:
+            print('not a repository')
+            return
+        try:
+            values = vars(self._gc_parser.parse_args(arg.split()))
+        except SystemExit:
+            return
+
+        report = self.cvs.gc(values['grace_period'], values['repack'])
+        print(f'removed {report.removed} objects and {report.removed_checkpoints} checkpoints')
+        print(f'kept {report.reachable} reachable objects')
+        print(f'reclaimed {report.reclaimed_size} bytes')
+
+    def do_pack_refs(self, arg):
+        '''Move branches and tags into a single packed-refs file'''
+        if not self.path_to_repository:
+            print('not a repository')
+            return
+
+        count = self.cvs.pack_refs()
+        print(f'packed {count} references')
+
+    def do_count_objects(self, arg):
+        '''Show the size of stored objects and the compression ratio'''
+        if not self.path_to_repository:
+            print('not a repository')
+            return
+
+        report = self.cvs.get_compression_report()
+        print(f'objects: {report.objects}')
+        print(f'raw size: {report.raw_size} bytes')
+        print(f'stored size: {report.stored_size} bytes')
+        print(f'compression ratio: {report.ratio:.2f}')
+        for codec_name, count in report.codecs.items():
+            print(f'{codec_name}: {count} objects')
+
+    def do_checkpoint(self, arg):
+        '''Store the full tree state of the head commit'''
+        if not self.path_to_repository:
+            print('not a repository')
+            return
+
+        self.cvs.create_checkpoint(self.cvs.get_commit_from_head())
+
+    def do_cache(self, arg):
+        '''Show object cache usage'''
+        if not self.path_to_repository:
+            print('not a repository')
+            return
+
+        cache = self.cvs.object_cache
+        print(f'objects: {len(cache)}')
+        print(f'size: {cache.size} of {cache.max_size} bytes')
+        print(f'hits: {cache.hits}')
+        print(f'misses: {cache.misses}')
+
+    def do_stats(self, arg):
+        '''Show counters and timers of storage and hashing operations
+        stats [on|trace|off|reset]'''
+        arg = arg.strip()
+        if arg == 'on':
+            instrumentation.enable()
+        elif arg == 'trace':
+            instrumentation.enable(trace=True)
+        elif arg == 'off':
+            instrumentation.disable()
+        elif arg == 'reset':
+            instrumentation.reset()
+        elif arg:
+            print(f'unknown argument: {arg}')
+        elif not instrumentation.is_enabled():
+            print('statistics are not collected, turn them on with "stats on"')
+        else:
+            print(instrumentation.format_profile(instrumentation.get_profile()))
+
     def do_ls(self, arg: str):
         '''Show all files in specified directory'''
         for item in os.listdir(self.working_directory):
@@ -253,14 +366,25 @@ class CVSShell(cmd.Cmd):
         self._set_working_directory(directory)
         if CVS.is_repository_exists(directory):
             # перешли в папку с репозиторием
+            self._close_repository()
             self.cvs = CVS(directory)
             self.cvs.initialize_repository()
             self.path_to_repository = directory
+            self._start_monitor()
         elif self.path_to_repository \
                 and os.path.commonprefix([directory, self.path_to_repository]) != self.path_to_repository:
             # покинули папку с репозиторием
-            self.cvs = None
-            self.path_to_repository = None
+            self._close_repository()
+
+    def _start_monitor(self):
+        if self.cvs.config.monitor_enabled and not self.cvs.start_monitor():
+            print('file monitor is not available, status will scan the whole working tree')
+
+    def _close_repository(self):
+        if self.cvs is not None:
+            self.cvs.stop_monitor()
+        self.cvs = None
+        self.path_to_repository = None
 
     def do_mkdir(self, arg: str):
         '''Create new directory'''
@@ -293,8 +417,15 @@ class CVSShell(cmd.Cmd):
         self._rebase_parser.add_argument('-a', '--abort', action='store_true', help='abort rebase')
         self._rebase_parser.add_argument('-c', '--continue', action='store_true', help='continue rebse')
 
+        self._gc_parser = argparse.ArgumentParser(prog='gc')
+        self._gc_parser.add_argument('--repack', action='store_true', help='pack reachable objects')
+        self._gc_parser.add_argument('--grace-period', type=int, help='keep newer unreachable objects, in seconds')
+
     def _handle_rebase_state(self, res: RebaseState):
-        if res.is_conflict:
+        if res.is_conflict and res.current_file.object_type is Tree:
+            print(f'can not finish rebase, directory {res.current_file.path} was changed in both branches,'
+                  f' please resolve the conflict and continue rebase, or abort it. To apply changes, add files to staged')
+        elif res.is_conflict:
             print(f'can not finish rebase, please resolve conflict in {res.current_file.path}'
                   f' and continue rebase, or abort it. To apply changes, add files to staged')
         else:
@@ -336,8 +467,9 @@ class InteractiveRebaseShell(cmd.Cmd):
         commit_hash = arg[0]
         msg = ' '.join(arg[1:])
         commit = self.cvs.get_commit_by_hash(commit_hash)
-        commit.message = msg
-        self.cvs.apply_commit(commit)
+        reworded = Commit(commit.tree, message=msg)
+        reworded.parent_commit_hash = commit.parent_commit_hash
+        self.cvs.apply_commit(reworded)
         if self.cvs.rebase_state.is_conflict:
             print(f'resolve conflict in {self.cvs.rebase_state.current_file}')
         for c in self.not_applied_commits:
@@ -0,0 +1,40 @@
+import os
+
+from benchmarks.generator import RepositoryShape, generate_repository, FEATURE_BRANCH
+from benchmarks.run import run_benchmarks, compare, OPERATIONS
+
+
+def small_shape(**kwargs) -> RepositoryShape:
+    return RepositoryShape(**{'files': 12, 'depth': 1, 'max_file_size': 1024, 'commits': 4,
+                              'changed_files': 2, 'divergence': 2, **kwargs})
+
+
+def test_generated_repository_has_diverged_branches(tmpdir):
+    cvs = generate_repository(str(tmpdir), small_shape())
+
+    master = cvs.get_branch_by_name('master').commit
+    feature = cvs.get_branch_by_name(FEATURE_BRANCH).commit
+    assert len(list(cvs.enumerate_commit_parents(master, return_itself=True))) == 4
+    assert len(list(cvs.enumerate_commit_parents(feature, return_itself=True))) == 4
+    assert cvs.find_merge_base(master, feature) not in (master.get_hash(), feature.get_hash())
+    assert len(cvs.index.get_directory_files()) == 12
+
+
+def test_generated_repository_depends_only_on_shape(tmpdir):
+    def read_files(path: str) -> dict[str, bytes]:
+        cvs = generate_repository(path, small_shape(seed=1))
+        return {os.path.relpath(item.path, path): item_hash
+                for item, item_hash in cvs.index.get_directory_files().items()}
+
+    assert read_files(os.path.join(tmpdir, 'first')) == read_files(os.path.join(tmpdir, 'second'))
+
+
+def test_run_benchmarks_times_every_operation(tmpdir):
+    report = run_benchmarks(small_shape(), repeat=1, directory=str(tmpdir))
+
+    assert set(report['results']) == set(OPERATIONS)
+    assert compare(report, report) == {}
+    slower = {'results': {operation: {'median': result['median'] / 2}
+                          for operation, result in report['results'].items()}}
+    assert set(compare(report, slower)) == {operation for operation, result in report['results'].items()
+                                            if result['median']}
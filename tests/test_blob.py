@@ -1,4 +1,5 @@
 import pytest
+import pickle
 
 from modules.cvs_objects import Blob
 
@@ -42,3 +43,18 @@ def test_hash_different_with_different_blobs():
     second = Blob(b'second')
 
     return first.get_hash() != second.get_hash()
+
+
+def test_deserialize_pickled_blob(blob):
+    out = Blob.deserialize(pickle.dumps(blob))
+
+    assert out.content == blob.content
+    assert out.get_hash() == blob.get_hash()
+
+
+def test_hash_file_matches_hash_of_content(tmpdir):
+    content = b'file content' * 100
+    path = tmpdir.join('file')
+    path.write_binary(content)
+
+    assert Blob.hash_file(str(path), chunk_size=7) == Blob(content).get_hash()
@@ -0,0 +1,43 @@
+import io
+import random
+
+import pytest
+
+from modules.chunking import iterate_stream_chunks, MIN_CHUNK_SIZE, MAX_CHUNK_SIZE
+
+
+def random_bytes(size, seed=0):
+    return random.Random(seed).randbytes(size)
+
+
+def get_chunks(data: bytes, read_size=1 << 20) -> list[bytes]:
+    return list(iterate_stream_chunks(io.BytesIO(data), read_size))
+
+
+def test_iterate_stream_chunks_splits_whole_content():
+    data = random_bytes(1024 * 1024)
+
+    chunks = get_chunks(data)
+
+    assert b''.join(chunks) == data
+    assert all(MIN_CHUNK_SIZE <= len(chunk) <= MAX_CHUNK_SIZE for chunk in chunks[:-1])
+
+
+def test_iterate_stream_chunks_keeps_chunks_after_insertion():
+    data = random_bytes(1024 * 1024)
+    chunks = get_chunks(data)
+
+    changed_chunks = get_chunks(b'inserted' + data)
+
+    assert len(set(chunks) & set(changed_chunks)) >= len(chunks) - 2
+
+
+def test_iterate_stream_chunks_of_empty_content():
+    assert get_chunks(b'') == []
+
+
+@pytest.mark.parametrize("read_size", [1000, 100 * 1024, 1 << 20])
+def test_iterate_stream_chunks_do_not_depend_on_read_size(read_size):
+    data = random_bytes(2 * 1024 * 1024)
+
+    assert get_chunks(data, read_size) == get_chunks(data, len(data))
@@ -1,4 +1,6 @@
 import pytest
+import hashlib
+import pickle
 
 from modules.cvs_objects import Blob, Commit, Tree, TreeObjectData
 
@@ -61,3 +63,42 @@ def test_derive_commit_save_tree_elements(commit, tree):
 
     for obj in objects:
         assert derived.tree.children[obj[0]] == obj[1]
+
+
+def test_serialize_and_deserialize_return_the_same_commit(commit, tree):
+    tree.add_object(TreeObjectData('123', Blob), b'123')
+    derived = commit.derive_commit(tree, message='message')
+
+    out = Commit.deserialize(derived.serialize())
+
+    assert out == derived
+    assert out.get_hash() == derived.get_hash()
+
+
+def test_deserialize_pickled_commit_keeps_legacy_hash(commit, tree):
+    tree.add_object(TreeObjectData('123', Blob), b'123')
+    derived = commit.derive_commit(tree, message='message')
+    legacy_tree_hash = hashlib.sha1(pickle.dumps(tree)).digest()
+    legacy_hash = hashlib.sha1(b'commit #\0' + legacy_tree_hash + derived.parent_commit_hash).digest()
+
+    out = Commit.deserialize(pickle.dumps(derived))
+
+    assert out.message == 'message'
+    assert out.get_hash() == legacy_hash
+
+
+def test_hash_changes_when_parent_changes(commit, tree):
+    derived = commit.derive_commit(tree)
+    prev_hash = derived.get_hash()
+    derived.parent_commit_hash = b'other parent'
+
+    assert derived.get_hash() != prev_hash
+
+
+def test_hash_changes_when_tree_replaced(commit):
+    prev_hash = commit.get_hash()
+    other = Tree()
+    other.add_object(TreeObjectData('123', Blob), b'123')
+    commit.tree = other
+
+    assert commit.get_hash() != prev_hash
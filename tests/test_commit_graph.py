@@ -0,0 +1,64 @@
+import pytest
+import os
+
+from modules.commit_graph import CommitGraph
+
+
+def make_hash(i: int) -> bytes:
+    return i.to_bytes(20, byteorder='big')
+
+
+@pytest.fixture()
+def graph(tmpdir):
+    graph = CommitGraph(os.path.join(tmpdir, 'commit-graph'))
+    graph.add(make_hash(1), b'', make_hash(100))
+    for i in range(2, 6):
+        graph.add(make_hash(i), make_hash(i - 1), make_hash(100 + i))
+
+    return graph
+
+
+def test_generation_grows_from_root(graph):
+    assert [graph.get_generation(make_hash(i)) for i in range(1, 6)] == [1, 2, 3, 4, 5]
+
+
+def test_enumerate_ancestors_walks_to_root(graph):
+    assert list(graph.enumerate_ancestors(make_hash(5))) == [make_hash(i) for i in range(5, 0, -1)]
+
+
+def test_load_returns_the_same_records(graph):
+    loaded = CommitGraph(graph.path)
+    loaded.load()
+
+    assert loaded.hashes == graph.hashes
+    assert loaded.parents == graph.parents
+    assert loaded.generations == graph.generations
+
+
+def test_add_existing_commit_does_not_append(graph):
+    size = os.path.getsize(graph.path)
+    graph.add(make_hash(3), make_hash(2), make_hash(103))
+
+    assert os.path.getsize(graph.path) == size
+    assert len(graph) == 5
+
+
+def test_contains_sees_commits_added_by_other_instance(graph):
+    other = CommitGraph(graph.path)
+    other.load()
+    other.add(make_hash(6), make_hash(5), make_hash(106))
+
+    assert graph.contains(make_hash(6))
+    assert graph.get_parent(make_hash(6)) == make_hash(5)
+
+
+def test_load_skips_partially_written_record(graph):
+    with open(graph.path, 'ab') as f:
+        f.write(b'partial')
+    loaded = CommitGraph(graph.path)
+    loaded.load()
+    loaded.add(make_hash(6), make_hash(5), make_hash(106))
+
+    reloaded = CommitGraph(graph.path)
+    reloaded.load()
+    assert reloaded.get_parent(make_hash(6)) == make_hash(5)
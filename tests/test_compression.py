@@ -0,0 +1,61 @@
+import pytest
+import os
+
+from modules import compression
+from modules.storage import CVSStorage
+from modules.cvs_objects import Blob
+
+
+@pytest.fixture()
+def blob():
+    return Blob(b'text content ' * 1000)
+
+
+@pytest.mark.parametrize("codec_name", compression.get_codecs_names())
+def test_encode_and_decode_return_the_same_content(codec_name, blob):
+    codec = compression.get_codec(codec_name)
+    content = blob.serialize()
+
+    assert compression.decode(compression.encode(content, codec)) == content
+
+
+@pytest.mark.parametrize("codec_name", compression.get_codecs_names())
+def test_stream_compression_matches_decompress(codec_name, blob):
+    codec = compression.get_codec(codec_name)
+    compressor = codec.compressobj()
+    compressed = b''.join(compressor.compress(part) for part in (b'first ', b'second')) + compressor.flush()
+
+    assert codec.decompress(compressed) == b'first second'
+
+
+def test_decode_raw_content_returns_it_unchanged(blob):
+    content = blob.serialize()
+
+    assert compression.decode(content) == content
+
+
+def test_unknown_codec_throws():
+    with pytest.raises(ValueError):
+        compression.get_codec('unknown')
+
+
+@pytest.mark.parametrize("codec_name", ['zlib', 'lzma', 'bz2'])
+def test_store_object_compresses_content(codec_name, blob, tmpdir):
+    CVSStorage.set_codec(tmpdir, codec_name)
+    CVSStorage.store_object(blob.get_hash().hex(), blob.serialize(), Blob, tmpdir)
+
+    report = CVSStorage.get_compression_report(tmpdir)
+    from_disk = Blob.deserialize(CVSStorage.read_object(blob.get_hash().hex(), Blob, tmpdir))
+
+    assert from_disk.content == blob.content
+    assert report.codecs == {codec_name: 1}
+    assert report.stored_size < report.raw_size
+
+
+def test_read_object_stored_without_compression(blob, tmpdir):
+    name = blob.get_hash().hex()
+    CVSStorage.store(name[2:], blob.serialize(), CVSStorage.get_object_directory(tmpdir, name))
+
+    from_disk = Blob.deserialize(CVSStorage.read_object(name, Blob, tmpdir))
+
+    assert from_disk.content == blob.content
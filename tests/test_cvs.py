@@ -1,10 +1,15 @@
 import pytest
 import os
+import shutil
+import tempfile
+import time
 
 from modules.folders_enum import FoldersEnum
 from modules.cvs import CVS
 from modules.cvs_objects import Commit, TreeObjectData, Tree, Blob
-from modules.references import Tag
+from modules.references import Tag, Branch, Head
+from modules.storage import CVSStorage
+from modules import fs_monitor
 
 
 @pytest.fixture()
@@ -47,3 +52,617 @@ def test_delete_existing_tag_removesDirectory(tmpdir, cvs):
 def test_delete_non_existing_tag_thows(tmpdir, cvs):
     with pytest.raises(FileNotFoundError):
         cvs.delete_tag('do_not_exist')
+
+
+def test_repack_keeps_history_readable(tmpdir, cvs):
+    with open(os.path.join(tmpdir, 'file'), 'wb') as f:
+        f.write(b'content')
+    cvs.update_index()
+    cvs.add_to_staged(TreeObjectData(os.path.join(tmpdir, 'file'), Blob))
+    cvs.make_commit('first')
+
+    cvs.repack()
+    head = cvs.get_commit_from_head()
+
+    assert head.message == 'first'
+    assert cvs.expand_full_tree(head)[TreeObjectData(os.path.join(tmpdir, 'file'), Blob)] == \
+           Blob(b'content').get_hash()
+
+
+def test_compression_is_recorded_in_config(tmpdir):
+    cvs = CVS(tmpdir)
+    cvs.initialize_repository('lzma')
+
+    assert CVS(tmpdir).config.compression == 'lzma'
+
+
+def test_restore_repository_state_restores_committed_files(tmpdir, cvs):
+    path = os.path.join(tmpdir, 'dir', 'file')
+    os.mkdir(os.path.join(tmpdir, 'dir'))
+    with open(path, 'wb') as f:
+        f.write(b'committed')
+    cvs.update_index()
+    cvs.add_to_staged(TreeObjectData(path, Blob))
+    cvs.make_commit('first')
+    with open(path, 'wb') as f:
+        f.write(b'changed')
+
+    cvs.restore_repository_state(cvs.get_commit_from_head())
+
+    with open(path, 'rb') as f:
+        assert f.read() == b'committed'
+
+
+def test_staged_files_survive_reopening_repository(tmpdir, cvs):
+    path = os.path.join(tmpdir, 'file')
+    with open(path, 'wb') as f:
+        f.write(b'content')
+    cvs.update_index()
+    cvs.add_to_staged(TreeObjectData(path, Blob))
+    cvs.index.store()
+
+    reopened = CVS(tmpdir)
+    reopened.initialize_repository()
+
+    assert reopened.index.staged == {TreeObjectData(path, Blob)}
+
+
+def test_staging_files_does_not_rewrite_index(tmpdir, cvs, monkeypatch):
+    paths = [os.path.join(tmpdir, f'file{i}') for i in range(3)]
+    for path in paths:
+        with open(path, 'wb') as f:
+            f.write(b'content')
+    cvs.update_index()
+    stored = []
+    monkeypatch.setattr(cvs.index.cache, 'store', lambda: stored.append(True))
+
+    for path in paths:
+        cvs.add_to_staged(TreeObjectData(path, Blob))
+    assert stored == []
+    cvs.index.store()
+
+    assert stored == [True]
+
+
+def test_update_index_does_not_rehash_unchanged_files(tmpdir, cvs, monkeypatch):
+    path = os.path.join(tmpdir, 'file')
+    with open(path, 'wb') as f:
+        f.write(b'content')
+    os.utime(path, ns=(0, 0))
+    cvs.update_index()
+    hashed = []
+    monkeypatch.setattr(Blob, 'hash_file', lambda file_path, *args: hashed.append(file_path))
+
+    reopened = CVS(tmpdir)
+    reopened.initialize_repository()
+
+    assert hashed == []
+    assert TreeObjectData(path, Blob) in reopened.index.new
+
+
+def test_get_commit_by_hash_reuses_decoded_commit(tmpdir, cvs):
+    commit_hash = cvs.get_commit_from_head().get_hash().hex()
+    first = cvs.get_commit_by_hash(commit_hash)
+    hits = cvs.object_cache.hits
+
+    assert cvs.get_commit_by_hash(commit_hash) is first
+    assert cvs.object_cache.hits == hits + 1
+
+
+def commit_files(cvs, tmpdir, files: dict, removed=(), message=''):
+    for name, content in files.items():
+        with open(os.path.join(tmpdir, name), 'wb') as f:
+            f.write(content)
+    for name in removed:
+        os.remove(os.path.join(tmpdir, name))
+    cvs.update_index()
+    for name in files:
+        cvs.add_to_staged(TreeObjectData(os.path.join(tmpdir, name), Blob))
+    for name in removed:
+        cvs.add_to_staged(TreeObjectData(os.path.join(tmpdir, name), Blob, is_removed=True))
+    cvs.make_commit(message)
+
+    return cvs.get_commit_from_head()
+
+
+def test_expand_full_tree_from_checkpoint_matches_full_walk(tmpdir, cvs):
+    for i in range(5):
+        commit_files(cvs, tmpdir, {f'file{i}': f'content{i}'.encode(), 'common': f'version{i}'.encode()})
+    commit_files(cvs, tmpdir, {}, removed=['file1'])
+    middle = cvs.get_commit_from_head()
+    for i in range(5, 8):
+        commit_files(cvs, tmpdir, {f'file{i}': f'content{i}'.encode()})
+    head = cvs.get_commit_from_head()
+    expected = cvs.expand_full_tree(head)
+    expected_middle = cvs.expand_full_tree(middle)
+
+    cvs.create_checkpoint(middle)
+
+    assert cvs.get_checkpoint(middle) is not None
+    assert cvs.expand_full_tree(head) == expected
+    assert cvs.expand_full_tree(middle) == expected_middle
+
+
+def test_expand_full_tree_stores_checkpoint_after_interval(tmpdir, cvs):
+    cvs.config.set('checkpoint', 'interval', 3)
+    for i in range(3):
+        commit_files(cvs, tmpdir, {f'file{i}': b'content'})
+
+    head = cvs.get_commit_from_head()
+    cvs.expand_full_tree(head)
+
+    assert cvs.get_checkpoint(head) is not None
+
+
+def test_expand_full_tree_keeps_storing_checkpoints(tmpdir, cvs):
+    cvs.config.set('checkpoint', 'interval', 3)
+    expected = {}
+    for i in range(12):
+        commit_files(cvs, tmpdir, {f'file{i}': b'content'})
+        expected[TreeObjectData(os.path.join(tmpdir, f'file{i}'), Blob)] = Blob(b'content').get_hash()
+        cvs.expand_full_tree(cvs.get_commit_from_head())
+
+    assert len(os.listdir(os.path.join(tmpdir, FoldersEnum.CHECKPOINTS))) >= 3
+    reopened = CVS(tmpdir)
+    reopened.initialize_repository()
+    assert reopened.expand_full_tree(reopened.get_commit_from_head()) == expected
+
+
+def test_get_full_tree_state_matches_expanded_tree(tmpdir, cvs):
+    cvs.config.set('checkpoint', 'interval', 2)
+    for i in range(5):
+        commit_files(cvs, tmpdir, {f'file{i}': b'content'})
+    head = commit_files(cvs, tmpdir, {}, removed=['file0'])
+
+    state = cvs.get_full_tree_state(head)
+
+    assert state.children == {**cvs.expand_full_tree(head),
+                              TreeObjectData(os.path.join(tmpdir, 'file0'), Blob, is_removed=True): b''}
+
+
+def test_restore_repository_state_touches_only_changed_files(tmpdir, cvs):
+    first = commit_files(cvs, tmpdir, {'same': b'same', 'changed': b'first'})
+    commit_files(cvs, tmpdir, {'changed': b'second', 'added': b'added'})
+    os.utime(os.path.join(tmpdir, 'same'), ns=(0, 0))
+
+    cvs.restore_repository_state(first)
+
+    assert os.stat(os.path.join(tmpdir, 'same')).st_mtime_ns == 0
+    assert not os.path.exists(os.path.join(tmpdir, 'added'))
+    with open(os.path.join(tmpdir, 'changed'), 'rb') as f:
+        assert f.read() == b'first'
+
+
+def test_restore_repository_state_removes_directories_not_in_commit(tmpdir, cvs):
+    first = commit_files(cvs, tmpdir, {'file': b'content'})
+    os.makedirs(os.path.join(tmpdir, 'dir', 'nested'))
+    commit_files(cvs, tmpdir, {'dir/nested/file': b'content'})
+
+    cvs.restore_repository_state(first)
+
+    assert not os.path.exists(os.path.join(tmpdir, 'dir'))
+    assert os.path.exists(os.path.join(tmpdir, 'file'))
+
+
+@pytest.mark.parametrize("workers", [1, 4])
+def test_restore_repository_state_in_parallel(tmpdir, cvs, workers):
+    cvs.config.set('checkout', 'workers', workers)
+    files = {f'dir{i % 3}/file{i}': f'content{i}'.encode() for i in range(20)}
+    for i in range(3):
+        os.mkdir(os.path.join(tmpdir, f'dir{i}'))
+    commit = commit_files(cvs, tmpdir, files)
+    cvs.repack()
+    for i in range(3):
+        shutil.rmtree(os.path.join(tmpdir, f'dir{i}'))
+
+    cvs.restore_repository_state(commit)
+
+    for name, content in files.items():
+        with open(os.path.join(tmpdir, name), 'rb') as f:
+            assert f.read() == content
+
+
+def test_enumerate_commit_parent_hashes_does_not_read_commits(tmpdir, cvs, monkeypatch):
+    commits = [commit_files(cvs, tmpdir, {'file': f'version{i}'.encode()}) for i in range(3)]
+    reopened = CVS(tmpdir)
+    reopened.initialize_repository()
+    monkeypatch.setattr(CVS, 'read_object', lambda *args: pytest.fail('commit was read'))
+
+    hashes = list(reopened.enumerate_commit_parent_hashes(commits[-1], return_itself=True))
+
+    assert hashes == [commit.get_hash() for commit in reversed(commits)]
+
+
+def test_find_merge_base_of_diverged_commits(tmpdir, cvs):
+    base = commit_files(cvs, tmpdir, {'file': b'base'})
+    cvs.store_branch(Branch('feature', base))
+    main_commits = [commit_files(cvs, tmpdir, {'main': f'main{i}'.encode()}) for i in range(5)]
+    cvs.head = Head(cvs.get_branch_by_name('feature'))
+    cvs.store_head()
+    feature = commit_files(cvs, tmpdir, {'feature': b'feature'})
+
+    assert cvs.find_merge_base(main_commits[-1], feature) == base.get_hash()
+    assert cvs.find_merge_base(feature, main_commits[-1]) == base.get_hash()
+    assert cvs.find_merge_base(main_commits[-1], base) == base.get_hash()
+
+
+def test_initialize_rebase_state_collects_commits_after_merge_base(tmpdir, cvs):
+    base = commit_files(cvs, tmpdir, {'file': b'base'})
+    cvs.store_branch(Branch('feature', base))
+    commit_files(cvs, tmpdir, {'main': b'main'})
+    cvs.head = Head(cvs.get_branch_by_name('feature'))
+    cvs.store_head()
+    feature_commits = [commit_files(cvs, tmpdir, {'feature': f'feature{i}'.encode()}) for i in range(2)]
+    cvs.head = Head(cvs.get_branch_by_name('master'))
+    cvs.store_head()
+
+    cvs.initialize_rebase_state(cvs.get_branch_by_name('feature'))
+
+    assert [c.get_hash() for c in cvs.rebase_state.not_applied] == \
+           [c.get_hash() for c in reversed(feature_commits)]
+
+
+def prepare_diverged_file(cvs, tmpdir, main_content: bytes, feature_content: bytes):
+    base = commit_files(cvs, tmpdir, {'file': b'first\nsecond\nthird\nfourth\n'})
+    cvs.store_branch(Branch('feature', base))
+    commit_files(cvs, tmpdir, {'file': main_content})
+    cvs.head = Head(cvs.get_branch_by_name('feature'))
+    cvs.store_head()
+    commit_files(cvs, tmpdir, {'file': feature_content})
+    cvs.head = Head(cvs.get_branch_by_name('master'))
+    cvs.store_head()
+    cvs.restore_repository_state(cvs.get_commit_from_head())
+    cvs.initialize_rebase_state(cvs.get_branch_by_name('feature'))
+
+
+def test_rebase_merges_independent_changes_of_file(tmpdir, cvs):
+    prepare_diverged_file(cvs, tmpdir, b'FIRST\nsecond\nthird\nfourth\n', b'first\nsecond\nthird\nFOURTH\n')
+
+    state = cvs.rebase()
+
+    assert not state.is_conflict
+    files = cvs.expand_full_tree(cvs.get_commit_from_head())
+    file_hash = files[TreeObjectData(os.path.join(tmpdir, 'file'), Blob)]
+    assert cvs.read_object(file_hash.hex(), Blob).content == b'FIRST\nsecond\nthird\nFOURTH\n'
+
+
+def test_rebase_merges_every_commit_against_its_parent(tmpdir, cvs):
+    prepare_diverged_file(cvs, tmpdir, b'FIRST\nsecond\nthird\nfourth\n', b'first\nsecond\nthird\nfourth\nadded\n')
+    cvs.rebase_state = None
+    cvs.head = Head(cvs.get_branch_by_name('feature'))
+    cvs.store_head()
+    cvs.restore_repository_state(cvs.get_commit_from_head())
+    commit_files(cvs, tmpdir, {'file': b'first\nsecond\nthird\nfourth\n'})
+    cvs.head = Head(cvs.get_branch_by_name('master'))
+    cvs.store_head()
+    cvs.restore_repository_state(cvs.get_commit_from_head())
+    cvs.initialize_rebase_state(cvs.get_branch_by_name('feature'))
+
+    state = cvs.rebase()
+
+    assert not state.is_conflict
+    files = cvs.expand_full_tree(cvs.get_commit_from_head())
+    file_hash = files[TreeObjectData(os.path.join(tmpdir, 'file'), Blob)]
+    assert cvs.read_object(file_hash.hex(), Blob).content == b'FIRST\nsecond\nthird\nfourth\n'
+
+
+def test_rebase_marks_conflicting_changes_of_file(tmpdir, cvs):
+    prepare_diverged_file(cvs, tmpdir, b'first\nmain\nthird\nfourth\n', b'first\nfeature\nthird\nfourth\n')
+
+    state = cvs.rebase()
+
+    assert state.is_conflict
+    with open(os.path.join(tmpdir, 'file'), 'rb') as f:
+        assert f.read() == b'first\n<<<<<<< ours\nmain\n=======\nfeature\n>>>>>>> theirs\nthird\nfourth\n'
+
+
+def switch_to(cvs, branch_name: str):
+    cvs.head = Head(cvs.get_branch_by_name(branch_name))
+    cvs.store_head()
+    cvs.restore_repository_state(cvs.get_commit_from_head())
+
+
+def test_rebase_file_removed_in_both_branches_is_merged(tmpdir, cvs):
+    base = commit_files(cvs, tmpdir, {'file': b'content', 'other': b'other'})
+    cvs.store_branch(Branch('feature', base))
+    commit_files(cvs, tmpdir, {'main': b'main'}, removed=('file',))
+    switch_to(cvs, 'feature')
+    commit_files(cvs, tmpdir, {}, removed=('file',))
+    switch_to(cvs, 'master')
+    cvs.initialize_rebase_state(cvs.get_branch_by_name('feature'))
+
+    state = cvs.rebase()
+
+    assert not state.is_conflict
+    files = cvs.expand_full_tree(cvs.get_commit_from_head())
+    assert TreeObjectData(os.path.join(tmpdir, 'file'), Blob) not in files
+    assert TreeObjectData(os.path.join(tmpdir, 'main'), Blob) in files
+
+
+def test_rebase_marks_file_removed_in_both_branches_and_added_again_in_one(tmpdir, cvs):
+    base = commit_files(cvs, tmpdir, {'file': b'content\n'})
+    cvs.store_branch(Branch('feature', base))
+    commit_files(cvs, tmpdir, {}, removed=('file',))
+    commit_files(cvs, tmpdir, {'file': b'changed\n'})
+    switch_to(cvs, 'feature')
+    commit_files(cvs, tmpdir, {'feature': b'feature'}, removed=('file',))
+    switch_to(cvs, 'master')
+    cvs.initialize_rebase_state(cvs.get_branch_by_name('feature'))
+
+    state = cvs.rebase()
+
+    assert state.is_conflict
+    with open(os.path.join(tmpdir, 'file'), 'rb') as f:
+        assert f.read() == b'<<<<<<< ours\nchanged\n=======\n>>>>>>> theirs\n'
+
+
+def test_rebase_reports_directory_changed_in_both_branches(tmpdir, cvs):
+    base = commit_files(cvs, tmpdir, {'file': b'content'})
+    cvs.store_branch(Branch('feature', base))
+    directory = TreeObjectData(os.path.join(tmpdir, 'dir', ''), Tree)
+    for branch_name, name in (('master', 'main'), ('feature', 'feature')):
+        switch_to(cvs, branch_name)
+        os.makedirs(directory.path, exist_ok=True)
+        with open(os.path.join(directory.path, name), 'wb') as f:
+            f.write(name.encode())
+        cvs.index.staged = {directory}
+        cvs.make_commit()
+    switch_to(cvs, 'master')
+    cvs.initialize_rebase_state(cvs.get_branch_by_name('feature'))
+
+    state = cvs.rebase()
+
+    assert state.is_conflict
+    assert state.current_file == directory
+    assert sorted(os.listdir(directory.path)) == ['main']
+
+
+def test_make_commit_stores_changed_file_as_delta(tmpdir, cvs):
+    cvs.config.set('delta', 'min_size', 0)
+    lines = [f'line {i}\n'.encode() for i in range(1000)]
+    commit_files(cvs, tmpdir, {'file': b''.join(lines), 'large': b''.join(lines)})
+    lines[500] = b'changed\n'
+    cvs.config.set('delta', 'max_size', 1024)
+    commit_files(cvs, tmpdir, {'large': b''.join(lines)})
+    assert 'delta' not in cvs.get_compression_report().codecs
+    cvs.config.set('delta', 'max_size', 1024 * 1024)
+
+    commit = commit_files(cvs, tmpdir, {'file': b''.join(lines)})
+
+    file_hash = commit.tree.children[TreeObjectData(os.path.join(tmpdir, 'file'), Blob)]
+    header = CVSStorage.read_stored_header(file_hash.hex(), cvs._full_path_to_objects, 2)
+    assert header == b'\0d'
+    assert cvs.get_compression_report().codecs['delta'] == 1
+    assert cvs.read_object(file_hash.hex(), Blob).content == b''.join(lines)
+
+
+def test_repack_stores_changed_file_as_delta(tmpdir, cvs):
+    cvs.config.set('delta', 'min_size', 0)
+    cvs.config.set('delta', 'on_commit', 'no')
+    lines = [f'line {i}\n'.encode() for i in range(1000)]
+    commit_files(cvs, tmpdir, {'file': b''.join(lines), 'binary': b'\0' * 10000})
+    lines[500] = b'changed\n'
+    commit = commit_files(cvs, tmpdir, {'file': b''.join(lines), 'binary': b'\0' * 9999 + b'\1'})
+    assert 'delta' not in cvs.get_compression_report().codecs
+
+    cvs.repack()
+
+    file_hash = commit.tree.children[TreeObjectData(os.path.join(tmpdir, 'file'), Blob)]
+    report = cvs.get_compression_report()
+    assert report.codecs['delta'] == 1
+    assert cvs.read_object(file_hash.hex(), Blob).content == b''.join(lines)
+
+
+def test_chunked_file_is_restored_after_checkout(tmpdir, cvs):
+    cvs.config.set('chunking', 'min_size', 1024)
+    cvs.config.store()
+    cvs = CVS(tmpdir)
+    cvs.initialize_repository()
+    content = os.urandom(200 * 1024)
+    first = commit_files(cvs, tmpdir, {'file': content})
+    commit_files(cvs, tmpdir, {'file': b'changed'})
+
+    cvs.restore_repository_state(first)
+
+    item = TreeObjectData(os.path.join(tmpdir, 'file'), Blob)
+    assert cvs.index.get_directory_files()[item] == first.tree.children[item]
+    assert cvs.read_object(first.tree.children[item].hex(), Blob).content == content
+    with open(os.path.join(tmpdir, 'file'), 'rb') as f:
+        assert f.read() == content
+
+
+def test_pack_refs_keeps_references_resolvable(tmpdir, cvs):
+    commit = commit_files(cvs, tmpdir, {'file': b'content'})
+    cvs.create_tag('v1')
+    cvs.store_branch(Branch('feature', commit))
+
+    assert cvs.pack_refs() == 3
+
+    assert os.listdir(os.path.join(tmpdir, FoldersEnum.TAGS)) == []
+    assert cvs.get_tags_names() == ['v1']
+    assert cvs.get_branches_names() == ['feature', 'master']
+    assert cvs.get_commit_by_tag_name('v1') == commit
+    assert cvs.get_branch_by_name('feature').commit == commit
+    assert cvs.get_commit_from_head() == commit
+
+
+def test_loose_reference_overrides_packed(tmpdir, cvs):
+    commit_files(cvs, tmpdir, {'file': b'first'})
+    cvs.pack_refs()
+    second = commit_files(cvs, tmpdir, {'file': b'second'})
+
+    assert cvs.get_branch_by_name('master').commit == second
+
+
+def test_delete_packed_and_loose_reference(tmpdir, cvs):
+    cvs.pack_refs()
+    commit_files(cvs, tmpdir, {'file': b'content'})
+
+    cvs.delete_branch('master')
+
+    with pytest.raises(FileNotFoundError):
+        cvs.get_branch_by_name('master')
+
+
+def test_head_reference_is_read_once(tmpdir, cvs, monkeypatch):
+    commit_files(cvs, tmpdir, {'file': b'content'})
+    cvs.get_commit_from_head()
+    reads = []
+    read_object = CVSStorage.read_object
+    monkeypatch.setattr(CVSStorage, 'read_object',
+                        lambda name, *args: reads.append(name) or read_object(name, *args))
+
+    for _ in range(3):
+        cvs.get_commit_from_head()
+        cvs.get_branch_from_head()
+
+    assert 'HEAD' not in reads and 'master' not in reads
+
+
+def test_reference_changed_on_disk_is_reread(tmpdir, cvs):
+    first = commit_files(cvs, tmpdir, {'file': b'first'})
+    second = commit_files(cvs, tmpdir, {'file': b'second'})
+    assert cvs.get_commit_from_head() == second
+
+    path_to_branch = os.path.join(tmpdir, FoldersEnum.HEADS, 'master')
+    with open(path_to_branch, 'wb') as f:
+        f.write(first.get_hash().hex().encode())
+    os.utime(path_to_branch, ns=(0, 0))
+
+    assert cvs.get_commit_from_head() == first
+
+
+@pytest.mark.skipif(not fs_monitor.is_supported(), reason='inotify is not available')
+def test_index_with_monitor_examines_changed_files(tmpdir, cvs):
+    commit_files(cvs, tmpdir, {'kept': b'kept', 'changed': b'old', 'removed': b'removed'})
+    assert cvs.start_monitor()
+    try:
+        cvs.update_index()
+        with open(os.path.join(tmpdir, 'changed'), 'wb') as f:
+            f.write(b'new')
+        os.remove(os.path.join(tmpdir, 'removed'))
+        with open(os.path.join(tmpdir, 'new'), 'wb') as f:
+            f.write(b'new')
+        deadline = time.monotonic() + 5
+        while len(cvs.index.monitor._dirty) < 3 and time.monotonic() < deadline:
+            time.sleep(0.01)
+
+        cvs.update_index()
+
+        assert [data.name for data in cvs.index.modified] == ['changed']
+        assert [data.name for data in cvs.index.removed] == ['removed']
+        assert [data.name for data in cvs.index.new] == ['new']
+        assert set(cvs.index.get_directory_files()) == {
+            TreeObjectData(os.path.join(tmpdir, name), Blob) for name in ('kept', 'changed', 'new')}
+    finally:
+        cvs.stop_monitor()
+
+
+def test_gc_removes_objects_of_deleted_branch(tmpdir, cvs):
+    base = commit_files(cvs, tmpdir, {'file': b'base'})
+    cvs.store_branch(Branch('feature', base))
+    cvs.head = Head(cvs.get_branch_by_name('feature'))
+    cvs.store_head()
+    feature = commit_files(cvs, tmpdir, {'file': b'feature'})
+    cvs.head = Head(cvs.get_branch_by_name('master'))
+    cvs.store_head()
+    cvs.delete_branch('feature')
+
+    report = cvs.gc(grace_period=0)
+
+    assert report.removed == 2
+    assert report.reclaimed_size > 0
+    assert not CVSStorage.contains_object(feature.get_hash().hex(), cvs._full_path_to_objects)
+    assert not CVSStorage.contains_object(Blob(b'feature').get_hash().hex(), cvs._full_path_to_objects)
+    assert cvs.read_object(Blob(b'base').get_hash().hex(), Blob).content == b'base'
+    assert cvs.get_commit_from_head() == base
+
+
+def test_gc_keeps_recent_unreachable_objects(tmpdir, cvs):
+    blob = Blob(b'unreachable')
+    CVSStorage.store_object(blob.get_hash().hex(), blob.serialize(), Blob, cvs._full_path_to_objects)
+
+    assert cvs.gc().removed == 0
+    assert CVSStorage.contains_object(blob.get_hash().hex(), cvs._full_path_to_objects)
+
+
+def test_gc_with_repack_keeps_recent_unreachable_packed_objects(tmpdir, cvs):
+    commit_files(cvs, tmpdir, {'file': b'content'})
+    blob = Blob(b'unreachable')
+    CVSStorage.store_object(blob.get_hash().hex(), blob.serialize(), Blob, cvs._full_path_to_objects)
+    CVSStorage.repack(cvs._full_path_to_objects)
+
+    assert cvs.gc(repack=True).removed == 0
+    assert CVSStorage.contains_object(blob.get_hash().hex(), cvs._full_path_to_objects)
+
+    assert cvs.gc(grace_period=-1, repack=True).removed == 1
+    assert not CVSStorage.contains_object(blob.get_hash().hex(), cvs._full_path_to_objects)
+
+
+def test_gc_without_checkpoints_directory(tmpdir, cvs):
+    base = commit_files(cvs, tmpdir, {'file': b'base'})
+    # repositories created before checkpoints were added do not have the directory
+    shutil.rmtree(os.path.join(cvs.path_to_repository, FoldersEnum.CHECKPOINTS))
+
+    report = cvs.gc(grace_period=0, repack=True)
+
+    assert report.removed == 0
+    assert CVS(tmpdir).get_commit_from_head() == base
+
+
+def test_reference_temporary_files_are_created_outside_of_reference_directories(tmpdir, cvs, monkeypatch):
+    directories = []
+    mkstemp = tempfile.mkstemp
+    monkeypatch.setattr(tempfile, 'mkstemp', lambda **kwargs: directories.append(kwargs['dir']) or mkstemp(**kwargs))
+
+    cvs.store_branch(Branch('feature', commit_files(cvs, tmpdir, {'file': b'content'})))
+    cvs.store_head()
+
+    assert directories
+    assert {os.path.abspath(directory) for directory in directories} <= {
+        os.path.abspath(os.path.join(tmpdir, FoldersEnum.CVS_DATA)),
+        os.path.abspath(os.path.join(tmpdir, FoldersEnum.OBJECTS))}
+
+
+def test_gc_removes_temporary_files_left_in_reference_directories(tmpdir, cvs):
+    commit_files(cvs, tmpdir, {'file': b'content'})
+    leftover = os.path.join(tmpdir, FoldersEnum.HEADS, 'tmp_interrupted')
+    with open(leftover, 'wb') as f:
+        f.write(b'')
+    os.utime(leftover, (0, 0))
+
+    cvs.gc()
+
+    assert not os.path.exists(leftover)
+    assert cvs.get_branches_names() == ['master']
+
+
+def test_gc_with_repack_keeps_deltas_and_chunks_readable(tmpdir, cvs):
+    cvs.config.set('chunking', 'min_size', 1024)
+    cvs.config.set('delta', 'min_size', 0)
+    cvs.config.store()
+    cvs = CVS(tmpdir)
+    cvs.initialize_repository()
+    lines = [f'line {i}\n'.encode() for i in range(1000)]
+    commit_files(cvs, tmpdir, {'text': b''.join(lines), 'binary': os.urandom(100 * 1024)})
+    lines[500] = b'changed\n'
+    commit_files(cvs, tmpdir, {'text': b''.join(lines)})
+    cvs.create_checkpoint(cvs.get_commit_from_head())
+    unreachable = Blob(b'unreachable')
+    CVSStorage.store_object(unreachable.get_hash().hex(), unreachable.serialize(), Blob, cvs._full_path_to_objects)
+    CVSStorage.repack(cvs._full_path_to_objects)
+
+    report = cvs.gc(grace_period=0, repack=True)
+
+    # the unreachable blob was packed
+    assert report.removed == 1
+    assert report.reclaimed_size > 0
+    assert not CVSStorage.contains_object(unreachable.get_hash().hex(), cvs._full_path_to_objects)
+    cvs = CVS(tmpdir)
+    cvs.initialize_repository()
+    files = cvs.expand_full_tree(cvs.get_commit_from_head())
+    assert cvs.read_object(files[TreeObjectData(os.path.join(tmpdir, 'text'), Blob)].hex(), Blob).content == \
+           b''.join(lines)
+    with open(os.path.join(tmpdir, 'binary'), 'rb') as f:
+        assert cvs.read_object(files[TreeObjectData(os.path.join(tmpdir, 'binary'), Blob)].hex(), Blob).content == \
+               f.read()
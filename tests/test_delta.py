@@ -0,0 +1,26 @@
+import random
+
+from modules.delta import create_delta, apply_delta
+
+
+def test_apply_delta_restores_target():
+    base = b''.join(f'line {i}\n'.encode() for i in range(1000))
+    target = base.replace(b'line 500\n', b'changed line\n') + b'appended line\n'
+
+    delta = create_delta(base, target)
+
+    assert apply_delta(base, delta) == target
+    assert len(delta) < len(target) // 10
+
+
+def test_apply_delta_to_unrelated_content():
+    generator = random.Random(0)
+    base = bytes(generator.getrandbits(8) for _ in range(1000))
+    target = bytes(generator.getrandbits(8) for _ in range(1000))
+
+    assert apply_delta(base, create_delta(base, target)) == target
+
+
+def test_apply_delta_to_empty_content():
+    assert apply_delta(b'', create_delta(b'', b'content\n')) == b'content\n'
+    assert apply_delta(b'content\n', create_delta(b'content\n', b'')) == b''
@@ -0,0 +1,65 @@
+import random
+
+from modules.diff import diff_matches, diff_opcodes, merge3
+
+
+def longest_common_subsequence(first, second):
+    lengths = [[0] * (len(second) + 1) for _ in range(len(first) + 1)]
+    for i in reversed(range(len(first))):
+        for j in reversed(range(len(second))):
+            if first[i] == second[j]:
+                lengths[i][j] = lengths[i + 1][j + 1] + 1
+            else:
+                lengths[i][j] = max(lengths[i + 1][j], lengths[i][j + 1])
+
+    return lengths[0][0]
+
+
+def test_diff_matches_are_longest_common_subsequence():
+    generator = random.Random(0)
+    for _ in range(500):
+        first = [generator.choice('abc') for _ in range(generator.randint(0, 12))]
+        second = [generator.choice('abc') for _ in range(generator.randint(0, 12))]
+
+        matches = diff_matches(first, second)
+
+        assert all(first[i] == second[j] for i, j in matches)
+        assert all(i1 < i2 and j1 < j2 for (i1, j1), (i2, j2) in zip(matches, matches[1:]))
+        assert len(matches) == longest_common_subsequence(first, second)
+
+
+def test_diff_opcodes():
+    first = ['a', 'b', 'c', 'd']
+    second = ['a', 'x', 'c', 'd', 'e']
+
+    assert diff_opcodes(first, second) == [
+        ('equal', 0, 1, 0, 1),
+        ('replace', 1, 2, 1, 2),
+        ('equal', 2, 4, 2, 4),
+        ('insert', 4, 4, 4, 5)
+    ]
+
+
+def test_merge3_takes_changes_from_both_sides():
+    base = [b'a\n', b'b\n', b'c\n', b'd\n']
+    ours = [b'A\n', b'b\n', b'c\n', b'd\n']
+    theirs = [b'a\n', b'b\n', b'c\n', b'd\n', b'e\n']
+
+    result = merge3(base, ours, theirs)
+
+    assert not result.is_conflict
+    assert result.lines == [b'A\n', b'b\n', b'c\n', b'd\n', b'e\n']
+
+
+def test_merge3_takes_same_change_once():
+    result = merge3([b'a\n'], [b'b\n'], [b'b\n'])
+
+    assert not result.is_conflict
+    assert result.lines == [b'b\n']
+
+
+def test_merge3_marks_conflicts():
+    result = merge3([b'a\n', b'b\n'], [b'a\n', b'ours'], [b'a\n', b'theirs\n'])
+
+    assert result.conflicts == 1
+    assert result.lines == [b'a\n', b'<<<<<<< ours\n', b'ours\n', b'=======\n', b'theirs\n', b'>>>>>>> theirs\n']
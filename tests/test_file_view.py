@@ -0,0 +1,51 @@
+import os
+import mmap
+
+from modules.file_view import map_file, iterate_slices
+
+
+def write_file(tmpdir, content: bytes, name='file') -> str:
+    path = os.path.join(tmpdir, name)
+    with open(path, 'wb') as f:
+        f.write(content)
+
+    return path
+
+
+def test_map_file(tmpdir):
+    path = write_file(tmpdir, b'file content')
+
+    with map_file(path) as view:
+        assert view.readonly
+        assert view == b'file content'
+
+
+def test_map_empty_file(tmpdir):
+    path = write_file(tmpdir, b'')
+
+    assert map_file(path) == b''
+
+
+def test_small_file_is_read(tmpdir):
+    path = write_file(tmpdir, b'file content')
+
+    view = map_file(path, min_size=1024)
+
+    assert view == b'file content'
+    assert isinstance(view.obj, bytes)
+    assert isinstance(map_file(path, min_size=4).obj, mmap.mmap)
+
+
+def test_view_outlives_replaced_file(tmpdir):
+    path = write_file(tmpdir, b'old content')
+    view = map_file(path)
+
+    os.replace(write_file(tmpdir, b'new', 'new_file'), path)
+
+    assert view == b'old content'
+
+
+def test_iterate_slices():
+    view = memoryview(b'0123456789')
+
+    assert [bytes(piece) for piece in iterate_slices(view, 4)] == [b'0123', b'4567', b'89']
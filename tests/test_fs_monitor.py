@@ -0,0 +1,86 @@
+import os
+import struct
+import time
+
+import pytest
+
+from modules import fs_monitor
+from modules.fs_monitor import FileSystemMonitor
+
+pytestmark = pytest.mark.skipif(not fs_monitor.is_supported(), reason='inotify is not available')
+
+
+@pytest.fixture()
+def monitor(tmpdir):
+    monitor = FileSystemMonitor(str(tmpdir), {os.path.join(tmpdir, 'ignored', '')})
+    os.mkdir(os.path.join(tmpdir, 'ignored'))
+    monitor.start()
+    yield monitor
+    monitor.stop()
+
+
+def wait_for_changes(monitor, expected: set[str]) -> set[str]:
+    changes = set()
+    deadline = time.monotonic() + 5
+    while not expected <= changes and time.monotonic() < deadline:
+        time.sleep(0.01)
+        changes |= monitor.take_changes()
+
+    return changes
+
+
+def test_first_query_requires_full_scan(monitor):
+    assert monitor.take_changes() is None
+    assert monitor.take_changes() == set()
+
+
+def test_changed_files_are_reported(tmpdir, monitor):
+    monitor.take_changes()
+    path = os.path.join(tmpdir, 'file')
+
+    with open(path, 'w') as f:
+        f.write('content')
+
+    assert path in wait_for_changes(monitor, {path})
+
+
+def test_changes_are_reported_without_waiting(tmpdir, monitor):
+    monitor.take_changes()
+    for i in range(200):
+        path = os.path.join(tmpdir, f'file{i}')
+        with open(path, 'w') as f:
+            f.write('content')
+
+        assert path in monitor.take_changes()
+
+
+def test_files_of_new_directory_are_reported(tmpdir, monitor):
+    monitor.take_changes()
+    directory = os.path.join(tmpdir, 'directory', '')
+    os.mkdir(directory)
+    assert directory in wait_for_changes(monitor, {directory})
+    path = os.path.join(directory, 'file')
+
+    with open(path, 'w') as f:
+        f.write('content')
+
+    assert path in wait_for_changes(monitor, {path})
+
+
+def test_ignored_directory_is_not_watched(tmpdir, monitor):
+    monitor.take_changes()
+    with open(os.path.join(tmpdir, 'ignored', 'file'), 'w') as f:
+        f.write('content')
+    marker = os.path.join(tmpdir, 'marker')
+    with open(marker, 'w') as f:
+        f.write('content')
+
+    assert wait_for_changes(monitor, {marker}) == {marker}
+
+
+def test_overflow_requires_full_scan(monitor):
+    monitor.take_changes()
+
+    monitor._handle_events(struct.pack('@iIII', -1, fs_monitor.IN_Q_OVERFLOW, 0, 0))
+
+    assert monitor.take_changes() is None
@@ -0,0 +1,66 @@
+import pytest
+import os
+
+from modules.index_cache import IndexCache
+from modules.cvs_objects import Blob, Tree, TreeObjectData
+
+
+@pytest.fixture()
+def file_path(tmpdir):
+    path = os.path.join(tmpdir, 'file')
+    with open(path, 'wb') as f:
+        f.write(b'content')
+
+    return path
+
+
+@pytest.fixture()
+def cache_path(tmpdir):
+    return os.path.join(tmpdir, 'cache')
+
+
+def test_store_and_load_return_the_same_entries(file_path, cache_path, tmpdir):
+    cache = IndexCache(cache_path, tmpdir)
+    cache.update_entry(file_path, os.stat(file_path), b'hash')
+    cache.staged = {TreeObjectData(file_path, Blob), TreeObjectData(os.path.join(tmpdir, 'dir', ''), Tree, True)}
+    cache.store()
+
+    loaded = IndexCache.load(cache_path, tmpdir)
+
+    assert loaded.entries == cache.entries
+    assert loaded.staged == cache.staged
+
+
+def test_get_hash_after_store_returns_cached_hash(file_path, cache_path, tmpdir):
+    cache = IndexCache(cache_path, tmpdir)
+    os.utime(file_path, ns=(0, 0))
+    cache.update_entry(file_path, os.stat(file_path), b'hash')
+    cache.store()
+
+    assert IndexCache.load(cache_path, tmpdir).get_hash(file_path, os.stat(file_path)) == b'hash'
+
+
+def test_get_hash_of_changed_file_returns_none(file_path, cache_path, tmpdir):
+    cache = IndexCache(cache_path, tmpdir)
+    os.utime(file_path, ns=(0, 0))
+    cache.update_entry(file_path, os.stat(file_path), b'hash')
+    cache.store()
+    with open(file_path, 'ab') as f:
+        f.write(b'changed')
+
+    assert cache.get_hash(file_path, os.stat(file_path)) is None
+
+
+def test_get_hash_of_file_modified_after_store_returns_none(file_path, cache_path, tmpdir):
+    cache = IndexCache(cache_path, tmpdir)
+    cache.update_entry(file_path, os.stat(file_path), b'hash')
+    cache.timestamp = os.stat(file_path).st_mtime_ns
+
+    assert cache.get_hash(file_path, os.stat(file_path)) is None
+
+
+def test_load_missing_cache_returns_empty_cache(cache_path, tmpdir):
+    cache = IndexCache.load(cache_path, tmpdir)
+
+    assert cache.entries == {}
+    assert cache.staged == set()
@@ -0,0 +1,81 @@
+import pytest
+
+from modules import instrumentation
+from modules.cvs import CVS
+from modules.cvs_objects import Blob
+from modules.storage import CVSStorage
+
+
+@pytest.fixture()
+def profile():
+    instrumentation.reset()
+    yield instrumentation.get_profile
+    instrumentation.disable()
+    instrumentation.reset()
+
+
+@pytest.fixture()
+def blob_path(tmpdir):
+    path = tmpdir.join('file')
+    path.write_binary(b'content')
+
+    return str(path)
+
+
+def test_disabled_instrumentation_records_nothing(profile, blob_path, tmpdir):
+    CVSStorage.store_blob_from_file(blob_path, tmpdir)
+
+    assert profile().counters == {}
+    assert profile().timings == {}
+
+
+def test_storage_operations_are_counted(profile, blob_path, tmpdir):
+    instrumentation.enable()
+    blob_hash = CVSStorage.store_blob_from_file(blob_path, tmpdir)
+    CVSStorage.store_blob_from_file(blob_path, tmpdir)
+    CVSStorage.read_object(blob_hash.hex(), Blob, tmpdir)
+
+    counters = profile().counters
+    assert counters['storage.stored_objects'] == 1
+    assert counters['storage.skipped_objects'] == 1
+    assert counters['storage.read_objects'] == 1
+    assert counters['storage.read_bytes'] == len(Blob(b'content').serialize())
+    assert counters['hash.bytes'] == 2 * len(b'content')
+    assert profile().timings['storage.store_blob_from_file'].calls == 2
+
+
+def test_tracing_records_nested_spans_of_cvs_methods(profile, tmpdir):
+    cvs = CVS(tmpdir)
+    cvs.initialize_repository()
+    instrumentation.enable(trace=True)
+
+    cvs.update_index()
+
+    spans = {span.name: span for span in profile().spans}
+    assert spans['CVS.update_index'].depth == 0
+    assert spans['CVS.expand_full_tree'].depth == 1
+    assert 'CVS.read_object' not in spans
+    assert profile().counters['commit_graph.ancestor_walks'] >= 1
+    assert 'spans:' in instrumentation.format_profile(profile())
+
+
+def test_spans_beyond_limit_are_dropped(profile, monkeypatch):
+    monkeypatch.setattr(instrumentation, 'MAX_SPANS', 2)
+    instrumentation.enable(trace=True)
+    traced = instrumentation.traced('function')(lambda: None)
+    for _ in range(3):
+        traced()
+
+    assert len(profile().spans) == 2
+    assert profile().dropped_spans == 1
+
+
+@pytest.mark.parametrize("value, enabled, tracing", [('', False, False), ('0', False, False),
+                                                     ('1', True, False), ('trace', True, True)])
+def test_enable_from_environment(profile, monkeypatch, value, enabled, tracing):
+    monkeypatch.setenv(instrumentation.ENVIRONMENT_VARIABLE, value)
+
+    assert instrumentation.enable_from_environment() == enabled
+    assert instrumentation.is_enabled() == enabled
+    assert instrumentation.is_tracing() == tracing
+
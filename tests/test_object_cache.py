@@ -0,0 +1,49 @@
+import pytest
+
+from modules.object_cache import ObjectCache
+from modules.cvs_objects import Blob
+
+
+@pytest.fixture()
+def cache():
+    return ObjectCache(max_size=10)
+
+
+def test_get_missing_object_counts_miss(cache):
+    assert cache.get('missing') is None
+    assert cache.misses == 1
+
+
+def test_get_stored_object_counts_hit(cache):
+    blob = Blob(b'1')
+    cache.put('1', blob, 1)
+
+    assert cache.get('1') is blob
+    assert cache.hits == 1
+
+
+def test_put_evicts_least_recently_used(cache):
+    for key in 'abc':
+        cache.put(key, Blob(key.encode()), 4)
+    cache.put('a', Blob(b'a'), 4)
+
+    assert 'a' in cache
+    assert 'b' not in cache
+    assert cache.size <= cache.max_size
+
+
+def test_get_refreshes_object(cache):
+    cache.put('a', Blob(b'a'), 4)
+    cache.put('b', Blob(b'b'), 4)
+    cache.get('a')
+    cache.put('c', Blob(b'c'), 4)
+
+    assert 'a' in cache
+    assert 'b' not in cache
+
+
+def test_put_object_larger_than_cache_is_skipped(cache):
+    cache.put('big', Blob(b'big'), 11)
+
+    assert len(cache) == 0
+    assert cache.size == 0
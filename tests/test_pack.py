@@ -0,0 +1,128 @@
+import pytest
+import os
+
+from modules.storage import CVSStorage
+from modules.pack import PackStorage
+from modules.cvs_objects import Blob
+
+
+@pytest.fixture()
+def blobs():
+    return [Blob(f'blob{i} content'.encode()) for i in range(10)]
+
+
+@pytest.fixture()
+def stored_blobs(blobs, tmpdir):
+    for blob in blobs:
+        CVSStorage.store_object(blob.get_hash().hex(), blob.serialize(), Blob, tmpdir)
+
+    return blobs
+
+
+def test_repack_moves_loose_objects(stored_blobs, tmpdir):
+    moved = CVSStorage.repack(tmpdir)
+
+    assert moved == len(stored_blobs)
+    assert list(PackStorage.enumerate_loose_objects(tmpdir)) == []
+
+
+def test_read_object_after_repack(stored_blobs, tmpdir):
+    CVSStorage.repack(tmpdir)
+
+    for blob in stored_blobs:
+        from_disk = Blob.deserialize(CVSStorage.read_object(blob.get_hash().hex(), Blob, tmpdir))
+        assert from_disk.content == blob.content
+
+
+def test_repack_appends_to_existing_pack(stored_blobs, tmpdir):
+    CVSStorage.repack(tmpdir)
+    blob = Blob(b'new content')
+    CVSStorage.store_object(blob.get_hash().hex(), blob.serialize(), Blob, tmpdir)
+
+    assert CVSStorage.repack(tmpdir) == 1
+    assert len(PackStorage.get_index(tmpdir)) == len(stored_blobs) + 1
+    for obj in stored_blobs + [blob]:
+        from_disk = Blob.deserialize(CVSStorage.read_object(obj.get_hash().hex(), Blob, tmpdir))
+        assert from_disk.content == obj.content
+
+
+def test_read_missing_object_throws(stored_blobs, tmpdir):
+    CVSStorage.repack(tmpdir)
+
+    with pytest.raises(FileNotFoundError):
+        CVSStorage.read_object(Blob(b'missing').get_hash().hex(), Blob, tmpdir)
+
+
+def test_index_is_sorted(stored_blobs, tmpdir):
+    CVSStorage.repack(tmpdir)
+    PackStorage.invalidate(tmpdir)
+
+    keys = PackStorage.get_index(tmpdir).keys
+    assert keys == sorted(keys)
+
+
+def test_repack_with_kept_objects_drops_others(stored_blobs, tmpdir):
+    CVSStorage.repack(tmpdir)
+    blob = Blob(b'new content')
+    CVSStorage.store_object(blob.get_hash().hex(), blob.serialize(), Blob, tmpdir)
+    keep = {stored_blobs[0].get_hash(), stored_blobs[1].get_hash()}
+
+    assert CVSStorage.repack(tmpdir, keep=keep) == 0
+
+    assert len(PackStorage.get_index(tmpdir)) == 2
+    assert [name for name, _ in PackStorage.enumerate_loose_objects(tmpdir)] == [blob.get_hash().hex()]
+    for kept in stored_blobs[:2]:
+        assert Blob.deserialize(CVSStorage.read_object(kept.get_hash().hex(), Blob, tmpdir)).content == kept.content
+    assert not CVSStorage.contains_object(stored_blobs[2].get_hash().hex(), tmpdir)
+
+
+def test_rewrite_writes_new_pack_and_keeps_old_views(stored_blobs, tmpdir):
+    CVSStorage.repack(tmpdir)
+    old_pack = PackStorage.get_pack_path(tmpdir)
+    name = stored_blobs[0].get_hash().hex()
+    old_view = PackStorage.read(name, tmpdir)
+    content = bytes(old_view)
+
+    CVSStorage.repack(tmpdir, keep={stored_blobs[0].get_hash()})
+
+    new_pack = PackStorage.get_pack_path(tmpdir)
+    assert new_pack != old_pack
+    assert os.path.basename(new_pack).startswith('pack-')
+    assert not os.path.exists(old_pack)
+    assert bytes(old_view) == content
+    assert bytes(PackStorage.read(name, tmpdir)) == content
+
+
+def test_read_after_pack_is_replaced_by_another_process(stored_blobs, tmpdir):
+    CVSStorage.repack(tmpdir)
+    stale_index = PackStorage.get_index(tmpdir)
+    CVSStorage.repack(tmpdir, keep={blob.get_hash() for blob in stored_blobs})
+    # as if the index was loaded before another process rewrote the pack
+    PackStorage._indexes[os.path.abspath(tmpdir)] = stale_index
+
+    for blob in stored_blobs:
+        assert Blob.deserialize(CVSStorage.read_object(blob.get_hash().hex(), Blob, tmpdir)).content == blob.content
+
+
+def test_prune_removes_packs_without_index(stored_blobs, tmpdir):
+    CVSStorage.repack(tmpdir)
+    current = PackStorage.get_pack_path(tmpdir)
+    orphan = os.path.join(PackStorage.get_pack_directory(tmpdir), 'pack-' + '0' * 40 + '.pack')
+    with open(orphan, 'wb') as f:
+        f.write(b'interrupted rewrite')
+
+    CVSStorage.prune_objects(tmpdir, set(), expire=float('inf'))
+
+    assert not os.path.exists(orphan)
+    assert os.path.exists(current)
+
+
+def test_packed_objects_keep_the_time_they_were_stored(stored_blobs, tmpdir):
+    for _, path in PackStorage.enumerate_loose_objects(tmpdir):
+        os.utime(path, (1000, 1000))
+    CVSStorage.repack(tmpdir)
+
+    CVSStorage.repack(tmpdir, keep={blob.get_hash() for blob in stored_blobs})
+    PackStorage.invalidate(tmpdir)
+
+    assert PackStorage.get_index(tmpdir).times == [1000] * len(stored_blobs)
@@ -0,0 +1,41 @@
+import os
+
+from modules.packed_refs import PackedRefs
+
+
+def test_store_and_find(tmpdir):
+    packed_refs = PackedRefs(os.path.join(tmpdir, 'packed-refs'))
+
+    packed_refs.store({'tags/b': 'bb', 'heads/master': 'aa', 'tags/a': 'cc'})
+
+    assert packed_refs.find('heads/master') == 'aa'
+    assert packed_refs.find('tags/a') == 'cc'
+    assert packed_refs.find('tags/c') is None
+    assert packed_refs.names == sorted(packed_refs.names)
+
+
+def test_get_names_by_prefix(tmpdir):
+    packed_refs = PackedRefs(os.path.join(tmpdir, 'packed-refs'))
+    packed_refs.store({'tags/b': 'bb', 'heads/master': 'aa', 'tags/a': 'cc'})
+
+    assert packed_refs.get_names('tags/') == ['a', 'b']
+    assert packed_refs.get_names('heads/') == ['master']
+
+
+def test_missing_file_has_no_refs(tmpdir):
+    packed_refs = PackedRefs(os.path.join(tmpdir, 'packed-refs'))
+
+    assert packed_refs.find('heads/master') is None
+    assert packed_refs.get_names('heads/') == []
+
+
+def test_changes_of_other_instance_are_visible(tmpdir):
+    path = os.path.join(tmpdir, 'packed-refs')
+    packed_refs = PackedRefs(path)
+    packed_refs.store({'tags/a': 'aa'})
+    assert packed_refs.find('tags/a') == 'aa'
+
+    assert PackedRefs(path).remove('tags/a')
+
+    assert packed_refs.find('tags/a') is None
+    assert not packed_refs.remove('tags/a')
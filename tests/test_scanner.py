@@ -0,0 +1,33 @@
+import pytest
+import os
+
+from modules.scanner import walk_directory, parallel_map
+from modules.cvs_objects import Blob
+
+
+@pytest.fixture()
+def directory(tmpdir):
+    for subdir in ['first', 'first/nested', 'second', 'ignored']:
+        os.makedirs(os.path.join(tmpdir, subdir))
+    for path in ['file', 'first/file', 'first/nested/file', 'ignored/file']:
+        with open(os.path.join(tmpdir, path), 'wb') as f:
+            f.write(path.encode())
+
+    return tmpdir
+
+
+def test_walk_directory_returns_all_directories_and_files(directory):
+    directories, files = walk_directory(directory, ignore={os.path.join(directory, 'ignored', '')})
+
+    assert sorted(directories) == sorted(os.path.join(directory, path, '')
+                                         for path in ['first', 'first/nested', 'second'])
+    assert sorted(path for path, _ in files) == sorted(os.path.join(directory, path)
+                                                       for path in ['file', 'first/file', 'first/nested/file'])
+
+
+@pytest.mark.parametrize("workers", [1, 2, 8])
+def test_parallel_map_matches_serial_hashing(directory, workers):
+    _, files = walk_directory(directory)
+    paths = [path for path, _ in files]
+
+    assert parallel_map(Blob.hash_file, paths, workers) == [Blob.hash_file(path) for path in paths]
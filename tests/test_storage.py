@@ -2,7 +2,7 @@ import pytest
 import os
 
 from modules.storage import CVSStorage
-from modules.cvs_objects import Blob, Tree, Commit, TreeObjectData
+from modules.cvs_objects import Blob, Tree, Commit, TreeObjectData, ChunkedBlob
 from modules.references import Tag, Branch, Head
 
 
@@ -85,3 +85,196 @@ def test_read_tree_blobsAfterStoreSameContent(tree_with_children, blob1, blob2,
 def test_store_the_same_object_dont_throws(blob1, tmpdir):
     CVSStorage.store_object(blob1.get_hash().hex(), blob1.serialize(), Blob, tmpdir)
     CVSStorage.store_object(blob1.get_hash().hex(), blob1.serialize(), Blob, tmpdir)
+
+
+@pytest.mark.parametrize("codec_name", ['none', 'zlib', 'lzma', 'bz2'])
+def test_store_blob_from_file_by_chunks(codec_name, tmpdir):
+    content = os.urandom(1000) + b'\0' * 5000
+    path = os.path.join(tmpdir, 'file')
+    with open(path, 'wb') as f:
+        f.write(content)
+    destination = os.path.join(tmpdir, 'objects')
+    CVSStorage.set_codec(destination, codec_name)
+
+    blob_hash = CVSStorage.store_blob_from_file(path, destination, chunk_size=64)
+    from_disk = Blob.deserialize(CVSStorage.read_object(blob_hash.hex(), Blob, destination))
+
+    assert blob_hash == Blob(content).get_hash()
+    assert from_disk.content == content
+
+
+@pytest.mark.parametrize("codec_name", ['none', 'zlib', 'lzma', 'bz2'])
+def test_iterate_object_yields_bounded_chunks(codec_name, tmpdir):
+    blob = Blob(b'\0' * 10000)
+    CVSStorage.set_codec(tmpdir, codec_name)
+    CVSStorage.store_object(blob.get_hash().hex(), blob.serialize(), Blob, tmpdir)
+
+    chunks = list(CVSStorage.iterate_object(blob.get_hash().hex(), tmpdir, chunk_size=100))
+
+    assert all(len(chunk) <= 100 for chunk in chunks)
+    assert b''.join(chunks) == blob.serialize()
+
+
+def test_restore_blob_to_file_from_pack(blob1, tmpdir):
+    CVSStorage.store_object(blob1.get_hash().hex(), blob1.serialize(), Blob, tmpdir)
+    CVSStorage.repack(tmpdir)
+    path = os.path.join(tmpdir, 'restored')
+
+    CVSStorage.restore_blob_to_file(blob1.get_hash().hex(), tmpdir, path, chunk_size=4)
+
+    with open(path, 'rb') as f:
+        assert f.read() == blob1.content
+
+
+def store_large_blob(content: bytes, path_to_objects):
+    blob = Blob(content)
+    CVSStorage.store_object(blob.get_hash().hex(), blob.serialize(), Blob, path_to_objects)
+
+    return blob
+
+
+def test_store_delta_keeps_object_content(tmpdir):
+    lines = [f'line {i}\n'.encode() for i in range(10000)]
+    base = store_large_blob(b''.join(lines), tmpdir)
+    lines[5000] = b'changed\n'
+    target = store_large_blob(b''.join(lines), tmpdir)
+    full_size = len(CVSStorage.read_stored_object(target.get_hash().hex(), tmpdir))
+
+    assert CVSStorage.store_delta(target.get_hash().hex(), base.get_hash().hex(), tmpdir, 10)
+
+    assert len(CVSStorage.read_stored_object(target.get_hash().hex(), tmpdir)) < full_size
+    assert CVSStorage.read_object(target.get_hash().hex(), Blob, tmpdir) == target.serialize()
+    assert b''.join(CVSStorage.iterate_object(target.get_hash().hex(), tmpdir, 1000)) == target.serialize()
+    CVSStorage.repack(tmpdir)
+    assert CVSStorage.read_object(target.get_hash().hex(), Blob, tmpdir) == target.serialize()
+
+
+def test_store_delta_limits_chain_depth(tmpdir):
+    lines = [f'line {i}\n'.encode() for i in range(1000)]
+    blobs = []
+    for i in range(4):
+        lines[i] = b'changed\n'
+        blobs.append(store_large_blob(b''.join(lines), tmpdir))
+
+    assert CVSStorage.store_delta(blobs[1].get_hash().hex(), blobs[0].get_hash().hex(), tmpdir, 2)
+    assert CVSStorage.store_delta(blobs[2].get_hash().hex(), blobs[1].get_hash().hex(), tmpdir, 2)
+    assert not CVSStorage.store_delta(blobs[3].get_hash().hex(), blobs[2].get_hash().hex(), tmpdir, 2)
+    assert not CVSStorage.store_delta(blobs[0].get_hash().hex(), blobs[2].get_hash().hex(), tmpdir, 10)
+
+
+def test_store_delta_skips_large_and_binary_blobs(tmpdir):
+    lines = [f'line {i}\n'.encode() for i in range(1000)]
+    base = store_large_blob(b''.join(lines), tmpdir)
+    lines[0] = b'changed\n'
+    target = store_large_blob(b''.join(lines), tmpdir)
+    binary_base = store_large_blob(b'\0' * 10000, tmpdir)
+    binary = store_large_blob(b'\0' * 9999 + b'\1', tmpdir)
+    manifest = ChunkedBlob([(base.get_hash(), 1)])
+    CVSStorage.store_object(manifest.get_hash().hex(), manifest.serialize(), ChunkedBlob, tmpdir)
+
+    assert not CVSStorage.store_delta(target.get_hash().hex(), base.get_hash().hex(), tmpdir, 10, max_size=1000)
+    assert not CVSStorage.store_delta(binary.get_hash().hex(), binary_base.get_hash().hex(), tmpdir, 10)
+    assert not CVSStorage.store_delta(manifest.get_hash().hex(), base.get_hash().hex(), tmpdir, 10)
+    assert CVSStorage.store_delta(target.get_hash().hex(), base.get_hash().hex(), tmpdir, 10, max_size=100000)
+
+
+def test_store_chunked_blob_from_file(tmpdir):
+    content = bytes(range(256)) * 4096
+    path = os.path.join(tmpdir, 'file')
+    with open(path, 'wb') as f:
+        f.write(content)
+    objects = os.path.join(tmpdir, 'objects')
+    CVSStorage.set_chunking_threshold(objects, 1024)
+
+    manifest_hash = CVSStorage.store_blob_from_file(path, objects)
+
+    assert manifest_hash == CVSStorage.hash_file(path, objects)
+    assert manifest_hash == ChunkedBlob.hash_file(path)
+    assert b''.join(CVSStorage.iterate_blob_content(manifest_hash.hex(), objects)) == content
+    restored_path = os.path.join(tmpdir, 'restored')
+    CVSStorage.restore_blob_to_file(manifest_hash.hex(), objects, restored_path)
+    with open(restored_path, 'rb') as f:
+        assert f.read() == content
+
+
+def test_objects_of_transaction_are_stored_on_exit(tmpdir, blob1):
+    name = blob1.get_hash().hex()
+    with CVSStorage.transaction(tmpdir):
+        CVSStorage.store_object(name, blob1.serialize(), Blob, tmpdir)
+        assert CVSStorage.contains_object(name, tmpdir)
+        assert not os.path.exists(os.path.join(tmpdir, name[:2], name[2:]))
+
+    assert CVSStorage.read_object(name, Blob, tmpdir) == blob1.serialize()
+
+
+def test_failed_transaction_leaves_no_files(tmpdir, blob1):
+    path = os.path.join(tmpdir, 'file')
+    with open(path, 'wb') as f:
+        f.write(b'content')
+
+    with pytest.raises(RuntimeError):
+        with CVSStorage.transaction(tmpdir):
+            CVSStorage.store_object(blob1.get_hash().hex(), blob1.serialize(), Blob, tmpdir)
+            CVSStorage.store_blob_from_file(path, tmpdir)
+            raise RuntimeError()
+
+    assert not CVSStorage.contains_object(blob1.get_hash().hex(), tmpdir)
+    assert [name for name in os.listdir(tmpdir) if name.startswith('tmp_')] == []
+
+
+def test_object_stored_outside_transaction_is_flushed(tmpdir, blob1, monkeypatch):
+    synced = []
+    monkeypatch.setattr('modules.storage.fsync_directory', synced.append)
+    name = blob1.get_hash().hex()
+
+    CVSStorage.store_object(name, blob1.serialize(), Blob, tmpdir)
+
+    item_directory = os.path.join(tmpdir, name[:2])
+    assert item_directory in synced
+    assert str(tmpdir) in synced
+    assert os.listdir(item_directory) == [name[2:]]
+
+
+def test_store_existing_object_does_not_rewrite_it(blob1, tmpdir):
+    name = blob1.get_hash().hex()
+    CVSStorage.store_object(name, blob1.serialize(), Blob, tmpdir)
+    path = os.path.join(tmpdir, name[:2], name[2:])
+    inode = os.stat(path).st_ino
+
+    CVSStorage.store_object(name, blob1.serialize(), Blob, tmpdir)
+    file_path = os.path.join(tmpdir, 'file')
+    with open(file_path, 'wb') as f:
+        f.write(blob1.content)
+    assert CVSStorage.store_blob_from_file(file_path, tmpdir) == blob1.get_hash()
+
+    assert os.stat(path).st_ino == inode
+    assert [name for name in os.listdir(tmpdir) if name.startswith('tmp_')] == []
+
+
+def test_known_objects_include_packed_and_new_objects(blob1, blob2, tmpdir):
+    CVSStorage.store_object(blob1.get_hash().hex(), blob1.serialize(), Blob, tmpdir)
+    CVSStorage.repack(tmpdir)
+    CVSStorage.forget_known_objects(tmpdir)
+
+    assert CVSStorage.contains_object(blob1.get_hash().hex(), tmpdir)
+    assert not CVSStorage.contains_object(blob2.get_hash().hex(), tmpdir)
+    CVSStorage.store_object(blob2.get_hash().hex(), blob2.serialize(), Blob, tmpdir)
+    assert CVSStorage.contains_object(blob2.get_hash().hex(), tmpdir)
+    CVSStorage.store_object(blob1.get_hash().hex(), blob1.serialize(), Blob, tmpdir)
+    assert not os.path.exists(os.path.join(tmpdir, blob1.get_hash().hex()[:2]))
+
+
+def test_known_objects_are_reloaded_after_gc_of_another_process(blob1, blob2, tmpdir):
+    for blob in (blob1, blob2):
+        CVSStorage.store_object(blob.get_hash().hex(), blob.serialize(), Blob, tmpdir)
+    CVSStorage.repack(tmpdir)
+    assert CVSStorage.contains_object(blob1.get_hash().hex(), tmpdir)
+    known = dict(CVSStorage._known_objects)
+
+    CVSStorage.repack(tmpdir, keep={blob2.get_hash()})
+    # the other process only changed files, this one still has its loaded set
+    CVSStorage._known_objects.update(known)
+
+    assert not CVSStorage.contains_object(blob1.get_hash().hex(), tmpdir)
+    CVSStorage.store_object(blob1.get_hash().hex(), blob1.serialize(), Blob, tmpdir)
+    assert Blob.deserialize(CVSStorage.read_object(blob1.get_hash().hex(), Blob, tmpdir)).content == blob1.content
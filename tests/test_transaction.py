@@ -0,0 +1,51 @@
+import os
+
+from modules.transaction import WriteTransaction, write_file_atomically
+
+
+def test_files_appear_on_commit(tmpdir):
+    transaction = WriteTransaction()
+    path = os.path.join(tmpdir, 'directory', 'file')
+    transaction.make_directory(os.path.dirname(path))
+
+    transaction.write_file(path, b'content', tmpdir)
+
+    assert not os.path.exists(path)
+    assert transaction.contains(path)
+    transaction.commit()
+    with open(path, 'rb') as f:
+        assert f.read() == b'content'
+    assert not transaction.contains(path)
+
+
+def test_rollback_removes_temporary_files(tmpdir):
+    transaction = WriteTransaction()
+    transaction.write_file(os.path.join(tmpdir, 'file'), b'content', tmpdir)
+
+    transaction.rollback()
+
+    assert os.listdir(tmpdir) == []
+
+
+def test_rewritten_file_keeps_last_content(tmpdir):
+    transaction = WriteTransaction()
+    path = os.path.join(tmpdir, 'file')
+    transaction.write_file(path, b'first', tmpdir)
+    transaction.write_file(path, b'second', tmpdir)
+
+    transaction.commit()
+
+    assert os.listdir(tmpdir) == ['file']
+    with open(path, 'rb') as f:
+        assert f.read() == b'second'
+
+
+def test_write_file_atomically(tmpdir):
+    path = os.path.join(tmpdir, 'file')
+    write_file_atomically(path, b'first')
+
+    write_file_atomically(path, b'second')
+
+    assert os.listdir(tmpdir) == ['file']
+    with open(path, 'rb') as f:
+        assert f.read() == b'second'
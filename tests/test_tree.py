@@ -1,4 +1,6 @@
 import os
+import hashlib
+import pickle
 import pytest
 
 from modules.cvs_objects import Tree, Blob, TreeObjectData
@@ -143,3 +145,47 @@ def build_tree_from_string(string: str):
     tree.add_object(TreeObjectData(subfolders[0], Tree), build_tree_from_string('/'.join(subfolders[1:])).get_hash())
 
     return tree
+
+
+def test_serialize_is_independent_of_insertion_order(tree_with_objects):
+    reversed_tree = Tree()
+    for data in reversed(list(tree_with_objects.children)):
+        reversed_tree.add_object(data, tree_with_objects.children[data])
+
+    assert reversed_tree.serialize() == tree_with_objects.serialize()
+    assert reversed_tree.get_hash() == tree_with_objects.get_hash()
+
+
+def test_deserialize_keeps_removed_entries(tree_with_objects):
+    tree_with_objects.add_object(TreeObjectData('removed', Blob, is_removed=True), b'')
+
+    out = Tree.deserialize(tree_with_objects.serialize())
+
+    assert out.children == tree_with_objects.children
+
+
+def test_deserialize_pickled_tree_keeps_legacy_hash(tree_with_objects):
+    legacy = pickle.dumps(tree_with_objects)
+
+    out = Tree.deserialize(legacy)
+
+    assert out.children == tree_with_objects.children
+    assert out.get_hash() == hashlib.sha1(legacy).digest()
+
+
+def test_hash_is_computed_once(tree_with_objects, monkeypatch):
+    calls = []
+    serialize = Tree.serialize
+    monkeypatch.setattr(Tree, 'serialize', lambda self: calls.append(self) or serialize(self))
+
+    tree_with_objects.get_hash()
+    tree_with_objects.get_hash()
+
+    assert len(calls) == 1
+
+
+def test_hash_changes_when_elements_removed(tree_with_objects):
+    prev_hash = tree_with_objects.get_hash()
+    del tree_with_objects.children[TreeObjectData('123', Tree)]
+
+    assert tree_with_objects.get_hash() != prev_hash